@@ -16,6 +16,17 @@ def create_app(config_name='default'):
     db.init_app(app)
     login_manager.init_app(app)
     
+    from app.rush import gateway
+    from app.seatfeed import broadcaster
+    from app.admission import admission
+    from app.ranking import refresher
+    from app.rollup import selection_buffer
+    gateway.init_app(app)
+    broadcaster.init_app(app)
+    admission.init_app(app)
+    refresher.init_app(app)
+    selection_buffer.init_app(app)
+    
     @app.errorhandler(404)
     def not_found_error(error):
         return render_template('common/404.html'), 404
@@ -32,4 +43,7 @@ def create_app(config_name='default'):
     app.register_blueprint(teacher.bp)
     app.register_blueprint(student.bp)
     
+    # 注册上课时间索引、学业概况、搜索索引、输入联想、总数统计、统计预聚合的 ORM 事件
+    from app import schedule, summary, search, typeahead, counters, rollup
+    
     return app
\ No newline at end of file
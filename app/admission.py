@@ -0,0 +1,120 @@
+"""按蓝图的并发准入控制
+
+每个蓝图（student / teacher / admin）有独立的并发上限，达到上限的请求立即返回 503 并带
+Retry-After，不在 WSGI 线程里排队等待——等待中的请求同样占着工作线程，排队只会把饱和传给其他蓝图。
+
+上限由每个进程的容量推出：容量取数据库连接池可提供的连接数（pool_size + max_overflow）与
+工作线程数（WSGI_THREADS）中较小者。教师、管理员各保留 ADMISSION_RESERVED 中的份额，
+再扣除留给登录等未受控请求与后台线程的 ADMISSION_HEADROOM，其余归学生端。
+各蓝图上限之和不超过容量，学生端饱和时教师、管理员的请求仍有线程和连接可用。
+"""
+import threading
+from sqlalchemy.pool import QueuePool
+from flask import request, g, jsonify, render_template
+from app import db
+
+
+class Limiter:
+    """并发上限，超出时直接拒绝"""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.peak = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """申请执行名额，成功返回 True"""
+        with self._lock:
+            if self.in_flight >= self.concurrency:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'in_flight': self.in_flight,
+                'peak': self.peak,
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+
+def pool_capacity(engine):
+    """连接池最多可同时借出的连接数；不限数量的连接池返回 None"""
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        overflow = pool._max_overflow
+        return None if overflow < 0 else pool.size() + overflow
+    return None
+
+
+def derive_limits(config, connections):
+    """按工作线程数与连接池容量推出各蓝图的并发上限"""
+    capacity = config['WSGI_THREADS'] if connections is None else min(config['WSGI_THREADS'], connections)
+    limits = dict(config['ADMISSION_RESERVED'])
+    limits['student'] = capacity - sum(limits.values()) - config['ADMISSION_HEADROOM']
+    limits.update(config['ADMISSION_LIMITS'])
+    if min(limits.values()) < 1 or sum(limits.values()) > capacity:
+        raise ValueError(f'并发准入上限 {limits} 与容量 {capacity}（工作线程 {config["WSGI_THREADS"]}，'
+                         f'数据库连接 {connections}）不匹配，请调整 WSGI_THREADS、连接池或 ADMISSION_RESERVED')
+    return limits
+
+
+class AdmissionController:
+    """在请求进入蓝图前申请名额，请求结束时释放"""
+
+    def __init__(self):
+        self.limiters = {}
+        self.exempt = set()
+        self.retry_after = 5
+
+    def init_app(self, app):
+        if not app.config['ADMISSION_CONTROL']:
+            return
+        with app.app_context():
+            connections = pool_capacity(db.engine)
+        self.limiters = {
+            name: Limiter(name, concurrency)
+            for name, concurrency in derive_limits(app.config, connections).items()
+        }
+        self.exempt = set(app.config['ADMISSION_EXEMPT'])
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def _admit(self):
+        limiter = self.limiters.get(request.blueprint)
+        if limiter is None or request.endpoint in self.exempt:
+            return None
+        if limiter.acquire():
+            g._admission = limiter
+            return None
+
+        headers = {'Retry-After': str(self.retry_after)}
+        if request.is_json or '/api/' in request.path or request.method != 'GET':
+            return jsonify({'success': False, 'message': '系统繁忙，请稍后再试'}), 503, headers
+        return render_template('errors/503.html', retry_after=self.retry_after), 503, headers
+
+    def _release(self, exc=None):
+        limiter = g.pop('_admission', None)
+        if limiter is not None:
+            limiter.release()
+
+    def snapshot(self):
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+
+
+admission = AdmissionController()
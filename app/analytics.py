@@ -0,0 +1,181 @@
+"""成绩分布统计
+
+对单个教学班、某课程某学期的全部教学班、某系部某学期开设的全部教学班（按授课教师所在系部），
+统计选课人数、有成绩人数、平均分、标准差、最高/最低分、及格率与分数段人数。这些聚合在数据库中
+完成；分位数（中位数等）取出总评一列后用 NumPy 计算。
+
+结果按统计范围缓存，范围内任一教学班的成绩（grades_changed）或选课人数（seats_changed）变化时失效；
+其他进程的写入由 ANALYTICS_CACHE_TTL 兜底。
+"""
+import threading
+import time
+import numpy as np
+from flask import current_app
+from sqlalchemy import case, func
+from app import db
+from app.models import Assignment, Selection, Course, Teacher
+from app.signals import grades_changed, seats_changed
+from app.transcript import USUAL_WEIGHT, FINAL_WEIGHT, PASS_GRADE
+
+PERCENTILES = (25, 50, 75, 90)
+# (标签, 下限, 上限)，与 4.0 制绩点的分数段一致
+BANDS = (('<60', None, 60), ('60-69', 60, 70), ('70-79', 70, 80), ('80-89', 80, 90), ('90-100', 90, None))
+
+
+def total_grade_expr():
+    """总评成绩的 SQL 表达式，与 Selection.total_grade 一致"""
+    usual, final = Selection.usual_grade, Selection.final_grade
+    return case((usual.is_(None), final),
+                (final.is_(None), usual),
+                else_=func.round(usual * USUAL_WEIGHT + final * FINAL_WEIGHT, 2))
+
+
+def _band(total, low, high):
+    condition = total.isnot(None)
+    if low is not None:
+        condition = condition & (total >= low)
+    if high is not None:
+        condition = condition & (total < high)
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _summarize(row, values):
+    graded = row.graded or 0
+    stats = {
+        'enrolled': row.enrolled or 0,
+        'graded': graded,
+        'mean': None, 'std': None, 'min': None, 'max': None, 'pass_rate': None,
+        'percentiles': {f'p{p}': None for p in PERCENTILES},
+        'histogram': [{'label': label, 'count': int(getattr(row, f'band_{i}') or 0)}
+                      for i, (label, _, _) in enumerate(BANDS)],
+    }
+    if graded:
+        mean = float(row.mean)
+        variance = max(float(row.mean_square) - mean * mean, 0.0)
+        stats.update({
+            'mean': round(mean, 2),
+            'std': round(variance ** 0.5, 2),
+            'min': float(row.min),
+            'max': float(row.max),
+            'pass_rate': round(int(row.passed or 0) / graded, 4),
+        })
+    if len(values):
+        stats['percentiles'] = {f'p{p}': round(float(v), 2)
+                                for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    stats['median'] = stats['percentiles']['p50']
+    return stats
+
+
+class GradeAnalytics:
+    """按统计范围缓存的成绩分布"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    # ==================== 统计范围 ====================
+    def assignment(self, assignment_id):
+        """单个教学班"""
+        return self._get(('assignment', assignment_id),
+                         [Assignment.assignment_id == assignment_id])
+
+    def course(self, course_id, academic_year, semester):
+        """某课程某学期的全部教学班，breakdown 为各教学班的统计"""
+        return self._get(('course', course_id, academic_year, semester),
+                         [Assignment.course_id == course_id,
+                          Assignment.academic_year == academic_year,
+                          Assignment.semester == semester],
+                         group_by=Assignment.assignment_id)
+
+    def department(self, dept_id, academic_year, semester):
+        """某系部某学期开设的全部教学班，breakdown 为各课程的统计"""
+        return self._get(('department', dept_id, academic_year, semester),
+                         [Teacher.dept_id == dept_id,
+                          Assignment.academic_year == academic_year,
+                          Assignment.semester == semester],
+                         group_by=Assignment.course_id)
+
+    # ==================== 缓存 ====================
+    def _get(self, key, filters, group_by=None):
+        ttl = current_app.config['ANALYTICS_CACHE_TTL']
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[2]
+
+        covered = {row[0] for row in db.session.query(Assignment.assignment_id)
+                                               .join(Teacher, Assignment.teacher_id == Teacher.teacher_id)
+                                               .filter(*filters)}
+        result = self._compute(filters, group_by)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), covered, result)
+        return result
+
+    def invalidate(self, sender=None, assignment_ids=None, **kwargs):
+        with self._lock:
+            if assignment_ids is None:
+                self._entries.clear()
+                return
+            changed = set(assignment_ids)
+            for key in [k for k, entry in self._entries.items() if entry[1] & changed]:
+                del self._entries[key]
+
+    # ==================== 计算 ====================
+    @staticmethod
+    def _compute(filters, group_by):
+        key = (group_by if group_by is not None else Assignment.assignment_id).label('group_key')
+        scoped = db.session.query(key, total_grade_expr().label('total'))\
+                           .select_from(Selection)\
+                           .join(Assignment, Selection.assignment_id == Assignment.assignment_id)\
+                           .join(Teacher, Assignment.teacher_id == Teacher.teacher_id)\
+                           .filter(*filters).subquery()
+        total = scoped.c.total
+        aggregates = [
+            func.count().label('enrolled'),
+            func.count(total).label('graded'),
+            func.avg(total).label('mean'),
+            func.avg(total * total).label('mean_square'),
+            func.min(total).label('min'),
+            func.max(total).label('max'),
+            func.sum(case((total >= PASS_GRADE, 1), else_=0)).label('passed'),
+        ] + [_band(total, low, high).label(f'band_{i}') for i, (_, low, high) in enumerate(BANDS)]
+
+        overall = db.session.query(*aggregates).one()
+        # 分位数：只取出有成绩的总评列，按分组键排序后切分
+        rows = db.session.query(scoped.c.group_key, total).filter(total.isnot(None))\
+                         .order_by(scoped.c.group_key, total).all()
+        keys = np.array([r[0] for r in rows], dtype=object)
+        values = np.array([r[1] for r in rows], dtype=float)
+
+        result = _summarize(overall, values)
+        if group_by is None:
+            return result
+
+        groups = db.session.query(scoped.c.group_key, *aggregates)\
+                           .group_by(scoped.c.group_key).order_by(scoped.c.group_key).all()
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1 if len(keys) else []
+        split = {k[0]: v for k, v in zip(np.split(keys, boundaries), np.split(values, boundaries)) if len(k)}
+        labels = _labels(group_by, [g.group_key for g in groups])
+        result['breakdown'] = [
+            dict(_summarize(group, split.get(group.group_key, values[:0])),
+                 key=group.group_key, label=labels.get(group.group_key, str(group.group_key)))
+            for group in groups
+        ]
+        return result
+
+
+def _labels(group_by, keys):
+    """分组键的显示名称：教学班显示授课教师，课程显示课程名称"""
+    if not keys:
+        return {}
+    if group_by is Assignment.assignment_id:
+        rows = db.session.query(Assignment.assignment_id, Teacher.name)\
+                         .join(Teacher, Assignment.teacher_id == Teacher.teacher_id)\
+                         .filter(Assignment.assignment_id.in_(keys))
+        return {aid: f'{name}（{aid}）' for aid, name in rows}
+    rows = db.session.query(Course.course_id, Course.course_name).filter(Course.course_id.in_(keys))
+    return dict(rows)
+
+
+analytics = GradeAnalytics()
+grades_changed.connect(analytics.invalidate, weak=False)
+seats_changed.connect(analytics.invalidate, weak=False)
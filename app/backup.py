@@ -0,0 +1,330 @@
+"""数据备份与恢复
+
+备份保存在 BACKUP_FOLDER 下，每次备份一个目录：每张表一个 gzip 压缩的 JSONL 文件（首行为列名，
+其后每行一条记录的值数组），另有 manifest.json 记录备份类型、基准备份、开始时间与各表行数。
+目录先以 .partial 后缀写入，全部完成后改名，未完成的备份不会被列出或恢复。
+
+- 一致性：全部表在同一个只读事务中读取（MySQL 为 START TRANSACTION WITH CONSISTENT SNAPSHOT），
+  各表是同一时刻的快照；查询以 stream_results 执行，逐批写入文件，内存占用与表大小无关。
+- 增量：以上一次备份为基准，只导出 updated_at 不早于基准开始时间（减去 INCREMENTAL_OVERLAP，
+  覆盖基准开始时尚未提交的事务）的行，另导出全部主键用于识别已删除的行。
+  没有 updated_at 的表（通知、候补）每次整表导出。
+- 只备份业务数据表。搜索索引、统计预聚合、学业概况、排名、上课时间段索引等派生表恢复后重新计算，
+  幂等键记录不备份。
+- 恢复：按外键依赖把表分为若干层，同一层的表各用一个连接并行写入；依次套用全量备份及其后的
+  各次增量备份，最后重建派生表。写入时关闭外键检查，所用连接来自不带连接池的专用引擎，
+  用完即断开，不会回到应用的连接池。
+  恢复会清空现有数据，只能在停止 Web 服务后用 `manage.py restore` 执行：恢复只重建本进程的
+  派生数据，其他进程内存中的缓存（总数、输入联想、选课人次缓冲等）不会随之失效。
+"""
+import base64
+import gzip
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+from flask import current_app
+from sqlalchemy import create_engine, select, delete, insert, func, tuple_, Date, DateTime, LargeBinary
+from sqlalchemy.pool import NullPool
+from app import db
+from app.models import User, Department, Teacher, Student, Course, Assignment, Selection, Preference, \
+    Waitlist, Notification
+
+CHUNK_SIZE = 5000
+INCREMENTAL_OVERLAP = timedelta(minutes=10)
+MANIFEST = 'manifest.json'
+TABLES = [model.__table__ for model in (User, Department, Teacher, Student, Course, Assignment,
+                                        Selection, Preference, Waitlist, Notification)]
+# 快照事务的开始语句，其他数据库依赖 REPEATABLE READ 隔离级别（SQLite 的事务本身即为快照）
+SNAPSHOT_STATEMENTS = {
+    'mysql': 'START TRANSACTION WITH CONSISTENT SNAPSHOT',
+    'sqlite': 'BEGIN',
+}
+
+
+# ==================== 编码 ====================
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f'无法备份的值类型: {type(value).__name__}')
+
+
+def _decoders(table, names):
+    """各列从 JSON 值还原的函数，不需要转换的列为 None"""
+    decoders = []
+    for name in names:
+        column_type = table.c[name].type if name in table.c else None
+        if isinstance(column_type, DateTime):
+            decoders.append(datetime.fromisoformat)
+        elif isinstance(column_type, Date):
+            decoders.append(date.fromisoformat)
+        elif isinstance(column_type, LargeBinary):
+            decoders.append(base64.b64decode)
+        else:
+            decoders.append(None)
+    return decoders
+
+
+def _write_rows(path, names, partitions):
+    """把分批的行写入 gzip JSONL 文件，返回行数"""
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        f.write(json.dumps(names, ensure_ascii=False) + '\n')
+        for rows in partitions:
+            f.writelines(json.dumps(list(row), default=_encode, ensure_ascii=False, separators=(',', ':')) + '\n'
+                         for row in rows)
+            count += len(rows)
+    return count
+
+
+def _read_rows(path, table):
+    """逐批读出备份文件中的记录，返回 (列名, 分批的 dict 列表)"""
+    f = gzip.open(path, 'rt', encoding='utf-8')
+    names = json.loads(f.readline())
+    decoders = _decoders(table, names)
+    # 备份之后删除的列不再写入
+    columns = [(i, name, decode) for i, (name, decode) in enumerate(zip(names, decoders)) if name in table.c]
+
+    def batches():
+        with f:
+            batch = []
+            for line in f:
+                values = json.loads(line)
+                batch.append({name: decode(values[i]) if decode and values[i] is not None else values[i]
+                              for i, name, decode in columns})
+                if len(batch) >= CHUNK_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+    return names, batches()
+
+
+# ==================== 备份 ====================
+def _folder(folder=None):
+    return folder or current_app.config['BACKUP_FOLDER']
+
+
+@contextmanager
+def _snapshot():
+    """在同一个只读快照事务中读取各表的连接"""
+    with db.engine.connect() as connection:
+        if connection.dialect.name != 'sqlite':
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        with connection.begin():
+            statement = SNAPSHOT_STATEMENTS.get(connection.dialect.name)
+            if statement:
+                connection.exec_driver_sql(statement)
+            yield connection.execution_options(stream_results=True)
+
+
+def _key_columns(table):
+    return list(table.primary_key.columns)
+
+
+def _dump(connection, table, folder, since):
+    keys = _key_columns(table)
+    query = select(table).order_by(*keys)
+    incremental = since is not None and 'updated_at' in table.c
+    if incremental:
+        query = query.where(table.c.updated_at >= since)
+    info = {
+        'file': f'{table.name}.jsonl.gz',
+        'mode': 'changed' if incremental else 'full',
+        'rows': _write_rows(os.path.join(folder, f'{table.name}.jsonl.gz'), list(table.c.keys()),
+                            connection.execute(query).partitions(CHUNK_SIZE)),
+    }
+    if incremental:
+        info['keys_file'] = f'{table.name}.keys.jsonl.gz'
+        info['keys'] = _write_rows(os.path.join(folder, info['keys_file']), [column.name for column in keys],
+                                   connection.execute(select(*keys).order_by(*keys)).partitions(CHUNK_SIZE))
+    return info
+
+
+def create(incremental=False, folder=None):
+    """做一次全量或增量备份，返回备份清单"""
+    folder = _folder(folder)
+    base = None
+    if incremental:
+        backups = list_backups(folder)
+        if not backups:
+            raise ValueError('没有可作为基准的备份，请先做一次全量备份')
+        base = backups[0]
+
+    started_at = datetime.utcnow()
+    kind = 'incremental' if incremental else 'full'
+    name = f'{started_at:%Y%m%d-%H%M%S}-{kind}'
+    partial = os.path.join(folder, name + '.partial')
+    os.makedirs(partial)
+    since = datetime.fromisoformat(base['started_at']) - INCREMENTAL_OVERLAP if base else None
+    try:
+        with _snapshot() as connection:
+            tables = {table.name: _dump(connection, table, partial, since) for table in TABLES}
+        manifest = {
+            'name': name,
+            'kind': kind,
+            'base': base['name'] if base else None,
+            'since': since.isoformat() if since else None,
+            'started_at': started_at.isoformat(),
+            'finished_at': datetime.utcnow().isoformat(),
+            'dialect': db.engine.dialect.name,
+            'tables': tables,
+        }
+        with open(os.path.join(partial, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.rename(partial, os.path.join(folder, name))
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    return manifest
+
+
+def list_backups(folder=None):
+    """已完成的备份清单，最新的在前；附带目录大小（字节）"""
+    folder = _folder(folder)
+    if not os.path.isdir(folder):
+        return []
+    backups = []
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith('.partial') or not os.path.isfile(os.path.join(path, MANIFEST)):
+            continue
+        with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest['size'] = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+        backups.append(manifest)
+    backups.sort(key=lambda manifest: manifest['started_at'], reverse=True)
+    return backups
+
+
+def _chain(name, folder):
+    """恢复 name 需要依次套用的备份：全量备份在前，name 在最后"""
+    backups = {manifest['name']: manifest for manifest in list_backups(folder)}
+    chain = []
+    while name is not None:
+        if name not in backups:
+            raise ValueError(f'找不到备份 {name}' if not chain else f'备份 {chain[-1]["name"]} 的基准备份 {name} 已不存在')
+        chain.append(backups[name])
+        name = backups[name]['base']
+    return chain[::-1]
+
+
+# ==================== 恢复 ====================
+def _levels(tables):
+    """按外键依赖分层，每层的表只依赖前面各层；循环依赖时只考虑不可为空的外键"""
+    names = {table.name for table in tables}
+
+    def depends(table, required_only=False):
+        return {fk.column.table.name for fk in table.foreign_keys
+                if not (required_only and fk.parent.nullable)} & names - {table.name}
+
+    levels, done = [], set()
+    while len(done) < len(tables):
+        remaining = [table for table in tables if table.name not in done]
+        ready = [table for table in remaining if depends(table) <= done] \
+            or [table for table in remaining if depends(table, required_only=True) <= done] \
+            or remaining
+        levels.append(ready)
+        done.update(table.name for table in ready)
+    return levels
+
+
+@contextmanager
+def _restore_engine():
+    """恢复专用的引擎：不使用连接池，关闭外键检查的会话设置随连接关闭而失效"""
+    engine = create_engine(db.engine.url, poolclass=NullPool)
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+
+
+def _relax_constraints(connection):
+    # 各表并行写入，写入顺序不保证满足外键；只用于 _restore_engine() 的连接
+    if connection.dialect.name == 'mysql':
+        connection.exec_driver_sql('SET FOREIGN_KEY_CHECKS = 0')
+
+
+def _key_filter(table, keys):
+    columns = _key_columns(table)
+    if len(columns) == 1:
+        return columns[0].in_([key[0] for key in keys])
+    return tuple_(*columns).in_(keys)
+
+
+def _apply(connection, table, folder, manifest):
+    """把一次备份中的一张表套用到数据库"""
+    info = manifest['tables'][table.name]
+    path = os.path.join(folder, manifest['name'])
+    names, batches = _read_rows(os.path.join(path, info['file']), table)
+    if info['mode'] == 'full':
+        connection.execute(delete(table))
+    keys = [column.name for column in _key_columns(table)]
+    for batch in batches:
+        if info['mode'] == 'changed':
+            connection.execute(delete(table).where(_key_filter(table, [tuple(row[k] for k in keys) for row in batch])))
+        connection.execute(insert(table), batch)
+
+    if info['mode'] == 'changed':
+        # 删除基准之后被删除的行：现有主键中不在本次备份主键清单内的
+        _, key_batches = _read_rows(os.path.join(path, info['keys_file']), table)
+        kept = {tuple(row[k] for k in keys) for batch in key_batches for row in batch}
+        existing = [tuple(row) for row in connection.execute(select(*_key_columns(table)))]
+        removed = [key for key in existing if key not in kept]
+        for i in range(0, len(removed), CHUNK_SIZE):
+            connection.execute(delete(table).where(_key_filter(table, removed[i:i + CHUNK_SIZE])))
+
+
+def _restore_table(engine, table, folder, chain):
+    with engine.connect() as connection:
+        _relax_constraints(connection)
+        with connection.begin():
+            for manifest in chain:
+                _apply(connection, table, folder, manifest)
+    return table.name
+
+
+def _rebuild_derived(workers):
+    from app import search, rollup, summary, ranking, schedule
+    from app.counters import counters
+    from app.typeahead import typeahead
+    schedule.rebuild_slot_index()
+    search.rebuild()
+    rollup.rebuild()
+    summary.rebuild(workers=workers)
+    ranking.rebuild()
+    counters.invalidate()
+    typeahead.invalidate()
+
+
+def restore(name, folder=None, workers=4, progress=None):
+    """恢复到备份 name 时的数据（清空现有数据），返回各表恢复后的行数"""
+    folder = _folder(folder)
+    chain = _chain(name, folder)
+    if chain[0]['kind'] != 'full':
+        raise ValueError(f'备份 {name} 缺少全量基准备份')
+
+    db.session.remove()
+    if db.engine.dialect.name == 'sqlite':
+        workers = 1  # SQLite 同时只允许一个连接写入
+    levels = _levels(TABLES)
+    with _restore_engine() as engine:
+        with engine.connect() as connection:
+            _relax_constraints(connection)
+            with connection.begin():
+                for level in reversed(levels):
+                    for table in level:
+                        connection.execute(delete(table))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for level in levels:
+                for table_name in pool.map(lambda table: _restore_table(engine, table, folder, chain), level):
+                    if progress:
+                        progress(table_name)
+
+    _rebuild_derived(workers)
+    return {table.name: db.session.scalar(select(func.count()).select_from(table)) for table in TABLES}
@@ -0,0 +1,74 @@
+"""选课目录快照
+
+当前学期全部教学任务（含课程、教师、已选人数）由一条联表查询得到，在进程内缓存。
+选课人数变化（seats_changed 信号）时立即失效；其他进程的写入由 CATALOG_SNAPSHOT_TTL 兜底。
+"""
+import hashlib
+import json
+import threading
+import time
+from flask import current_app
+from app import db
+from app.models import Assignment, Course, Teacher
+from app.signals import seats_changed
+
+
+class CatalogSnapshot:
+    """按学期缓存的选课目录"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, academic_year, semester):
+        """返回 (digest, rows)，digest 为目录内容摘要，用于生成 ETag"""
+        key = (academic_year, semester)
+        ttl = current_app.config['CATALOG_SNAPSHOT_TTL']
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[1], entry[2]
+
+        rows = self._load(academic_year, semester)
+        digest = hashlib.sha1(json.dumps(rows, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        with self._lock:
+            self._entries[key] = (time.monotonic(), digest, rows)
+        return digest, rows
+
+    def invalidate(self, *args, **kwargs):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _load(academic_year, semester):
+        query = db.session.query(
+            Assignment.assignment_id, Assignment.academic_year, Assignment.semester,
+            Assignment.class_time, Assignment.location,
+            Assignment.enrollment_limit, Assignment.current_enrollment,
+            Course.course_name, Course.credits, Teacher.name.label('teacher_name')
+        ).join(Course, Assignment.course_id == Course.course_id)\
+         .join(Teacher, Assignment.teacher_id == Teacher.teacher_id)\
+         .filter(Assignment.academic_year == academic_year,
+                 Assignment.semester == semester)\
+         .order_by(Assignment.assignment_id)
+
+        result = []
+        for row in query:
+            current = row.current_enrollment or 0
+            result.append({
+                'assignment_id': row.assignment_id,
+                'course_name': row.course_name,
+                'teacher_name': row.teacher_name,
+                'academic_year': row.academic_year,
+                'semester': row.semester,
+                'class_time': row.class_time,
+                'location': row.location,
+                'current_enrollment': current,
+                'enrollment_limit': row.enrollment_limit,
+                'is_full': bool(row.enrollment_limit) and current >= row.enrollment_limit,
+                'credits': row.credits or 0
+            })
+        return result
+
+
+catalog = CatalogSnapshot()
+seats_changed.connect(catalog.invalidate, weak=False)
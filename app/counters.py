@@ -0,0 +1,115 @@
+"""管理端总数统计
+
+仪表盘的各项总数由一条查询（每张表一个标量子查询）取得，在进程内缓存 COUNTERS_CACHE_TTL 秒。
+ORM 新增、删除对象时，提交后按增量调整已缓存的总数，不必等缓存过期或重新计数；绕过 ORM 的
+批量写入需调用 adjust() 登记增量。其他进程的写入由 TTL 兜底。
+
+approximate() 直接读取数据库的表统计信息（MySQL 的 information_schema.tables.table_rows），
+不扫描表，适合行数很大、只需量级的场合；其他数据库退回精确总数。
+"""
+import threading
+import time
+from collections import Counter
+from flask import current_app
+from sqlalchemy import event, select, func, text, bindparam
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Student, Teacher, Department, Course, Assignment, Selection, User
+
+COUNTERS = {
+    'students': Student,
+    'teachers': Teacher,
+    'departments': Department,
+    'courses': Course,
+    'active_assignments': Assignment,
+    'selections': Selection,
+    'users': User,
+}
+_BY_MODEL = {model: name for name, model in COUNTERS.items()}
+
+
+class Counters:
+    """缓存的各表总数"""
+
+    def __init__(self):
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """全部总数 {名称: 行数}"""
+        ttl = current_app.config['COUNTERS_CACHE_TTL']
+        entry = self._entry
+        if entry and time.monotonic() - entry[0] < ttl:
+            return dict(entry[1])
+
+        counts = self._load()
+        with self._lock:
+            self._entry = (time.monotonic(), counts)
+        return dict(counts)
+
+    def count(self, name):
+        return self.get()[name]
+
+    @staticmethod
+    def _load():
+        columns = [select(func.count()).select_from(model.__table__).scalar_subquery().label(name)
+                   for name, model in COUNTERS.items()]
+        return dict(db.session.execute(select(*columns)).one()._mapping)
+
+    def approximate(self):
+        """按表统计信息估算的总数，不支持的数据库返回精确总数"""
+        if db.session.get_bind().dialect.name != 'mysql':
+            return self.get()
+        tables = {model.__tablename__: name for name, model in COUNTERS.items()}
+        query = text('SELECT table_name, table_rows FROM information_schema.tables '
+                     'WHERE table_schema = DATABASE() AND table_name IN :tables')\
+            .bindparams(bindparam('tables', expanding=True))
+        counts = dict.fromkeys(COUNTERS, 0)
+        for table, rows in db.session.execute(query, {'tables': list(tables)}):
+            counts[tables[table]] = int(rows or 0)
+        return counts
+
+    def apply(self, deltas):
+        """按已提交的增量调整缓存"""
+        with self._lock:
+            if self._entry is None:
+                return
+            counts = dict(self._entry[1])
+            for name, delta in deltas.items():
+                counts[name] = max(counts[name] + delta, 0)
+            self._entry = (self._entry[0], counts)
+
+    def invalidate(self, *args, **kwargs):
+        with self._lock:
+            self._entry = None
+
+
+def adjust(name, delta, session=None):
+    """登记本事务内绕过 ORM 的新增（正数）或删除（负数）"""
+    session = session if session is not None else db.session()
+    session.info.setdefault('counter_deltas', Counter())[name] += delta
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+    for obj in session.new:
+        if type(obj) in _BY_MODEL:
+            adjust(_BY_MODEL[type(obj)], 1, session)
+    for obj in session.deleted:
+        if type(obj) in _BY_MODEL:
+            adjust(_BY_MODEL[type(obj)], -1, session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply(session):
+    deltas = session.info.pop('counter_deltas', None)
+    if deltas:
+        counters.apply(deltas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('counter_deltas', None)
+
+
+counters = Counters()
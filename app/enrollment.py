@@ -0,0 +1,186 @@
+from datetime import datetime
+from sqlalchemy import update, func
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Assignment, Selection, Student, Waitlist, Notification
+from app.schedule import load_masks, student_masks, EMPTY
+from app.signals import track
+
+
+# ==================== 选课名额 ====================
+def reserve_seat(assignment_id):
+    """占用一个名额
+
+    单条条件 UPDATE 完成"检查容量 + 人数加一"，由数据库行锁保证并发安全。
+    enrollment_limit 为 0 或空表示不限人数。返回 True 表示占座成功。
+    调用方需在同一事务中插入 Selection，失败时回滚即可释放名额。
+    """
+    result = db.session.execute(
+        update(Assignment)
+        .where(Assignment.assignment_id == assignment_id)
+        .where(db.or_(
+            func.coalesce(Assignment.enrollment_limit, 0) == 0,
+            func.coalesce(Assignment.current_enrollment, 0) < Assignment.enrollment_limit
+        ))
+        .values(current_enrollment=func.coalesce(Assignment.current_enrollment, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    track('seats', [assignment_id])
+    return True
+
+
+def release_seat(assignment_id):
+    """释放一个名额（退选时调用，与删除 Selection 处于同一事务）"""
+    db.session.execute(
+        update(Assignment)
+        .where(Assignment.assignment_id == assignment_id)
+        .where(Assignment.current_enrollment > 0)
+        .values(current_enrollment=Assignment.current_enrollment - 1)
+        .execution_options(synchronize_session=False)
+    )
+    track('seats', [assignment_id])
+
+
+def is_full(assignment):
+    """根据 current_enrollment 判断是否满员，O(1)"""
+    return bool(assignment.enrollment_limit) and \
+        (assignment.current_enrollment or 0) >= assignment.enrollment_limit
+
+
+# ==================== 候补队列 ====================
+WAITLIST_SCAN_LIMIT = 20
+
+
+def waitlist_position(entry):
+    """候补位次（从 1 开始）"""
+    return Waitlist.query.filter(
+        Waitlist.assignment_id == entry.assignment_id,
+        Waitlist.waitlist_id <= entry.waitlist_id
+    ).count()
+
+
+def promote_waitlist(assignment_id):
+    """名额释放后递补候补队首，与退选处于同一事务，返回被递补的 Waitlist 或 None
+
+    已选该课程的候补记录直接清除；与已选课程时间冲突的跳过，保留其位次。
+    """
+    entries = Waitlist.query.filter_by(assignment_id=assignment_id)\
+                            .order_by(Waitlist.waitlist_id)\
+                            .limit(WAITLIST_SCAN_LIMIT)\
+                            .with_for_update().all()
+    if not entries:
+        return None
+
+    assignment = Assignment.query.get(assignment_id)
+    mask = load_masks([assignment_id]).get(assignment_id, EMPTY)
+    student_ids = [e.student_id for e in entries]
+    selected = {
+        row.student_id for row in db.session.query(Selection.student_id).filter(
+            Selection.assignment_id == assignment_id,
+            Selection.student_id.in_(student_ids)
+        )
+    }
+    taken = student_masks(student_ids, assignment.academic_year, assignment.semester) if mask else {}
+
+    for entry in entries:
+        if entry.student_id in selected:
+            db.session.delete(entry)
+            continue
+        if mask.conflicts(taken.get(entry.student_id, EMPTY)):
+            continue
+        if not reserve_seat(assignment_id):
+            return None
+
+        db.session.add(Selection(
+            student_id=entry.student_id,
+            assignment_id=assignment_id,
+            selection_time=datetime.utcnow()
+        ))
+        db.session.delete(entry)
+
+        user_id = db.session.query(Student.user_id).filter_by(student_id=entry.student_id).scalar()
+        if user_id:
+            db.session.add(Notification(
+                user_id=user_id,
+                message=f'您候补的课程《{assignment.course.course_name}》已递补成功，已自动为您选课'
+            ))
+        return entry
+    return None
+
+
+# ==================== 购物车选课 ====================
+def checkout(student_id, assignment_ids):
+    """购物车一次性选课
+
+    重复、容量、时间冲突均用集合查询一次性检查，所有选课记录在调用方的同一事务中提交。
+    返回与 assignment_ids 顺序一致的结果列表，不提交事务。
+    """
+    assignment_ids = list(dict.fromkeys(assignment_ids))
+
+    assignments = {
+        a.assignment_id: a for a in Assignment.query.options(joinedload(Assignment.course))
+                                               .filter(Assignment.assignment_id.in_(assignment_ids))
+    }
+    selected = {
+        row.assignment_id for row in db.session.query(Selection.assignment_id).filter(
+            Selection.student_id == student_id,
+            Selection.assignment_id.in_(assignment_ids)
+        )
+    }
+    # 时间位图：候选课程一次读取，已选课程按学期合并
+    masks = load_masks(assignment_ids)
+    taken = {}
+    for term in {(a.academic_year, a.semester) for a in assignments.values()}:
+        taken[term] = student_masks([student_id], *term).get(student_id, EMPTY)
+
+    results = []
+    now = datetime.utcnow()
+    for assignment_id in assignment_ids:
+        assignment = assignments.get(assignment_id)
+        result = {'assignment_id': assignment_id, 'success': False}
+        results.append(result)
+
+        if not assignment:
+            result['message'] = '课程不存在'
+            continue
+        result['course_name'] = assignment.course.course_name
+
+        term = (assignment.academic_year, assignment.semester)
+        mask = masks.get(assignment_id, EMPTY)
+        if assignment_id in selected:
+            result['message'] = '您已经选择了该课程'
+        elif mask.conflicts(taken[term]):
+            result['message'] = '与已选课程上课时间冲突'
+        elif is_full(assignment) or not reserve_seat(assignment_id):
+            result['message'] = '该课程已满员'
+        else:
+            db.session.add(Selection(
+                student_id=student_id,
+                assignment_id=assignment_id,
+                selection_time=now
+            ))
+            taken[term] = taken[term] | mask
+            result['success'] = True
+            result['message'] = f'成功选择：{assignment.course.course_name}'
+
+    return results
+
+
+def sync_enrollment_counts():
+    """按 Selection 表重新校准所有教学任务的 current_enrollment，返回校准的任务数"""
+    counts = db.session.query(
+        Selection.assignment_id, func.count(Selection.selection_id)
+    ).group_by(Selection.assignment_id).all()
+    count_map = dict(counts)
+
+    fixed = 0
+    for assignment in Assignment.query.all():
+        actual = count_map.get(assignment.assignment_id, 0)
+        if assignment.current_enrollment != actual:
+            assignment.current_enrollment = actual
+            track('seats', [assignment.assignment_id])
+            fixed += 1
+    db.session.commit()
+    return fixed
@@ -0,0 +1,184 @@
+"""数据导出（学生、教师、课程、教学任务、选课与成绩）
+
+每类数据是一条按主键排序的 SELECT，列标签即导出文件的表头。查询以 yield_per 执行
+（MySQL 上为服务端游标），每次只取 CHUNK_SIZE 行：
+
+- CSV 逐批写成文本后立即发送，响应以分块传输，第一批行取到即开始下载，内存占用与表大小无关；
+- XLSX 使用 openpyxl 的只写工作簿，行写入临时文件而不在内存中保留，保存后按块读出发送。
+  xlsx 是 zip 包，必须写完才能发送，因此大表建议导出 CSV。单个工作表超过 XLSX_MAX_ROWS 行时
+  续写到新的工作表。
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from sqlalchemy import select, DateTime
+from app import db
+from app.models import Student, Teacher, Department, Course, Assignment, Selection, User
+from app.analytics import total_grade_expr
+
+CHUNK_SIZE = 2000
+XLSX_MAX_ROWS = 1048575  # Excel 单表行数上限减去表头
+
+
+def _students():
+    return select(Student.student_id.label('学号'), Student.name.label('姓名'),
+                  Student.gender.label('性别'), Student.birth_date.label('出生日期'),
+                  Student.enrollment_date.label('入学日期'), Student.dept_id.label('系部编号'),
+                  Department.dept_name.label('系部'), Student.status.label('学籍状态'),
+                  User.username.label('用户名'), User.email.label('邮箱'))\
+        .join(Department, Department.dept_id == Student.dept_id)\
+        .outerjoin(User, User.id == Student.user_id)\
+        .order_by(Student.student_id)
+
+
+def _teachers():
+    return select(Teacher.teacher_id.label('工号'), Teacher.name.label('姓名'),
+                  Teacher.gender.label('性别'), Teacher.birth_date.label('出生日期'),
+                  Teacher.hire_date.label('入职日期'), Teacher.dept_id.label('系部编号'),
+                  Department.dept_name.label('系部'), Teacher.title.label('职称'),
+                  Teacher.specialty.label('专业方向'), User.username.label('用户名'),
+                  User.email.label('邮箱'))\
+        .join(Department, Department.dept_id == Teacher.dept_id)\
+        .outerjoin(User, User.id == Teacher.user_id)\
+        .order_by(Teacher.teacher_id)
+
+
+def _courses():
+    return select(Course.course_id.label('课程编号'), Course.course_name.label('课程名称'),
+                  Course.course_type.label('课程类型'), Course.hours.label('学时'),
+                  Course.credits.label('学分'), Course.description.label('课程简介'))\
+        .order_by(Course.course_id)
+
+
+def _assignments():
+    return select(Assignment.assignment_id.label('教学任务编号'), Assignment.academic_year.label('学年'),
+                  Assignment.semester.label('学期'), Assignment.course_id.label('课程编号'),
+                  Course.course_name.label('课程名称'), Assignment.teacher_id.label('教师工号'),
+                  Teacher.name.label('教师'), Assignment.class_time.label('上课时间'),
+                  Assignment.location.label('上课地点'), Assignment.exam_time.label('考试时间'),
+                  Assignment.enrollment_limit.label('人数上限'),
+                  Assignment.current_enrollment.label('已选人数'))\
+        .join(Course, Course.course_id == Assignment.course_id)\
+        .join(Teacher, Teacher.teacher_id == Assignment.teacher_id)\
+        .order_by(Assignment.assignment_id)
+
+
+def _selections():
+    return select(Selection.selection_id.label('选课编号'), Selection.student_id.label('学号'),
+                  Student.name.label('姓名'), Student.dept_id.label('系部编号'),
+                  Assignment.academic_year.label('学年'), Assignment.semester.label('学期'),
+                  Assignment.course_id.label('课程编号'), Course.course_name.label('课程名称'),
+                  Course.credits.label('学分'), Teacher.name.label('教师'),
+                  Selection.usual_grade.label('平时成绩'), Selection.final_grade.label('期末成绩'),
+                  total_grade_expr().label('总评成绩'), Selection.selection_time.label('选课时间'),
+                  Selection.grade_time.label('成绩录入时间'))\
+        .join(Student, Student.student_id == Selection.student_id)\
+        .join(Assignment, Assignment.assignment_id == Selection.assignment_id)\
+        .join(Course, Course.course_id == Assignment.course_id)\
+        .join(Teacher, Teacher.teacher_id == Assignment.teacher_id)\
+        .order_by(Selection.selection_id)
+
+
+# 数据集 -> (名称, 查询, {筛选参数: 列})，筛选均为等值条件
+DATASETS = {
+    'students': ('学生', _students, {'dept': Student.dept_id, 'status': Student.status}),
+    'teachers': ('教师', _teachers, {'dept': Teacher.dept_id}),
+    'courses': ('课程', _courses, {'course_type': Course.course_type}),
+    'assignments': ('教学任务', _assignments, {'academic_year': Assignment.academic_year,
+                                           'semester': Assignment.semester,
+                                           'teacher': Assignment.teacher_id}),
+    'selections': ('选课与成绩', _selections, {'academic_year': Assignment.academic_year,
+                                          'semester': Assignment.semester,
+                                          'dept': Student.dept_id,
+                                          'course': Assignment.course_id}),
+}
+FILTER_LABELS = {
+    'dept': '系部', 'status': '学籍状态', 'course_type': '课程类型', 'academic_year': '学年',
+    'semester': '学期', 'teacher': '教师工号', 'course': '课程编号',
+}
+
+
+def _execute(dataset, args):
+    """执行导出查询，返回 (各列, 按 CHUNK_SIZE 分批的行)"""
+    title, build, filters = DATASETS[dataset]
+    query = build()
+    for param, column in filters.items():
+        value = (args.get(param) or '').strip()
+        if value:
+            query = query.where(column == value)
+    # yield_per 同时启用 stream_results；不指定时 ORM 会先取回全部行
+    result = db.session.execute(query.execution_options(yield_per=CHUNK_SIZE))
+    return list(query.selected_columns), result.partitions()
+
+
+def _format_times(row, positions):
+    values = list(row)
+    for i in positions:
+        if values[i] is not None:
+            values[i] = values[i].strftime('%Y-%m-%d %H:%M:%S')
+    return values
+
+
+def _cell(value):
+    # 工作表 XML 中不允许出现控制字符
+    return ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value
+
+
+def csv_chunks(dataset, args):
+    """逐批生成 CSV（UTF-8 带 BOM，Excel 可直接打开）"""
+    columns, partitions = _execute(dataset, args)
+    # 空值写为空串、日期写为 ISO 格式由 csv 模块完成，只有时间戳需要去掉微秒
+    times = [i for i, column in enumerate(columns) if isinstance(column.type, DateTime)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in columns])
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+    for rows in partitions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_format_times(row, times) for row in rows] if times else rows)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def xlsx_chunks(dataset, args, block_size=64 * 1024):
+    """写入只写工作簿，完成后按块生成 xlsx 文件内容"""
+    title = DATASETS[dataset][0]
+    columns, partitions = _execute(dataset, args)
+    headers = [column.name for column in columns]
+    workbook = Workbook(write_only=True)
+    sheets = 0
+    written = XLSX_MAX_ROWS
+    for rows in partitions:
+        for row in rows:
+            if written >= XLSX_MAX_ROWS:
+                sheets += 1
+                sheet = workbook.create_sheet(title if sheets == 1 else f'{title}({sheets})')
+                sheet.append(headers)
+                written = 0
+            sheet.append([_cell(value) for value in row])
+            written += 1
+    if not sheets:
+        workbook.create_sheet(title).append(headers)
+
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+# 格式 -> (生成器, MIME 类型)
+FORMATS = {
+    'csv': (csv_chunks, 'text/csv; charset=utf-8'),
+    'xlsx': (xlsx_chunks, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def filename(dataset, fmt):
+    return f'{dataset}_{datetime.now():%Y%m%d%H%M%S}.{fmt}'
@@ -51,7 +51,8 @@ class TeacherForm(FlaskForm):
 class DepartmentForm(FlaskForm):
     dept_id = StringField('系号', validators=[DataRequired(), Length(max=20)])
     dept_name = StringField('系名称', validators=[DataRequired(), Length(max=50)])
-    dean_id = SelectField('系主任', coerce=str, validators=[Optional()])
+    # 选项由前端按输入查询（见 app.typeahead），提交的值在视图中校验
+    dean_id = SelectField('系主任', coerce=str, validators=[Optional()], validate_choice=False)
     phone = StringField('联系电话', validators=[Optional(), Length(max=20)])
     description = TextAreaField('系简介', validators=[Optional()])
     submit = SubmitField('保存')
@@ -66,8 +67,9 @@ class CourseForm(FlaskForm):
     submit = SubmitField('保存')
 
 class AssignmentForm(FlaskForm):
-    course_id = SelectField('课程', coerce=str, validators=[DataRequired()])
-    teacher_id = SelectField('授课教师', coerce=str, validators=[DataRequired()])
+    # 选项由前端按输入查询（见 app.typeahead），提交的值在视图中校验
+    course_id = SelectField('课程', coerce=str, validators=[DataRequired()], validate_choice=False)
+    teacher_id = SelectField('授课教师', coerce=str, validators=[DataRequired()], validate_choice=False)
     academic_year = StringField('学年', validators=[DataRequired(), Length(max=20)])
     semester = SelectField('学期', choices=[('1', '第一学期'), ('2', '第二学期'), ('3', '夏季学期')], validators=[DataRequired()])
     class_time = StringField('上课时间', validators=[Optional(), Length(max=100)])
@@ -0,0 +1,254 @@
+"""成绩批量导入与增量保存
+
+教师上传的 .xlsx/.csv 成绩表直接从上传流读入 DataFrame，整表向量化校验（学号是否属于本班、
+是否重复、成绩是否为 0-100 的数字），与现有成绩比对后只把有变化的行用一条 executemany
+UPDATE 写回。成绩录入页的表单提交也走同一流程。成绩单元格留空表示保持原成绩不变，
+与表单录入的行为一致。
+
+成绩录入页的自动保存只提交改动过的单元格（apply_delta），每行带上读取时的
+grade_version，版本不一致的行不写入而作为冲突返回，避免多人同时录入时互相覆盖。
+"""
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import update, bindparam
+from app import db
+from app.models import Selection, Student
+from app.summary import mark_dirty
+from app.signals import track
+
+# 列名 -> 可接受的表头
+COLUMNS = {
+    'student_id': ('学号', 'student_id'),
+    'usual_grade': ('平时成绩', 'usual_grade'),
+    'final_grade': ('期末成绩', 'final_grade'),
+}
+GRADE_FIELDS = ('usual_grade', 'final_grade')
+GRADE_LABELS = {'usual_grade': '平时成绩', 'final_grade': '期末成绩'}
+TEMPLATE_HEADERS = ['学号', '姓名', '平时成绩', '期末成绩']
+
+
+def read_sheet(stream, filename, max_rows):
+    """读取上传的成绩表，返回含 row、student_id 及成绩列（均为字符串）的 DataFrame"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    options = {'dtype': str, 'keep_default_na': False, 'nrows': max_rows + 1}
+    if extension == 'csv':
+        sheet = pd.read_csv(stream, encoding='utf-8-sig', **options)
+    elif extension in ('xlsx', 'xlsm'):
+        sheet = pd.read_excel(stream, engine='openpyxl', **options)
+    else:
+        raise ValueError('仅支持 .xlsx 或 .csv 格式的成绩表')
+
+    if len(sheet) > max_rows:
+        raise ValueError(f'成绩表超过 {max_rows} 行，请分批导入')
+
+    headers = {str(name).strip(): name for name in sheet.columns}
+    renamed = {}
+    for field, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in headers:
+                renamed[headers[alias]] = field
+                break
+    if 'student_id' not in renamed.values():
+        raise ValueError('成绩表缺少"学号"列')
+    if not set(GRADE_FIELDS) & set(renamed.values()):
+        raise ValueError('成绩表缺少"平时成绩"或"期末成绩"列')
+
+    sheet = sheet.rename(columns=renamed)
+    result = pd.DataFrame({'row': np.arange(len(sheet)) + 2})  # 第 1 行为表头
+    for field in COLUMNS:
+        result[field] = sheet[field].astype(str).to_numpy() if field in sheet else ''
+    return result
+
+
+def form_sheet(selections, form):
+    """把成绩录入页的表单转换为与 read_sheet 相同结构的 DataFrame"""
+    return pd.DataFrame({
+        'row': np.arange(len(selections)) + 1,
+        'student_id': [s.student_id for s in selections],
+        'usual_grade': [form.get(f'usual_grade_{s.selection_id}', '') for s in selections],
+        'final_grade': [form.get(f'final_grade_{s.selection_id}', '') for s in selections],
+    })
+
+
+def current_grades(assignment_id):
+    rows = db.session.query(Selection.selection_id, Selection.student_id,
+                            Selection.usual_grade, Selection.final_grade)\
+                     .filter(Selection.assignment_id == assignment_id).all()
+    current = pd.DataFrame.from_records(rows, columns=['selection_id', 'student_id'] + list(GRADE_FIELDS))
+    for field in GRADE_FIELDS:
+        current[field] = current[field].astype(float)
+    return current
+
+
+def plan(sheet, current):
+    """校验并比对，返回 (changes, errors, unchanged)
+
+    changes 为待写入的行（selection_id、student_id 与新成绩），errors 为逐行错误。
+    """
+    student_ids = sheet['student_id'].str.strip()
+    raw = {field: sheet[field].str.strip() for field in GRADE_FIELDS}
+    values = {field: pd.to_numeric(raw[field].replace('', np.nan), errors='coerce') for field in GRADE_FIELDS}
+
+    no_id = student_ids == ''
+    empty = no_id & np.logical_and.reduce([raw[f] == '' for f in GRADE_FIELDS])
+    checks = [(no_id & ~empty, '缺少学号'),
+              (~no_id & ~student_ids.isin(current['student_id']), '该学生未选修本课程'),
+              (~no_id & student_ids.duplicated(keep=False), '学号重复')]
+    for field, label in GRADE_LABELS.items():
+        checks.append(((raw[field] != '') & values[field].isna(), f'{label}不是数字'))
+        checks.append((values[field].notna() & ~values[field].between(0, 100), f'{label}必须在0-100之间'))
+
+    errors = []
+    invalid = pd.Series(False, index=sheet.index)
+    for mask, message in checks:
+        invalid |= mask
+        for row, student_id in zip(sheet.loc[mask, 'row'], student_ids[mask]):
+            errors.append({'row': int(row), 'student_id': student_id, 'message': message})
+    errors.sort(key=lambda e: e['row'])
+
+    valid = ~invalid & ~empty
+    incoming = pd.DataFrame({'student_id': student_ids[valid]})
+    for field in GRADE_FIELDS:
+        incoming[field] = values[field][valid]
+    merged = incoming.merge(current, on='student_id', suffixes=('', '_current'))
+
+    changed = pd.Series(False, index=merged.index)
+    for field in GRADE_FIELDS:
+        new, old = merged[field], merged[f'{field}_current']
+        changed |= new.notna() & ~(new == old)
+        merged[field] = new.where(new.notna(), old)
+
+    changes = merged.loc[changed, ['selection_id', 'student_id'] + list(GRADE_FIELDS)]
+    changes = changes.astype(object).where(changes.notna(), None)
+    return changes.to_dict('records'), errors, int((~changed).sum())
+
+
+def apply(assignment_id, changes):
+    """把 plan() 得到的变更用一条 executemany UPDATE 写回（不提交）"""
+    if not changes:
+        return 0
+    now = datetime.utcnow()
+    table = Selection.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.selection_id == bindparam('b_selection_id'))
+        .values(usual_grade=bindparam('b_usual_grade'),
+                final_grade=bindparam('b_final_grade'),
+                grade_version=table.c.grade_version + 1,
+                grade_time=now),
+        [{'b_selection_id': c['selection_id'], 'b_usual_grade': c['usual_grade'],
+          'b_final_grade': c['final_grade']} for c in changes]
+    )
+    mark_dirty(c['student_id'] for c in changes)
+    track('grades', [assignment_id])
+    return len(changes)
+
+
+def import_grades(assignment_id, sheet):
+    """校验、比对并写入一个教学班的成绩；有错误时不写入任何行
+
+    返回 {'rows', 'updated', 'unchanged', 'errors'}，由调用方提交事务。
+    """
+    changes, errors, unchanged = plan(sheet, current_grades(assignment_id))
+    updated = 0 if errors else apply(assignment_id, changes)
+    return {'rows': len(sheet), 'updated': updated, 'unchanged': unchanged, 'errors': errors}
+
+
+def _state(selection_id, version, usual_grade, final_grade, message=None):
+    state = {
+        'selection_id': selection_id,
+        'version': version,
+        'usual_grade': usual_grade,
+        'final_grade': final_grade,
+        'total_grade': Selection(usual_grade=usual_grade, final_grade=final_grade).total_grade
+    }
+    if message:
+        state['message'] = message
+    return state
+
+
+def _is_grade(value):
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value <= 100)
+
+
+def apply_delta(assignment_id, cells):
+    """按单元格增量修改一个教学班的成绩（不提交）
+
+    cells 为 [{'selection_id', 'version', 'usual_grade'?, 'final_grade'?}]，只需包含改动过的成绩列，
+    null 表示清空。返回 {'updated', 'conflicts', 'errors'}：updated 为已保存（或无变化）行的最新状态，
+    conflicts 为版本不一致、未写入的行及其当前值。
+    """
+    errors, requested = [], {}
+    for cell in cells:
+        selection_id = cell.get('selection_id') if isinstance(cell, dict) else None
+        if not isinstance(selection_id, int) or not isinstance(cell.get('version'), int):
+            errors.append({'selection_id': selection_id, 'message': '缺少 selection_id 或 version'})
+            continue
+        fields = {field: cell[field] for field in GRADE_FIELDS if field in cell}
+        if not fields:
+            errors.append({'selection_id': selection_id, 'message': '没有需要保存的成绩'})
+        elif selection_id in requested:
+            errors.append({'selection_id': selection_id, 'message': '同一学生的成绩重复提交'})
+        elif not all(_is_grade(value) for value in fields.values()):
+            bad = next(field for field, value in fields.items() if not _is_grade(value))
+            errors.append({'selection_id': selection_id, 'message': f'{GRADE_LABELS[bad]}必须是0-100之间的数字'})
+        else:
+            requested[selection_id] = (cell['version'], fields)
+
+    result = {'updated': [], 'conflicts': [], 'errors': errors}
+    if not requested:
+        return result
+
+    # 锁定涉及的行，版本比较与写入之间不会被其他事务插入修改
+    rows = {
+        row.selection_id: row for row in db.session.query(
+            Selection.selection_id, Selection.student_id, Selection.usual_grade,
+            Selection.final_grade, Selection.grade_version
+        ).filter(Selection.assignment_id == assignment_id,
+                 Selection.selection_id.in_(list(requested))).with_for_update()
+    }
+
+    params, students = [], []
+    for selection_id, (version, fields) in requested.items():
+        row = rows.get(selection_id)
+        if row is None:
+            errors.append({'selection_id': selection_id, 'message': '该学生未选修本课程'})
+            continue
+        if row.grade_version != version:
+            result['conflicts'].append(_state(selection_id, row.grade_version, row.usual_grade,
+                                              row.final_grade, '成绩已被他人修改，请确认后重新保存'))
+            continue
+        new = {field: fields.get(field, getattr(row, field)) for field in GRADE_FIELDS}
+        if all(new[field] == getattr(row, field) for field in GRADE_FIELDS):
+            result['updated'].append(_state(selection_id, version, row.usual_grade, row.final_grade))
+            continue
+        params.append({'b_selection_id': selection_id, 'b_version': version,
+                       'b_usual_grade': new['usual_grade'], 'b_final_grade': new['final_grade']})
+        students.append(row.student_id)
+        result['updated'].append(_state(selection_id, version + 1, new['usual_grade'], new['final_grade']))
+
+    if params:
+        table = Selection.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.selection_id == bindparam('b_selection_id'))
+            .where(table.c.grade_version == bindparam('b_version'))
+            .values(usual_grade=bindparam('b_usual_grade'),
+                    final_grade=bindparam('b_final_grade'),
+                    grade_version=table.c.grade_version + 1,
+                    grade_time=datetime.utcnow()),
+            params
+        )
+        mark_dirty(students)
+        track('grades', [assignment_id])
+    return result
+
+
+def roster_template(assignment_id):
+    """成绩导入模板：本班学生名单与现有成绩"""
+    rows = db.session.query(Selection.student_id, Student.name, Selection.usual_grade, Selection.final_grade)\
+                     .join(Student, Selection.student_id == Student.student_id)\
+                     .filter(Selection.assignment_id == assignment_id)\
+                     .order_by(Selection.student_id).all()
+    return pd.DataFrame.from_records(rows, columns=TEMPLATE_HEADERS)
@@ -0,0 +1,148 @@
+"""写请求幂等键
+
+客户端在 POST 请求头中携带 Idempotency-Key，同一用户同一键的首次响应被保存
+（进程内 LRU + 数据库），有效期内的重试直接返回保存的响应，不再执行业务逻辑。
+请求指纹包含方法、路径、查询参数与请求体，同一个键用于内容不同的请求时返回 422。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, current_app, jsonify, make_response
+from flask_login import current_user
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 64
+_WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class IdempotencyStore:
+    """进程内 LRU，未命中时回退到数据库"""
+
+    def __init__(self):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # 同一进程内相同键的并发重试串行执行：(user_id, key) -> [锁, 使用者数]
+        self._key_locks = {}
+
+    @contextmanager
+    def key_lock(self, user_id, key):
+        """持有 (user_id, key) 专用的锁，不同的键互不等待；无人使用时锁即被丢弃"""
+        with self._lock:
+            entry = self._key_locks.setdefault((user_id, key), [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[(user_id, key)]
+
+    def get(self, user_id, key):
+        """返回 (fingerprint, status_code, content_type, location, body) 或 None"""
+        ttl = current_app.config['IDEMPOTENCY_TTL']
+        with self._lock:
+            entry = self._cache.get((user_id, key))
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._cache.move_to_end((user_id, key))
+                    return entry[1]
+                del self._cache[(user_id, key)]
+
+        record = IdempotencyRecord.query.filter_by(user_id=user_id, key=key).first()
+        if record is None or record.created_at < datetime.utcnow() - timedelta(seconds=ttl):
+            return None
+        value = (record.fingerprint, record.status_code, record.content_type, record.location, record.body)
+        remaining = ttl - (datetime.utcnow() - record.created_at).total_seconds()
+        self._remember(user_id, key, value, remaining)
+        return value
+
+    def put(self, user_id, key, value):
+        """保存响应；记录用单独的连接写入并提交，不影响调用方会话中的事务"""
+        self._remember(user_id, key, value, current_app.config['IDEMPOTENCY_TTL'])
+        fingerprint, status_code, content_type, location, body = value
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(insert(IdempotencyRecord.__table__).values(
+                    user_id=user_id, key=key, fingerprint=fingerprint, status_code=status_code,
+                    content_type=content_type, location=location, body=body
+                ))
+        except IntegrityError:
+            pass  # 其他进程已保存了同一键的响应
+
+    def _remember(self, user_id, key, value, ttl):
+        with self._lock:
+            self._cache[(user_id, key)] = (time.monotonic() + ttl, value)
+            self._cache.move_to_end((user_id, key))
+            while len(self._cache) > current_app.config['IDEMPOTENCY_LRU_SIZE']:
+                self._cache.popitem(last=False)
+
+
+store = IdempotencyStore()
+
+
+def _replay(value):
+    _, status_code, content_type, location, body = value
+    response = current_app.response_class(body, status=status_code, content_type=content_type)
+    if location:
+        response.headers['Location'] = location
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _fingerprint():
+    """请求指纹：方法、路径、查询参数与请求体（表单按字段排序，其他类型取原始内容）"""
+    digest = hashlib.sha1(f'{request.method} {request.full_path}'.encode('utf-8'))
+    # 表单请求体被解析到 request.form，此时 get_data 返回空；其他请求体缓存后视图仍可读取
+    body = request.get_data(cache=True, parse_form_data=True)
+    for name, value in sorted(request.form.items(multi=True)):
+        digest.update(f'\n{name}={value}'.encode('utf-8'))
+    digest.update(b'\n' + body)
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """为写请求启用幂等键"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or request.method not in _WRITE_METHODS or not current_user.is_authenticated:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'success': False, 'message': '幂等键过长'}), 400
+
+        fingerprint = _fingerprint()
+        user_id = current_user.id
+
+        with store.key_lock(user_id, key):
+            cached = store.get(user_id, key)
+            if cached is not None:
+                if cached[0] != fingerprint:
+                    return jsonify({'success': False, 'message': '幂等键已用于其他请求'}), 422
+                return _replay(cached)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code < 500 and not response.is_streamed:
+                store.put(user_id, key, (fingerprint, response.status_code, response.content_type,
+                                         response.headers.get('Location'), response.get_data()))
+            return response
+
+    return wrapper
+
+
+def purge_expired():
+    """删除过期的幂等记录，返回删除条数"""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+    deleted = IdempotencyRecord.query.filter(IdempotencyRecord.created_at < cutoff)\
+                                     .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,293 @@
+"""新生批量导入
+
+上传的 .xlsx/.csv 学生名单分三步处理：
+
+1. 读取：CSV 由 pandas 按 CHUNK_SIZE 行分块读入，xlsx 用 openpyxl 只读模式逐行读取后分块，
+   整个文件不会一次载入内存；
+2. 校验：每块在 DataFrame 上整列校验（必填、长度、性别、学籍状态、日期格式、系部是否存在、
+   学号是否与库中或本文件中已有的重复），系部、已有学号、用户名、邮箱在导入开始时各取一次；
+3. 写入：每块的用户账号与学生各用一条 executemany INSERT 写入，用户编号按用户名回查一次。
+
+账号口令（DEFAULT_PASSWORD）的散列有两种方式，由调用方用 workers 明确选择：
+
+- workers 为进程数（`manage.py import-students --workers`）：每个账号各自加盐散列，由
+  app.passwords 的进程池计算，下一块校验、本块散列与上一块写库同时进行；
+- workers 为 None（Web 上传）：全部账号共用导入开始时算出的一个散列，请求内只做一次 PBKDF2。
+  这些账号的散列字符串相同，大名单应在服务器上用命令行导入。
+
+绕过 ORM 写入，因此同时登记搜索索引、总数统计、统计预聚合与输入联想的变更。
+默认整批导入：任一行有错时不写入任何记录，只报告错误；skip_invalid=True 时跳过错误行，
+其余照常导入。调用方负责提交事务。
+"""
+from contextlib import nullcontext
+from datetime import datetime
+from collections import Counter
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+from app import db, search, rollup
+from app.models import User, Student, Department
+from app.counters import adjust
+from app.passwords import PasswordHasher
+from app.signals import track
+
+CHUNK_SIZE = 1000
+DEFAULT_PASSWORD = '123456'
+EMAIL_DOMAIN = 'school.edu'
+
+# 列名 -> 可接受的表头
+COLUMNS = {
+    'student_id': ('学号', 'student_id'),
+    'name': ('姓名', 'name'),
+    'gender': ('性别', 'gender'),
+    'birth_date': ('出生日期', 'birth_date'),
+    'enrollment_date': ('入学日期', 'enrollment_date'),
+    'dept_id': ('系部', '系部编号', 'dept_id'),
+    'status': ('学籍状态', 'status'),
+}
+LABELS = {field: aliases[0] for field, aliases in COLUMNS.items()}
+REQUIRED = ('student_id', 'name', 'enrollment_date', 'dept_id')
+TEMPLATE_HEADERS = ['学号', '姓名', '性别', '出生日期', '入学日期', '系部', '学籍状态']
+GENDERS = ('男', '女')
+STATUSES = ('在籍', '毕业', '休学', '退学')
+MAX_LENGTH = {'student_id': 20, 'name': 20}
+
+
+# ==================== 读取 ====================
+def _rename(headers):
+    """表头 -> 字段名，缺少必填列时报错"""
+    positions = {str(name).strip(): i for i, name in enumerate(headers) if name is not None}
+    fields = {}
+    for field, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in positions:
+                fields[field] = positions[alias]
+                break
+    missing = [LABELS[field] for field in REQUIRED if field not in fields]
+    if missing:
+        raise ValueError(f'名单缺少列：{"、".join(missing)}')
+    return fields
+
+
+def _frame(rows, fields, first_row):
+    """按字段取出一块行，所有值为去除首尾空白的字符串"""
+    frame = pd.DataFrame({'row': np.arange(first_row, first_row + len(rows))})
+    for field in COLUMNS:
+        if field in fields:
+            i = fields[field]
+            frame[field] = pd.Series([row[i] if i < len(row) else '' for row in rows], dtype=str).str.strip()
+        else:
+            frame[field] = ''
+    return frame
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # Excel 把纯数字学号存为数值
+    return str(value)
+
+
+def _read_csv(stream, chunk_size):
+    reader = pd.read_csv(stream, encoding='utf-8-sig', dtype=str, keep_default_na=False,
+                         header=None, chunksize=chunk_size)
+    fields, row = None, 1
+    for chunk in reader:
+        rows = chunk.values.tolist()
+        if fields is None:
+            fields, rows = _rename(rows[0]), rows[1:]
+            row = 2
+        if rows:
+            yield _frame(rows, fields, row)
+            row += len(rows)
+
+
+def _read_xlsx(stream, chunk_size):
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        fields = _rename(header)
+        batch, row = [], 2
+        for values in rows:
+            if not any(value not in (None, '') for value in values):
+                continue
+            batch.append([_cell(value) for value in values])
+            if len(batch) >= chunk_size:
+                yield _frame(batch, fields, row)
+                row += len(batch)
+                batch = []
+        if batch:
+            yield _frame(batch, fields, row)
+    finally:
+        workbook.close()
+
+
+def read_batches(stream, filename, chunk_size=CHUNK_SIZE):
+    """逐块读取上传的学生名单，生成含 row 及各字段（字符串）的 DataFrame"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'csv':
+        return _read_csv(stream, chunk_size)
+    if extension in ('xlsx', 'xlsm'):
+        return _read_xlsx(stream, chunk_size)
+    raise ValueError('仅支持 .xlsx 或 .csv 格式的学生名单')
+
+
+# ==================== 校验与写入 ====================
+def _dates(series):
+    return pd.to_datetime(series.str.replace('/', '-', regex=False), format='%Y-%m-%d', errors='coerce')
+
+
+class StudentImport:
+    """一次导入：缓存系部与已占用的学号、用户名、邮箱，逐块校验并写入"""
+
+    def __init__(self, skip_invalid=False, workers=None):
+        self.skip_invalid = skip_invalid
+        self.workers = workers
+        self.departments = {}
+        for dept_id, dept_name in db.session.execute(select(Department.dept_id, Department.dept_name)):
+            self.departments.setdefault(dept_name, dept_id)
+            self.departments[dept_id] = dept_id
+        self.taken = set(db.session.scalars(select(Student.student_id)))
+        self.taken.update(db.session.scalars(select(User.username)))
+        self.emails = set(db.session.scalars(select(User.email)))
+        self.password_hash = generate_password_hash(DEFAULT_PASSWORD) if workers is None else None
+        self.rows = 0
+        self.imported = 0
+        self.errors = []
+
+    def validate(self, batch):
+        """整块校验，返回通过校验的行（dept_id 已换成系部编号、日期已解析）"""
+        batch = batch.copy()
+        problems = []  # (行掩码, 错误信息)
+        for field in REQUIRED:
+            problems.append((batch[field] == '', f'{LABELS[field]}不能为空'))
+        for field, length in MAX_LENGTH.items():
+            problems.append((batch[field].str.len() > length, f'{LABELS[field]}不能超过 {length} 个字符'))
+        problems.append((~batch['gender'].isin(GENDERS + ('',)), '性别只能为"男"或"女"'))
+
+        batch['status'] = batch['status'].replace('', STATUSES[0])
+        problems.append((~batch['status'].isin(STATUSES), f'学籍状态只能为{"、".join(STATUSES)}'))
+
+        for field in ('enrollment_date', 'birth_date'):
+            parsed = _dates(batch[field])
+            problems.append((parsed.isna() & (batch[field] != ''), f'{LABELS[field]}格式应为 YYYY-MM-DD'))
+            batch[field] = parsed
+
+        dept_ids = batch['dept_id'].map(self.departments)
+        problems.append((dept_ids.isna() & (batch['dept_id'] != ''), '系部不存在'))
+        batch['dept_id'] = dept_ids
+
+        ids = batch['student_id']
+        problems.append((ids.isin(self.taken) & (ids != ''), '学号已存在'))
+        problems.append((ids.duplicated() & (ids != ''), '学号在名单中重复'))
+        emails = ids + '@' + EMAIL_DOMAIN
+        problems.append((emails.isin(self.emails) & ~ids.isin(self.taken), '默认邮箱已被其他账号使用'))
+
+        invalid = np.zeros(len(batch), dtype=bool)
+        messages = {}
+        for mask, message in problems:
+            mask = mask.to_numpy(dtype=bool)
+            invalid |= mask
+            for i in np.flatnonzero(mask):
+                messages.setdefault(i, []).append(message)
+        for i in sorted(messages):
+            self.errors.append({
+                'row': int(batch['row'].iat[i]),
+                'student_id': batch['student_id'].iat[i],
+                'message': '；'.join(messages[i])
+            })
+
+        # 后续各块的重复检查包含本块的学号（无论本块是否写入）
+        self.taken.update(ids[ids != ''])
+        return batch[~invalid]
+
+    def insert(self, valid, hashes):
+        """写入一块已校验的学生及其用户账号，hashes 为与各行对应的口令散列"""
+        if valid.empty:
+            return
+        now = datetime.utcnow()
+        students = valid.to_dict('records')
+        db.session.execute(insert(User.__table__), [{
+            'username': s['student_id'],
+            'email': f"{s['student_id']}@{EMAIL_DOMAIN}",
+            'password_hash': password_hash,
+            'role': 'student',
+            'is_active': True,
+            'created_at': now,
+            'updated_at': now,
+        } for s, password_hash in zip(students, hashes)])
+        user_ids = dict(db.session.execute(select(User.username, User.id)
+                                           .where(User.username.in_(valid['student_id'].tolist()))).all())
+        db.session.execute(insert(Student.__table__), [{
+            'student_id': s['student_id'],
+            'user_id': user_ids[s['student_id']],
+            'name': s['name'],
+            'gender': s['gender'] or None,
+            'birth_date': s['birth_date'].date() if not pd.isna(s['birth_date']) else None,
+            'enrollment_date': s['enrollment_date'].date(),
+            'dept_id': s['dept_id'],
+            'status': s['status'],
+            'created_at': now,
+            'updated_at': now,
+        } for s in students])
+
+        search.reindex('student', [(s['student_id'], s['student_id'], s['name']) for s in students])
+        search.reindex('user', [(user_ids[s['student_id']], s['student_id'], f"{s['student_id']}@{EMAIL_DOMAIN}")
+                                for s in students])
+        rollup.add_students(Counter((s['dept_id'], s['enrollment_date'].year) for s in students))
+        adjust('students', len(students))
+        adjust('users', len(students))
+        self.emails.update(f"{s['student_id']}@{EMAIL_DOMAIN}" for s in students)
+        self.imported += len(students)
+
+    def run(self, batches, progress=None):
+        """逐块校验、写入；progress(已读行数, 已导入行数) 在每块处理后调用"""
+        pending = None
+        with (PasswordHasher(self.workers) if self.workers is not None else nullcontext()) as hasher:
+            for batch in batches:
+                self.rows += len(batch)
+                valid = self.validate(batch)
+                # 整批导入时出现错误后只继续校验，收集全部错误
+                accepting = self.skip_invalid or not self.errors
+                if pending and accepting:
+                    self.insert(*pending)
+                pending = (valid, self._hashes(hasher, len(valid))) if accepting else None
+                if progress:
+                    progress(self.rows, self.imported)
+            if pending:
+                self.insert(*pending)
+        if self.imported:
+            track('directory', ['student'])
+        return self.result()
+
+    def _hashes(self, hasher, count):
+        """一块账号的口令散列：使用进程池时调用即开始计算，写库时按需等待"""
+        if hasher is None:
+            return [self.password_hash] * count
+        return hasher.map([DEFAULT_PASSWORD] * count)
+
+    def result(self):
+        committed = self.skip_invalid or not self.errors
+        return {'rows': self.rows, 'imported': self.imported if committed else 0, 'errors': self.errors}
+
+
+def import_students(stream, filename, skip_invalid=False, progress=None, workers=None):
+    """导入学生名单，返回 {'rows', 'imported', 'errors'}；不提交事务
+
+    workers 为 None 时全部账号共用一个口令散列，否则用 workers 个进程为每个账号各自加盐散列。
+    """
+    return StudentImport(skip_invalid, workers).run(read_batches(stream, filename), progress)
+
+
+def template():
+    """导入模板（CSV，含一行示例）"""
+    example = ['2024010001', '张三', '男', '2006-05-01', '2024-09-01', 'CS', '在籍']
+    return pd.DataFrame([example], columns=TEMPLATE_HEADERS).to_csv(index=False).encode('utf-8-sig')
@@ -0,0 +1,210 @@
+"""志愿抽签分配
+
+热门选修课不再"先到先得"：学生在志愿征集期内提交排序后的志愿，征集结束后由
+`manage.py allocate-lottery` 对某学期的全部志愿一次性分配。
+
+分配规则为随机序列独裁（random serial dictatorship）：用随机种子给全体学生生成优先级，
+分若干轮进行，每轮每名学生至多分得一门课程，优先级高的学生先得到其志愿中排名最前、
+仍有余量且与已得课程不冲突的教学班。
+
+每轮内部用"学生按志愿提议、课程按优先级保留"的迭代实现：在所有学生共用同一优先级时，
+其结果与逐个学生依次挑选完全相同，但每次迭代都是对整个志愿数组的 NumPy 向量运算。
+"""
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import insert, update, bindparam, func
+
+from app import db
+from app.models import Assignment, Selection, Preference, AssignmentSlot
+from app.schedule import PERIODS_PER_DAY
+from app.signals import track
+from app.summary import add_courses
+from app.counters import adjust
+from app.rollup import add_selections
+
+CHUNK_SIZE = 5000
+_LOW_BITS = (1 << 64) - 1
+
+
+def _term_assignments(academic_year, semester):
+    """读取并锁定学期内所有教学任务，返回 {assignment_id: (course_id, 余量)}"""
+    rows = db.session.query(
+        Assignment.assignment_id, Assignment.course_id,
+        Assignment.enrollment_limit, Assignment.current_enrollment
+    ).filter(Assignment.academic_year == academic_year,
+             Assignment.semester == semester).with_for_update().all()
+    return {
+        row.assignment_id: (row.course_id,
+                            max((row.enrollment_limit or 0) - (row.current_enrollment or 0), 0)
+                            if row.enrollment_limit else None)
+        for row in rows
+    }
+
+
+def _term_slot_bits(academic_year, semester):
+    """学期内各教学任务的上课时间位图（不区分周次），拆成高低两个 uint64 便于向量运算"""
+    bits = {}
+    rows = db.session.query(AssignmentSlot.assignment_id, AssignmentSlot.weekday, AssignmentSlot.period_mask)\
+                     .join(Assignment, Assignment.assignment_id == AssignmentSlot.assignment_id)\
+                     .filter(Assignment.academic_year == academic_year,
+                             Assignment.semester == semester)
+    for assignment_id, weekday, period_mask in rows:
+        bits[assignment_id] = bits.get(assignment_id, 0) | (period_mask << (weekday * PERIODS_PER_DAY))
+    return bits
+
+
+def _split(values):
+    lo = np.array([v & _LOW_BITS for v in values], dtype=np.uint64)
+    hi = np.array([v >> 64 for v in values], dtype=np.uint64)
+    return lo, hi
+
+
+def _run_round(stu, asg, row_priority, cap, available):
+    """单轮分配，返回本轮获得课程的志愿行下标（每名学生至多一行）"""
+    n_students = stu.max() + 1
+    held = np.zeros(len(stu), dtype=bool)
+
+    while True:
+        has_held = np.zeros(n_students, dtype=bool)
+        has_held[stu[held]] = True
+        candidates = np.flatnonzero(available & ~has_held[stu])
+        if len(candidates) == 0:
+            break
+
+        # 志愿数组已按 (学生, 志愿排名) 排序，取每名学生排名最前的可用志愿
+        _, first = np.unique(stu[candidates], return_index=True)
+        proposals = candidates[first]
+        available[proposals] = False
+
+        # 已保留者与新提议者一起按 (教学任务, 优先级) 排序，组内名次小于余量者保留
+        pool = np.concatenate([np.flatnonzero(held), proposals])
+        pool = pool[np.lexsort((row_priority[pool], asg[pool]))]
+        groups = asg[pool]
+        starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+        sizes = np.diff(np.r_[starts, len(pool)])
+        rank_in_group = np.arange(len(pool)) - np.repeat(starts, sizes)
+
+        held[:] = False
+        held[pool[rank_in_group < cap[groups]]] = True
+
+    return np.flatnonzero(held)
+
+
+def allocate(academic_year, semester, seed, max_courses=None, dry_run=False):
+    """对指定学期的全部志愿进行抽签分配，返回统计信息
+
+    max_courses 为每名学生本次最多分得的课程数，默认不限（以志愿数为上限）。
+    同一课程的多个教学班至多分得一个；与已选或已分得课程时间重叠的志愿自动跳过
+    （按星期、节次判断，不区分单双周）。dry_run 为 True 时只计算不写库。
+    """
+    started = time.perf_counter()
+    term_assignments = _term_assignments(academic_year, semester)
+
+    prefs = db.session.query(Preference.student_id, Preference.assignment_id, Preference.rank)\
+                      .join(Assignment, Assignment.assignment_id == Preference.assignment_id)\
+                      .filter(Assignment.academic_year == academic_year,
+                              Assignment.semester == semester).all()
+    stats = {'preferences': len(prefs), 'students': 0, 'allocated': 0,
+             'unallocated_students': 0, 'rounds': 0}
+    if not prefs:
+        db.session.rollback()
+        stats['elapsed'] = time.perf_counter() - started
+        return stats
+
+    # ---------- 编码为整数数组 ----------
+    students, stu = np.unique(np.array([p.student_id for p in prefs], dtype=object), return_inverse=True)
+    assignments, asg = np.unique(np.array([p.assignment_id for p in prefs], dtype=np.int64), return_inverse=True)
+    ranks = np.array([p.rank for p in prefs], dtype=np.int64)
+
+    order = np.lexsort((ranks, stu))
+    stu, asg = stu[order].astype(np.int64), asg[order].astype(np.int64)
+    n_rows, n_students = len(stu), len(students)
+
+    unlimited = n_rows + 1
+    cap = np.array([term_assignments[a][1] if term_assignments[a][1] is not None else unlimited
+                    for a in assignments.tolist()], dtype=np.int64)
+    courses, course_of = np.unique(np.array([term_assignments[a][0] for a in assignments.tolist()],
+                                            dtype=object), return_inverse=True)
+    course = course_of[asg].astype(np.int64)
+
+    slot_bits = _term_slot_bits(academic_year, semester)
+    asg_lo, asg_hi = _split([slot_bits.get(a, 0) for a in assignments.tolist()])
+    lo, hi = asg_lo[asg], asg_hi[asg]
+
+    # ---------- 学期内已有选课：排除同课程志愿，并计入时间占用 ----------
+    student_index = {s: i for i, s in enumerate(students.tolist())}
+    course_index = {c: i for i, c in enumerate(courses.tolist())}
+    stu_bits = [0] * n_students
+    taken_keys = []
+    existing = db.session.query(Selection.student_id, Selection.assignment_id, Assignment.course_id)\
+                         .join(Assignment, Assignment.assignment_id == Selection.assignment_id)\
+                         .filter(Assignment.academic_year == academic_year,
+                                 Assignment.semester == semester)
+    for student_id, assignment_id, course_id in existing:
+        i = student_index.get(student_id)
+        if i is None:
+            continue
+        stu_bits[i] |= slot_bits.get(assignment_id, 0)
+        if course_id in course_index:
+            taken_keys.append(i * len(courses) + course_index[course_id])
+    stu_lo, stu_hi = _split(stu_bits)
+
+    keys = stu * len(courses) + course
+    available = ~np.isin(keys, np.array(taken_keys, dtype=np.int64))
+    available &= ((lo & stu_lo[stu]) | (hi & stu_hi[stu])) == 0
+
+    # ---------- 随机优先级，数值越小越优先 ----------
+    priority = np.random.default_rng(seed).permutation(n_students)
+    row_priority = priority[stu]
+
+    rounds = max_courses or int(np.bincount(stu).max())
+    won = []
+    for _ in range(rounds):
+        accepted = _run_round(stu, asg, row_priority, cap, available)
+        if len(accepted) == 0:
+            break
+        stats['rounds'] += 1
+        won.append(accepted)
+
+        cap -= np.bincount(asg[accepted], minlength=len(cap))
+        available &= ~np.isin(keys, keys[accepted])
+        stu_lo[stu[accepted]] |= lo[accepted]
+        stu_hi[stu[accepted]] |= hi[accepted]
+        available &= ((lo & stu_lo[stu]) | (hi & stu_hi[stu])) == 0
+
+    won = np.concatenate(won) if won else np.array([], dtype=np.int64)
+    stats['students'] = n_students
+    stats['allocated'] = len(won)
+    stats['unallocated_students'] = n_students - len(np.unique(stu[won]))
+
+    if dry_run or len(won) == 0:
+        db.session.rollback()
+        stats['elapsed'] = time.perf_counter() - started
+        return stats
+
+    # ---------- 批量写入 ----------
+    now = datetime.utcnow()
+    rows = [{'student_id': s, 'assignment_id': a, 'selection_time': now}
+            for s, a in zip(students[stu[won]].tolist(), assignments[asg[won]].tolist())]
+    for i in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(insert(Selection.__table__), rows[i:i + CHUNK_SIZE])
+
+    filled = np.bincount(asg[won], minlength=len(assignments))
+    table = Assignment.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.assignment_id == bindparam('aid'))
+        .values(current_enrollment=func.coalesce(table.c.current_enrollment, 0) + bindparam('filled')),
+        [{'aid': a, 'filled': n} for a, n in zip(assignments.tolist(), filled.tolist()) if n]
+    )
+    track('seats', assignments[filled > 0].tolist())
+    add_courses(Counter((row['student_id'], row['assignment_id']) for row in rows))
+    adjust('selections', len(rows))
+    add_selections({a: n for a, n in zip(assignments.tolist(), filled.tolist()) if n})
+    db.session.commit()
+
+    stats['elapsed'] = time.perf_counter() - started
+    return stats
@@ -68,6 +68,11 @@ class Teacher(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        # 管理端列表的键集分页
+        db.Index('ix_teacher_hire_date', 'hire_date', 'teacher_id'),
+    )
+    
     assignments = db.relationship('Assignment', back_populates='teacher', cascade='all, delete-orphan')
     department = db.relationship('Department', 
                                 back_populates='teachers', 
@@ -89,6 +94,12 @@ class Student(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        # 管理端列表的键集分页（全部 / 按系部筛选）
+        db.Index('ix_student_enrollment', 'enrollment_date', 'student_id'),
+        db.Index('ix_student_dept_enrollment', 'dept_id', 'enrollment_date', 'student_id'),
+    )
+    
     selections = db.relationship('Selection', 
                                 back_populates='student', 
                                 cascade='all, delete-orphan',
@@ -136,6 +147,7 @@ class Assignment(db.Model):
     __table_args__ = (
         db.UniqueConstraint('course_id', 'teacher_id', 'academic_year', 'semester', 
                           name='uq_assignment_course_teacher_year_semester'),
+        db.Index('ix_assignment_term', 'academic_year', 'semester', 'assignment_id'),
     )
     
     course = db.relationship('Course', 
@@ -147,10 +159,27 @@ class Assignment(db.Model):
     selections = db.relationship('Selection', 
                                 back_populates='assignment', 
                                 cascade='all, delete-orphan')
+    slots = db.relationship('AssignmentSlot', 
+                           back_populates='assignment', 
+                           cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Assignment {self.assignment_id}>'
 
+class AssignmentSlot(db.Model):
+    """上课时间索引，由 Assignment.class_time 解析得到（见 app.schedule）"""
+    __tablename__ = 'assignment_slot'
+    slot_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.assignment_id'), nullable=False, index=True)
+    weekday = db.Column(db.SmallInteger, nullable=False)
+    period_mask = db.Column(db.Integer, nullable=False)
+    week_mask = db.Column(db.Integer, nullable=False)
+    
+    assignment = db.relationship('Assignment', back_populates='slots')
+    
+    def __repr__(self):
+        return f'<AssignmentSlot {self.assignment_id}:{self.weekday}>'
+
 class Selection(db.Model):
     __tablename__ = 'selection'
     selection_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -160,6 +189,8 @@ class Selection(db.Model):
     final_grade = db.Column(db.Float)
     selection_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     grade_time = db.Column(db.DateTime)
+    # 成绩版本号，每次修改成绩加 1，用于检测并发修改
+    grade_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -186,4 +217,181 @@ class Selection(db.Model):
             return round(self.usual_grade * 0.3 + self.final_grade * 0.7, 2)
     
     def __repr__(self):
-        return f'<Selection {self.selection_id}>'
\ No newline at end of file
+        return f'<Selection {self.selection_id}>'
+
+class Waitlist(db.Model):
+    __tablename__ = 'waitlist'
+    waitlist_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    student_id = db.Column(db.String(20), db.ForeignKey('student.student_id'), nullable=False)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.assignment_id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'assignment_id', name='uq_waitlist_student_assignment'),
+        db.Index('ix_waitlist_assignment_order', 'assignment_id', 'waitlist_id'),
+    )
+    
+    student = db.relationship('Student')
+    assignment = db.relationship('Assignment')
+    
+    def __repr__(self):
+        return f'<Waitlist {self.waitlist_id}>'
+
+class Notification(db.Model):
+    __tablename__ = 'notification'
+    notification_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    message = db.Column(db.String(255), nullable=False)
+    is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Notification {self.notification_id}>'
+
+class Preference(db.Model):
+    """选课志愿（抽签分配用），rank 越小越优先"""
+    __tablename__ = 'preference'
+    preference_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    student_id = db.Column(db.String(20), db.ForeignKey('student.student_id'), nullable=False)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.assignment_id'), nullable=False, index=True)
+    rank = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'assignment_id', name='uq_preference_student_assignment'),
+    )
+    
+    student = db.relationship('Student')
+    assignment = db.relationship('Assignment')
+    
+    def __repr__(self):
+        return f'<Preference {self.student_id}:{self.rank}>'
+
+class IdempotencyRecord(db.Model):
+    """幂等键对应的首次响应（见 app.idempotency）"""
+    __tablename__ = 'idempotency_record'
+    record_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    fingerprint = db.Column(db.String(40), nullable=False)
+    status_code = db.Column(db.SmallInteger, nullable=False)
+    content_type = db.Column(db.String(100))
+    location = db.Column(db.String(255))
+    body = db.Column(db.LargeBinary)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_user_key'),
+    )
+    
+    def __repr__(self):
+        return f'<IdempotencyRecord {self.key}>'
+
+class StudentSummary(db.Model):
+    """学生学业概况读模型（见 app.summary）"""
+    __tablename__ = 'student_summary'
+    student_id = db.Column(db.String(20), db.ForeignKey('student.student_id', ondelete='CASCADE'), primary_key=True)
+    total_courses = db.Column(db.Integer, nullable=False, default=0)
+    graded_courses = db.Column(db.Integer, nullable=False, default=0)
+    passed_courses = db.Column(db.Integer, nullable=False, default=0)
+    total_credits = db.Column(db.Float, nullable=False, default=0.0)
+    graded_credits = db.Column(db.Float, nullable=False, default=0.0)
+    grade_points = db.Column(db.Float, nullable=False, default=0.0)
+    gpa = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    student = db.relationship('Student', 
+                             backref=db.backref('summary', uselist=False, cascade='all, delete-orphan', passive_deletes=True))
+    
+    def __repr__(self):
+        return f'<StudentSummary {self.student_id}>'
+
+class StudentTermSummary(db.Model):
+    """学生分学期学业概况（见 app.summary）"""
+    __tablename__ = 'student_term_summary'
+    student_id = db.Column(db.String(20), db.ForeignKey('student.student_id', ondelete='CASCADE'), primary_key=True)
+    academic_year = db.Column(db.String(20), primary_key=True)
+    semester = db.Column(db.String(10), primary_key=True)
+    total_courses = db.Column(db.Integer, nullable=False, default=0)
+    graded_courses = db.Column(db.Integer, nullable=False, default=0)
+    passed_courses = db.Column(db.Integer, nullable=False, default=0)
+    total_credits = db.Column(db.Float, nullable=False, default=0.0)
+    graded_credits = db.Column(db.Float, nullable=False, default=0.0)
+    grade_points = db.Column(db.Float, nullable=False, default=0.0)
+    gpa = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    student = db.relationship('Student', 
+                             backref=db.backref('term_summaries', cascade='all, delete-orphan', passive_deletes=True))
+    
+    def __repr__(self):
+        return f'<StudentTermSummary {self.student_id}:{self.academic_year}-{self.semester}>'
+
+class CohortRank(db.Model):
+    """学生在系部+入学年份内的 GPA 排名（见 app.ranking）"""
+    __tablename__ = 'cohort_rank'
+    student_id = db.Column(db.String(20), db.ForeignKey('student.student_id', ondelete='CASCADE'), primary_key=True)
+    dept_id = db.Column(db.String(20), nullable=False)
+    enrollment_year = db.Column(db.Integer, nullable=False)
+    gpa = db.Column(db.Float, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    cohort_size = db.Column(db.Integer, nullable=False)
+    percentile = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_cohort_rank_cohort', 'dept_id', 'enrollment_year', 'rank'),
+    )
+    
+    def __repr__(self):
+        return f'<CohortRank {self.student_id}:{self.rank}>'
+
+class CohortStatus(db.Model):
+    """排名分组状态，dirty 表示组内有成绩变化、排名待重算"""
+    __tablename__ = 'cohort_status'
+    dept_id = db.Column(db.String(20), primary_key=True)
+    enrollment_year = db.Column(db.Integer, primary_key=True)
+    dirty = db.Column(db.Boolean, nullable=False, default=True)
+    refreshed_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<CohortStatus {self.dept_id}:{self.enrollment_year}>'
+
+class SearchToken(db.Model):
+    """搜索索引词元（见 app.search）"""
+    __tablename__ = 'search_token'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entity = db.Column(db.String(10), nullable=False)
+    token = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.String(20), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_search_token_lookup', 'entity', 'token', 'entity_id'),
+        db.Index('ix_search_token_entity', 'entity', 'entity_id'),
+    )
+    
+    def __repr__(self):
+        return f'<SearchToken {self.entity}:{self.token}>'
+
+class DepartmentRollup(db.Model):
+    """各系部、各入学年份的学生人数（见 app.rollup）"""
+    __tablename__ = 'dept_rollup'
+    dept_id = db.Column(db.String(20), primary_key=True)
+    enrollment_year = db.Column(db.Integer, primary_key=True)
+    student_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DepartmentRollup {self.dept_id}:{self.enrollment_year}>'
+
+class CourseTermRollup(db.Model):
+    """各课程、各学期的教学班数与选课人次（见 app.rollup）"""
+    __tablename__ = 'course_term_rollup'
+    course_id = db.Column(db.String(20), primary_key=True)
+    academic_year = db.Column(db.String(20), primary_key=True)
+    semester = db.Column(db.String(10), primary_key=True)
+    assignment_count = db.Column(db.Integer, nullable=False, default=0)
+    selection_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<CourseTermRollup {self.course_id}:{self.academic_year}-{self.semester}>'
@@ -0,0 +1,162 @@
+"""键集（seek）分页与列表筛选
+
+列表按一组有索引的排序键排序（最后一个键必须唯一，通常为主键），翻页时以上一页最后一行
+（或第一行）的键值为游标，用 WHERE 条件直接定位，不使用 OFFSET，翻到任何位置查询代价都相同。
+游标为排序键值的 base64 JSON 编码，通过 after / before 查询参数传递。
+
+总数是可选的：按筛选条件缓存 ADMIN_COUNT_CACHE_TTL 秒，只用于"约 N 条"之类的提示。
+"""
+import base64
+import binascii
+import json
+import threading
+import time
+from datetime import date, datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+
+class Page:
+    """一页数据及前后页游标"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def filter_query(query, filters, args=None):
+    """按请求参数依次套用筛选器，返回 (query, 生效的筛选值)
+
+    filters 为 {参数名: builder(query, value) -> query}，参数为空时跳过。
+    """
+    args = request.args if args is None else args
+    active = {}
+    for name, builder in filters.items():
+        value = (args.get(name) or '').strip()
+        if value:
+            query = builder(query, value)
+            active[name] = value
+    return query, active
+
+
+def equals(column):
+    """筛选器：列等于参数值"""
+    return lambda query, value: query.filter(column == value)
+
+
+def _encode(values):
+    data = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode(token, keys):
+    """解析游标，格式不对时返回 None（回到第一页）"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw.decode('utf-8'))
+        if not isinstance(data, list) or len(data) != len(keys):
+            return None
+        values = []
+        for (column, _), value in zip(keys, data):
+            python_type = column.type.python_type
+            if value is not None and python_type in (date, datetime):
+                value = python_type.fromisoformat(value)
+            values.append(value)
+        return values
+    except (binascii.Error, ValueError, UnicodeDecodeError, NotImplementedError):
+        return None
+
+
+def _seek(keys, values, forward):
+    """列表顺序中位于游标之后（forward）或之前的行"""
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        less = descending == forward
+        condition = column < values[i] if less else column > values[i]
+        clauses.append(and_(*[keys[j][0] == values[j] for j in range(i)], condition))
+    return or_(*clauses)
+
+
+def _ordering(keys, reverse=False):
+    return [column.asc() if descending == reverse else column.desc() for column, descending in keys]
+
+
+def paginate(query, keys, per_page=None, after=None, before=None):
+    """键集分页
+
+    keys 为 [(排序列, 是否降序)]，最后一列须唯一；after / before 默认取自请求参数。
+    """
+    per_page = per_page or current_app.config['ITEMS_PER_PAGE']
+    if after is None and before is None:
+        after, before = request.args.get('after'), request.args.get('before')
+    cursor = _decode(before, keys) if before else _decode(after, keys) if after else None
+    backward = bool(before) and cursor is not None
+
+    if cursor is not None:
+        query = query.filter(_seek(keys, cursor, forward=not backward))
+    rows = query.order_by(*_ordering(keys, reverse=backward)).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backward:
+        rows.reverse()
+
+    def cursor_of(item):
+        return _encode([getattr(item, column.key) for column, _ in keys])
+
+    has_next = more if not backward else True
+    has_prev = cursor is not None and (more if backward else True)
+    return Page(rows, per_page,
+                next_cursor=cursor_of(rows[-1]) if rows and has_next else None,
+                prev_cursor=cursor_of(rows[0]) if rows and has_prev else None)
+
+
+class CountCache:
+    """列表总数缓存"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, query):
+        ttl = current_app.config['ADMIN_COUNT_CACHE_TTL']
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        total = query.order_by(None).count()
+        with self._lock:
+            if len(self._entries) > 1000:
+                self._entries.clear()
+            self._entries[key] = (time.monotonic(), total)
+        return total
+
+    def invalidate(self, prefix=None):
+        with self._lock:
+            if prefix is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == prefix]:
+                    del self._entries[key]
+
+
+counts = CountCache()
+
+
+def paginate_list(name, query, keys, filters):
+    """管理端列表：套用筛选、键集分页，并按配置附带缓存的总数，返回 (page, 生效的筛选值)"""
+    query, active = filter_query(query, filters)
+    page = paginate(query, keys)
+    if current_app.config['ADMIN_LIST_COUNTS']:
+        page.total = counts.get((name, tuple(sorted(active.items()))), query)
+    return page, active
@@ -0,0 +1,85 @@
+"""批量口令散列
+
+werkzeug 的 generate_password_hash（PBKDF2，迭代次数很多）每个口令要花费数十到数百毫秒 CPU。
+批量导入学生、批量重置口令时由 PasswordHasher 把散列分发到进程池，按提交顺序取回结果，
+调用方可以边取边写库；总耗时随 CPU 核数下降。每个账号的散列各自加盐，即使口令相同散列也不同。
+
+进程池由命令行（manage.py import-students --workers、manage.py reset-passwords）使用，
+不在 Web 请求中启动：成千上万次散列不应占用 Web 工作进程（Web 上传的名单见 app.intake）。
+子进程以 spawn 方式启动，不复制父进程的线程、锁与数据库连接，只做散列。
+workers 为 1 或口令很少时在本进程内计算。
+"""
+import multiprocessing
+import os
+import secrets
+import string
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy import update, bindparam
+from werkzeug.security import generate_password_hash
+from app import db
+from app.models import User
+
+# 少于该数量的口令不值得分发到进程池
+PARALLEL_THRESHOLD = 8
+# 每次分发给一个进程的口令数
+DISPATCH_SIZE = 16
+CHUNK_SIZE = 500
+ALPHABET = string.ascii_letters + string.digits
+
+
+class PasswordHasher:
+    """进程池口令散列，在 with 块内使用"""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _executor(self):
+        if self._pool is None:
+            context = multiprocessing.get_context('spawn')
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._pool
+
+    def map(self, passwords):
+        """按顺序生成各口令的散列；使用进程池时调用即开始计算，迭代时按需等待"""
+        passwords = list(passwords)
+        if self.workers <= 1 or len(passwords) < PARALLEL_THRESHOLD:
+            return map(generate_password_hash, passwords)
+        return self._executor().map(generate_password_hash, passwords, chunksize=DISPATCH_SIZE)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+def hash_many(passwords, workers=None):
+    """一次性散列一批口令，返回列表"""
+    with PasswordHasher(workers) as hasher:
+        return list(hasher.map(passwords))
+
+
+def generate_password(length=10):
+    """随机初始口令（字母与数字）"""
+    return ''.join(secrets.choice(ALPHABET) for _ in range(length))
+
+
+def reset_passwords(user_ids, passwords, workers=None, chunk_size=CHUNK_SIZE):
+    """把 user_ids 的口令依次改为 passwords，散列按块取回后即写库（不提交），返回更新的账号数"""
+    statement = update(User.__table__).where(User.__table__.c.id == bindparam('uid'))\
+        .values(password_hash=bindparam('hashed'), updated_at=bindparam('now'))
+    user_ids = list(user_ids)
+    with PasswordHasher(workers) as hasher:
+        hashes = iter(hasher.map(passwords))
+        for i in range(0, len(user_ids), chunk_size):
+            now = datetime.utcnow()
+            db.session.execute(statement, [{'uid': user_id, 'hashed': next(hashes), 'now': now}
+                                           for user_id in user_ids[i:i + chunk_size]])
+    return len(user_ids)
@@ -0,0 +1,200 @@
+"""同系部、同年级学生的 GPA 排名
+
+按（系部, 入学年份）分组。app.transcript 一次算出组内全部学生的 GPA，pandas 按组计算
+密集排名（GPA 相同名次相同）和百分位（组内 GPA 不高于本人的比例），写入 cohort_rank，
+查询时按主键读取。只有已出成绩的学生参与排名。
+
+学生 GPA 变化时，app.summary 在同一事务内调用 mark_dirty()，以 UPSERT 把学生所在分组标记为待重算。
+读取排名只按主键读 cohort_rank，不在请求中重算：首次读取时启动本进程的后台线程，每隔
+RANKING_REFRESH_INTERVAL 秒重算各个已标记的分组，同一分组在一个间隔内的多次成绩变化只重算一次。
+各进程的线程以分组状态行的行锁互斥，同一分组不会被重复计算；`manage.py refresh-rankings`
+可在没有读取请求的进程中（如定时任务）执行同样的重算。
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import insert, delete, update, extract
+from app import db, transcript
+from app.models import Student, CohortRank, CohortStatus
+from app.upsert import upsert
+
+COHORT_KEYS = ['dept_id', 'enrollment_year']
+RANK_COLUMNS = ['student_id', 'dept_id', 'enrollment_year', 'gpa', 'rank', 'cohort_size', 'percentile']
+CHUNK_SIZE = 5000
+
+
+def _students(*filters, session=None):
+    session = session if session is not None else db.session()
+    rows = session.query(Student.student_id, Student.dept_id,
+                         extract('year', Student.enrollment_date)).filter(*filters).all()
+    frame = pd.DataFrame.from_records(rows, columns=['student_id'] + COHORT_KEYS)
+    frame['enrollment_year'] = frame['enrollment_year'].astype(int)
+    return frame
+
+
+def compute(students, all_students=False):
+    """计算 students（student_id, dept_id, enrollment_year）在各自分组内的排名，返回 cohort_rank 行
+
+    all_students 为 True 时一次读取全部选课记录，否则只读取 students 的记录。
+    """
+    if students.empty:
+        return []
+    selections = transcript.load(None if all_students else students['student_id'].tolist())
+    summary = transcript.summarize(transcript.compute(selections))
+
+    ranked = students.join(summary[['gpa', 'graded_courses']], on='student_id', how='inner')
+    ranked = ranked[ranked['graded_courses'] > 0].copy()
+    if ranked.empty:
+        return []
+    ranked['gpa'] = ranked['gpa'].astype(float)
+    grouped = ranked.groupby(COHORT_KEYS)['gpa']
+    ranked['rank'] = grouped.rank(method='dense', ascending=False).astype(int)
+    ranked['percentile'] = (grouped.rank(method='max', pct=True) * 100).round(2)
+    ranked['cohort_size'] = grouped.transform('size').astype(int)
+    ranked['updated_at'] = datetime.utcnow()
+    return ranked[RANK_COLUMNS + ['updated_at']].to_dict('records')
+
+
+def _insert(rows, session):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        session.execute(insert(CohortRank.__table__), rows[i:i + CHUNK_SIZE])
+
+
+def _set_dirty(cohorts, session):
+    # 按主键顺序写入，并发事务以相同顺序加锁
+    upsert(session, CohortStatus.__table__,
+           [{'dept_id': dept_id, 'enrollment_year': year, 'dirty': True} for dept_id, year in sorted(set(cohorts))],
+           assign=('dirty',))
+
+
+def mark_dirty(student_ids, session=None):
+    """把学生所在的分组标记为待重算（在当前事务内）"""
+    session = session if session is not None else db.session()
+    ids = list(student_ids)
+    if not ids:
+        return
+    cohorts = set()
+    for i in range(0, len(ids), CHUNK_SIZE):
+        cohorts.update(
+            (dept_id, int(year)) for dept_id, year in
+            session.query(Student.dept_id, extract('year', Student.enrollment_date))
+                   .filter(Student.student_id.in_(ids[i:i + CHUNK_SIZE])).distinct()
+        )
+    _set_dirty(cohorts, session)
+
+
+def mark_all_dirty(session=None):
+    session = session if session is not None else db.session()
+    session.execute(update(CohortStatus.__table__).values(dirty=True))
+
+
+def refresh_cohort(dept_id, enrollment_year):
+    """重算一个分组的排名（不提交）"""
+    status = CohortStatus.query.filter_by(dept_id=dept_id, enrollment_year=enrollment_year)\
+                               .with_for_update().first()
+    if status is not None and not status.dirty:
+        return  # 等待锁期间已被其他请求重算
+
+    students = _students(Student.dept_id == dept_id,
+                         extract('year', Student.enrollment_date) == enrollment_year)
+    # 转系的学生可能仍留有原分组的排名，删除并让原分组重算
+    table = CohortRank.__table__
+    if not students.empty:
+        moved = db.session.query(CohortRank.dept_id, CohortRank.enrollment_year)\
+                          .filter(CohortRank.student_id.in_(students['student_id'].tolist()))\
+                          .filter(db.or_(CohortRank.dept_id != dept_id,
+                                         CohortRank.enrollment_year != enrollment_year)).distinct().all()
+        _set_dirty([tuple(row) for row in moved], db.session)
+        db.session.execute(delete(table).where(table.c.student_id.in_(students['student_id'].tolist())))
+    db.session.execute(delete(table).where(table.c.dept_id == dept_id)
+                                    .where(table.c.enrollment_year == enrollment_year))
+    _insert(compute(students), db.session)
+
+    if status is None:
+        status = CohortStatus(dept_id=dept_id, enrollment_year=enrollment_year)
+        db.session.add(status)
+    status.dirty = False
+    status.refreshed_at = datetime.utcnow()
+
+
+def refresh_dirty(min_age=0):
+    """重算已标记的分组（各自提交），跳过 min_age 秒内刚重算过的分组，返回重算的分组数"""
+    condition = [CohortStatus.dirty.is_(True)]
+    if min_age:
+        cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+        condition.append(db.or_(CohortStatus.refreshed_at.is_(None), CohortStatus.refreshed_at <= cutoff))
+    cohorts = db.session.query(CohortStatus.dept_id, CohortStatus.enrollment_year).filter(*condition)\
+                        .order_by(CohortStatus.dept_id, CohortStatus.enrollment_year).all()
+    db.session.rollback()  # 结束读取事务，各分组在自己的事务中加锁重算
+    for dept_id, year in cohorts:
+        refresh_cohort(dept_id, year)
+        db.session.commit()
+    return len(cohorts)
+
+
+class RankingRefresher:
+    """本进程的排名后台重算线程，首次读取排名时启动"""
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    def ensure_started(self):
+        if self.app is None or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ranking-refresher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        interval = self.app.config['RANKING_REFRESH_INTERVAL']
+        while True:
+            try:
+                with self.app.app_context():
+                    refresh_dirty(min_age=interval)
+                    db.session.remove()
+            except Exception:
+                self.app.logger.exception('排名后台重算失败')
+            time.sleep(interval)
+
+
+refresher = RankingRefresher()
+
+
+def get(student):
+    """读取学生排名（分组有成绩变化时为上次重算的结果）；未出成绩或尚未计算的学生返回 None"""
+    refresher.ensure_started()
+    rank = db.session.get(CohortRank, student.student_id)
+    if rank is None:
+        return None
+    return {
+        'dept_id': rank.dept_id,
+        'enrollment_year': rank.enrollment_year,
+        'gpa': rank.gpa,
+        'rank': rank.rank,
+        'cohort_size': rank.cohort_size,
+        'percentile': rank.percentile
+    }
+
+
+def rebuild():
+    """一次计算全部分组的排名并覆盖写入，返回参与排名的学生数"""
+    students = _students()
+    rows = compute(students, all_students=True)
+    db.session.execute(delete(CohortRank.__table__))
+    db.session.execute(delete(CohortStatus.__table__))
+    _insert(rows, db.session)
+    now = datetime.utcnow()
+    cohorts = students[COHORT_KEYS].drop_duplicates().itertuples(index=False)
+    status_rows = [{'dept_id': d, 'enrollment_year': int(y), 'dirty': False, 'refreshed_at': now}
+                   for d, y in cohorts]
+    if status_rows:
+        db.session.execute(insert(CohortStatus.__table__), status_rows)
+    db.session.commit()
+    return len(rows)
@@ -0,0 +1,283 @@
+"""数据统计页的预聚合表
+
+dept_rollup 按（系部, 入学年份）保存学生人数，course_term_rollup 按（课程, 学年, 学期）
+保存教学班数与选课人次。统计页只读这两张小表，按学期、按年级的分布也由同一批行汇总得到。
+
+维护方式：ORM flush 时按新增、删除的学生、教学任务、选课记录（以及学生转系、入学日期修改）
+计算各分组的增量。
+
+- 学生人数、教学班数：提交前以 count = count + delta（UPSERT，按主键排序）写入，
+  与业务写入在同一事务内完成；
+- 选课人次：不在选课事务中写入，否则同一课程所有教学班的选课都要争抢同一行的锁。
+  提交后累加到本进程的缓冲（SelectionBuffer），由后台线程每隔 ROLLUP_FLUSH_INTERVAL 秒
+  在单独的事务中按主键顺序写入；统计页读取前先写入本进程的缓冲。进程异常退出时尚未写入的
+  增量会丢失，可用 `manage.py rebuild-rollups` 从原始数据全量重算校正。
+
+绕过 ORM 批量插入选课记录（抢课模式、志愿抽签）需调用 add_selections()，批量导入学生需调用
+add_students()。
+"""
+import atexit
+import threading
+import time
+from collections import Counter
+from sqlalchemy import event, select, insert, delete, extract, func
+from sqlalchemy.orm import Session
+from app import db
+from app.models import (Student, Assignment, Selection, Department, Course, StudentSummary,
+                        DepartmentRollup, CourseTermRollup)
+from app.upsert import upsert
+
+
+def _deltas(session):
+    return session.info.setdefault('rollup_deltas', {
+        'students': Counter(), 'assignments': Counter(), 'selections': Counter()
+    })
+
+
+def _old_value(state, key):
+    history = state.attrs[key].history
+    values = history.deleted or history.unchanged
+    return values[0] if values else None
+
+
+def _term_keys(session, assignment_ids, known):
+    """教学任务 -> (课程, 学年, 学期)，known 为本次 flush 中已有的教学任务对象"""
+    keys = {a.assignment_id: (a.course_id, a.academic_year, a.semester)
+            for a in known if a.assignment_id in assignment_ids}
+    missing = [aid for aid in assignment_ids if aid not in keys]
+    if missing:
+        rows = session.execute(select(Assignment.assignment_id, Assignment.course_id,
+                                      Assignment.academic_year, Assignment.semester)
+                               .where(Assignment.assignment_id.in_(missing)))
+        keys.update((row[0], tuple(row[1:])) for row in rows)
+    return keys
+
+
+def add_selections(assignment_counts, session=None):
+    """登记本事务内绕过 ORM 新增的选课记录，assignment_counts 为 {assignment_id: 人数}"""
+    session = session if session is not None else db.session()
+    keys = _term_keys(session, set(assignment_counts), ())
+    selections = _deltas(session)['selections']
+    for assignment_id, count in assignment_counts.items():
+        if assignment_id in keys:
+            selections[keys[assignment_id]] += count
+
+
+def add_students(cohort_counts, session=None):
+    """登记本事务内绕过 ORM 新增的学生，cohort_counts 为 {(dept_id, 入学年份): 人数}"""
+    session = session if session is not None else db.session()
+    _deltas(session)['students'].update(cohort_counts)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+    changes = [(obj, 1) for obj in session.new] + [(obj, -1) for obj in session.deleted]
+    students, assignments, selections = Counter(), Counter(), Counter()
+    for obj, sign in changes:
+        # 已删除的行不能再加载过期属性，只读取对象上已有的值
+        values = db.inspect(obj).dict
+        if isinstance(obj, Student) and values.get('enrollment_date') is not None:
+            students[(values.get('dept_id'), values['enrollment_date'].year)] += sign
+        elif isinstance(obj, Assignment):
+            assignments[(values.get('course_id'), values.get('academic_year'), values.get('semester'))] += sign
+        elif isinstance(obj, Selection):
+            selections[values.get('assignment_id')] += sign
+
+    # 转系、修改入学日期：从原分组移到新分组
+    for obj in session.dirty:
+        if not isinstance(obj, Student):
+            continue
+        state = db.inspect(obj)
+        if state.attrs.dept_id.history.has_changes() or state.attrs.enrollment_date.history.has_changes():
+            old_date = _old_value(state, 'enrollment_date')
+            if old_date is not None:
+                students[(_old_value(state, 'dept_id'), old_date.year)] -= 1
+            students[(obj.dept_id, obj.enrollment_date.year)] += 1
+
+    selections = {aid: n for aid, n in selections.items() if n and aid is not None}
+    if not (students or assignments or selections):
+        return
+    deltas = _deltas(session)
+    deltas['students'].update(students)
+    deltas['assignments'].update(assignments)
+    if selections:
+        known = [obj for obj in session.identity_map.values() if isinstance(obj, Assignment)]
+        known += [obj for obj in session.deleted if isinstance(obj, Assignment)]
+        keys = _term_keys(session, set(selections), known)
+        for assignment_id, count in selections.items():
+            if assignment_id in keys:
+                deltas['selections'][keys[assignment_id]] += count
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply(session):
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    deltas = session.info.pop('rollup_deltas', None)
+    if deltas:
+        _write(deltas, session)
+        session.info['rollup_selections'] = deltas['selections']
+
+
+@event.listens_for(Session, 'after_commit')
+def _buffer(session):
+    selections = session.info.pop('rollup_selections', None)
+    if selections:
+        selection_buffer.add(selections)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('rollup_deltas', None)
+    session.info.pop('rollup_selections', None)
+
+
+def _write(deltas, session):
+    """在当前事务内写入学生人数、教学班数的增量；各行按主键顺序写入，并发事务以相同顺序加锁"""
+    upsert(session, DepartmentRollup.__table__,
+           [{'dept_id': dept_id, 'enrollment_year': year, 'student_count': delta}
+            for (dept_id, year), delta in sorted(deltas['students'].items()) if delta],
+           increment=('student_count',))
+    upsert(session, CourseTermRollup.__table__,
+           [{'course_id': course_id, 'academic_year': year, 'semester': semester, 'assignment_count': delta}
+            for (course_id, year, semester), delta in sorted(deltas['assignments'].items()) if delta],
+           increment=('assignment_count',))
+
+
+class SelectionBuffer:
+    """本进程已提交、尚未写入 course_term_rollup 的选课人次增量"""
+
+    def __init__(self):
+        self.app = None
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self._flush_at_exit)
+
+    def add(self, counts):
+        with self._lock:
+            self._counts.update(counts)
+            if self.app is not None and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name='rollup-flusher', daemon=True)
+                self._thread.start()
+
+    def discard(self):
+        with self._lock:
+            self._counts.clear()
+
+    def flush(self):
+        """在单独的事务中写入缓冲的增量，返回写入的行数；写入失败时增量放回缓冲"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        rows = [{'course_id': course_id, 'academic_year': year, 'semester': semester, 'selection_count': n}
+                for (course_id, year, semester), n in sorted(counts.items()) if n]
+        if not rows:
+            return 0
+        try:
+            with db.engine.begin() as connection:
+                upsert(connection, CourseTermRollup.__table__, rows, increment=('selection_count',))
+        except Exception:
+            with self._lock:
+                self._counts.update(counts)
+            raise
+        return len(rows)
+
+    def _run(self):
+        interval = self.app.config['ROLLUP_FLUSH_INTERVAL']
+        while True:
+            time.sleep(interval)
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                self.app.logger.exception('选课人次预聚合写入失败')
+
+    def _flush_at_exit(self):
+        if self._counts:
+            with self.app.app_context():
+                self.flush()
+
+
+selection_buffer = SelectionBuffer()
+
+
+def rebuild():
+    """从学生、教学任务、选课记录全量重算，返回写入的行数"""
+    selection_buffer.discard()  # 缓冲中的增量已包含在原始数据中
+    year = extract('year', Student.enrollment_date)
+    student_rows = [
+        {'dept_id': dept_id, 'enrollment_year': int(y), 'student_count': count}
+        for dept_id, y, count in db.session.query(Student.dept_id, year, func.count())
+                                           .group_by(Student.dept_id, year)
+    ]
+
+    term = (Assignment.course_id, Assignment.academic_year, Assignment.semester)
+    courses = {}
+    for *key, count in db.session.query(*term, func.count()).group_by(*term):
+        courses[tuple(key)] = {'assignment_count': count, 'selection_count': 0}
+    for *key, count in db.session.query(*term, func.count())\
+                                 .join(Selection, Selection.assignment_id == Assignment.assignment_id)\
+                                 .group_by(*term):
+        courses[tuple(key)]['selection_count'] = count
+    course_rows = [dict(course_id=c, academic_year=y, semester=s, **values)
+                   for (c, y, s), values in courses.items()]
+
+    db.session.execute(delete(DepartmentRollup.__table__))
+    db.session.execute(delete(CourseTermRollup.__table__))
+    if student_rows:
+        db.session.execute(insert(DepartmentRollup.__table__), student_rows)
+    if course_rows:
+        db.session.execute(insert(CourseTermRollup.__table__), course_rows)
+    db.session.commit()
+    return len(student_rows) + len(course_rows)
+
+
+# ==================== 读取 ====================
+def department_stats():
+    """各系部学生人数、各年级人数与平均 GPA（取自学业概况），按系部编号排列"""
+    by_year = {}
+    for row in DepartmentRollup.query.filter(DepartmentRollup.student_count > 0):
+        by_year.setdefault(row.dept_id, {})[row.enrollment_year] = row.student_count
+    gpa = dict(
+        (dept_id, round(float(avg), 2)) for dept_id, avg in
+        db.session.query(Student.dept_id, func.avg(StudentSummary.gpa))
+                  .join(StudentSummary, StudentSummary.student_id == Student.student_id)
+                  .filter(StudentSummary.graded_courses > 0)
+                  .group_by(Student.dept_id)
+    )
+    return [{
+        'dept_id': dept_id,
+        'dept_name': dept_name,
+        'student_count': sum(by_year.get(dept_id, {}).values()),
+        'by_year': sorted(by_year.get(dept_id, {}).items()),
+        'avg_gpa': gpa.get(dept_id)
+    } for dept_id, dept_name in db.session.query(Department.dept_id, Department.dept_name)
+                                          .order_by(Department.dept_id)]
+
+
+def course_stats():
+    """返回 (各课程的教学班数与选课人次, 各学期合计)，学期按时间顺序排列"""
+    selection_buffer.flush()
+    courses, terms = {}, {}
+    for row in CourseTermRollup.query:
+        course = courses.setdefault(row.course_id, Counter())
+        course['assignment_count'] += row.assignment_count
+        course['selection_count'] += row.selection_count
+        term = terms.setdefault((row.academic_year, row.semester), Counter())
+        term['assignment_count'] += row.assignment_count
+        term['selection_count'] += row.selection_count
+        term['course_count'] += 1 if row.assignment_count > 0 else 0
+
+    course_rows = [{
+        'course_id': course_id,
+        'course_name': course_name,
+        'assignment_count': courses.get(course_id, {}).get('assignment_count', 0),
+        'selection_count': courses.get(course_id, {}).get('selection_count', 0)
+    } for course_id, course_name in db.session.query(Course.course_id, Course.course_name)
+                                              .order_by(Course.course_id)]
+    term_rows = [dict(academic_year=year, semester=semester, **counts)
+                 for (year, semester), counts in sorted(terms.items())]
+    return course_rows, term_rows
@@ -1,13 +1,38 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, date
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from app import db
 from app.models import User, Department, Teacher, Student, Course, Assignment, Selection
 from app.forms import StudentForm, TeacherForm, DepartmentForm, CourseForm, AssignmentForm
+from app import summary, ranking, search
+from app.pagination import paginate_list, equals
+from app.typeahead import typeahead
+from app.counters import counters
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+# 列表排序键（须有对应索引，最后一列唯一）与筛选器
+STUDENT_KEYS = [(Student.enrollment_date, True), (Student.student_id, True)]
+STUDENT_FILTERS = {
+    'dept': equals(Student.dept_id),
+    'status': equals(Student.status),
+    'search': search.matching('student'),
+}
+TEACHER_KEYS = [(Teacher.hire_date, True), (Teacher.teacher_id, True)]
+TEACHER_FILTERS = {
+    'dept': equals(Teacher.dept_id),
+    'search': search.matching('teacher'),
+}
+USER_KEYS = [(User.id, True)]
+USER_FILTERS = {
+    'role': equals(User.role),
+    'search': search.matching('user'),
+}
+COURSE_KEYS = [(Course.course_id, False)]
+ASSIGNMENT_KEYS = [(Assignment.academic_year, True), (Assignment.semester, True), (Assignment.assignment_id, True)]
+
 @bp.before_request
 @login_required
 def restrict_to_admin():
@@ -19,55 +44,27 @@ def restrict_to_admin():
 @bp.route('/dashboard')
 def dashboard():
     """管理员仪表盘"""
-    stats = {
-        'students': Student.query.count(),
-        'teachers': Teacher.query.count(),
-        'departments': Department.query.count(),
-        'courses': Course.query.count(),
-        'active_assignments': Assignment.query.count(),
-        'selections': Selection.query.count(),
-        'users': User.query.count()
-    }
+    if current_app.config['DASHBOARD_APPROXIMATE_COUNTS']:
+        stats = counters.approximate()
+    else:
+        stats = counters.get()
     return render_template('admin/dashboard.html', stats=stats)
 
 # ==================== 学生管理 ====================
 @bp.route('/students')
 def students():
     """学生列表"""
-    students = Student.query.order_by(Student.student_id).all()
-    # 获取筛选参数
-    dept_filter = request.args.get('dept', '')
-    status_filter = request.args.get('status', '')
-    search_query = request.args.get('search', '')
-    
-    # 构建查询
-    query = Student.query
-    
-    if dept_filter:
-        query = query.filter_by(dept_id=dept_filter)
-    
-    if status_filter:
-        query = query.filter_by(status=status_filter)
-    
-    if search_query:
-        query = query.filter(
-            db.or_(
-                Student.student_id.ilike(f'%{search_query}%'),
-                Student.name.ilike(f'%{search_query}%')
-            )
-        )
-    
-    students = query.order_by(Student.enrollment_date.desc()).all()
+    query = Student.query.options(joinedload(Student.user), joinedload(Student.department))
+    page, active = paginate_list('students', query, STUDENT_KEYS, STUDENT_FILTERS)
     departments = Department.query.order_by(Department.dept_name).all()
     
     return render_template('admin/students.html', 
-                          students=students,
+                          students=page.items,
+                          page=page,
                           departments=departments,
-                          dept_filter=dept_filter,
-                          status_filter=status_filter,
-                          search_query=search_query)
-    
-
+                          dept_filter=active.get('dept', ''),
+                          status_filter=active.get('status', ''),
+                          search_query=active.get('search', ''))
 
 @bp.route('/students/add', methods=['GET', 'POST'])
 def add_student():
@@ -188,40 +185,28 @@ def delete_student(student_id):
 def student_detail(student_id):
     """学生详情"""
     student = Student.query.get_or_404(student_id)
-    selections = Selection.query.filter_by(student_id=student_id).all()
-    return render_template('admin/student_detail.html', student=student, selections=selections)
+    selections = Selection.query.filter_by(student_id=student_id).options(
+        joinedload(Selection.assignment).joinedload(Assignment.course),
+        joinedload(Selection.assignment).joinedload(Assignment.teacher)
+    ).all()
+    stats = summary.get(student_id)
+    return render_template('admin/student_detail.html', student=student, selections=selections, stats=stats,
+                          cohort_rank=ranking.get(student))
 
 # ==================== 教师管理 ====================
 @bp.route('/teachers')
 def teachers():
     """教师管理"""
-    # 获取筛选参数
-    dept_filter = request.args.get('dept', '')
-    search_query = request.args.get('search', '')
-    
-    # 构建查询
-    query = Teacher.query
-    
-    if dept_filter:
-        query = query.filter_by(dept_id=dept_filter)
-    
-    if search_query:
-        query = query.filter(
-            db.or_(
-                Teacher.teacher_id.ilike(f'%{search_query}%'),
-                Teacher.name.ilike(f'%{search_query}%'),
-                Teacher.title.ilike(f'%{search_query}%')
-            )
-        )
-    
-    teachers = query.order_by(Teacher.hire_date.desc()).all()
+    query = Teacher.query.options(joinedload(Teacher.user), joinedload(Teacher.department))
+    page, active = paginate_list('teachers', query, TEACHER_KEYS, TEACHER_FILTERS)
     departments = Department.query.order_by(Department.dept_name).all()
     
     return render_template('admin/teachers.html', 
-                          teachers=teachers,
+                          teachers=page.items,
+                          page=page,
                           departments=departments,
-                          dept_filter=dept_filter,
-                          search_query=search_query)
+                          dept_filter=active.get('dept', ''),
+                          search_query=active.get('search', ''))
 
 @bp.route('/teachers/<string:teacher_id>')
 def teacher_detail(teacher_id):
@@ -375,15 +360,17 @@ def departments():
 def add_department():
     """添加系部"""
     form = DepartmentForm()
-    
-    teachers = Teacher.query.order_by(Teacher.name).all()
-    form.dean_id.choices = [('', '请选择系主任')] + [(t.teacher_id, f"{t.teacher_id} - {t.name}") for t in teachers]
+    form.dean_id.choices = typeahead.choices('teacher', form.dean_id.data, '请选择系主任')
     
     if form.validate_on_submit():
         if Department.query.filter_by(dept_id=form.dept_id.data).first():
             flash('该系部编号已存在', 'danger')
             return render_template('admin/department_form.html', form=form, title='添加系部')
         
+        if form.dean_id.data and not typeahead.exists('teacher', form.dean_id.data):
+            flash('所选系主任不存在', 'danger')
+            return render_template('admin/department_form.html', form=form, title='添加系部')
+        
         department = Department(
             dept_id=form.dept_id.data,
             dept_name=form.dept_name.data,
@@ -408,15 +395,17 @@ def edit_department(dept_id):
     """编辑系部信息"""
     department = Department.query.get_or_404(dept_id)
     form = DepartmentForm(obj=department)
-    
-    teachers = Teacher.query.order_by(Teacher.name).all()
-    form.dean_id.choices = [('', '请选择系主任')] + [(t.teacher_id, f"{t.teacher_id} - {t.name}") for t in teachers]
+    form.dean_id.choices = typeahead.choices('teacher', form.dean_id.data, '请选择系主任')
     
     if form.validate_on_submit():
         if dept_id != form.dept_id.data and Department.query.filter_by(dept_id=form.dept_id.data).first():
             flash('该系部编号已存在', 'danger')
             return render_template('admin/department_form.html', form=form, title='编辑系部')
         
+        if form.dean_id.data and not typeahead.exists('teacher', form.dean_id.data):
+            flash('所选系主任不存在', 'danger')
+            return render_template('admin/department_form.html', form=form, title='编辑系部')
+        
         form.populate_obj(department)
         department.updated_at = datetime.utcnow()
         
@@ -454,8 +443,13 @@ def delete_department(dept_id):
 @bp.route('/courses')
 def courses():
     """课程列表"""
-    courses = Course.query.order_by(Course.course_id).all()
-    return render_template('admin/courses.html', courses=courses)
+    page, _ = paginate_list('courses', Course.query, COURSE_KEYS, {})
+    ids = [course.course_id for course in page.items]
+    assignment_counts = dict(db.session.query(Assignment.course_id, db.func.count())
+                                       .filter(Assignment.course_id.in_(ids))
+                                       .group_by(Assignment.course_id)) if ids else {}
+    return render_template('admin/courses.html', courses=page.items, page=page,
+                          assignment_counts=assignment_counts)
 
 @bp.route('/courses/add', methods=['GET', 'POST'])
 def add_course():
@@ -535,25 +529,29 @@ def delete_course(course_id):
 @bp.route('/assignments')
 def assignments():
     """教学任务列表"""
-    assignments = Assignment.query.order_by(
-        Assignment.academic_year.desc(), 
-        Assignment.semester.desc()
-    ).all()
-    return render_template('admin/assignments.html', assignments=assignments)
+    query = Assignment.query.options(joinedload(Assignment.course), joinedload(Assignment.teacher))
+    page, _ = paginate_list('assignments', query, ASSIGNMENT_KEYS, {})
+    ids = [assignment.assignment_id for assignment in page.items]
+    selection_counts = dict(db.session.query(Selection.assignment_id, db.func.count())
+                                      .filter(Selection.assignment_id.in_(ids))
+                                      .group_by(Selection.assignment_id)) if ids else {}
+    return render_template('admin/assignments.html', assignments=page.items, page=page,
+                          selection_counts=selection_counts)
 
 @bp.route('/assignments/add', methods=['GET', 'POST'])
 def add_assignment():
     """添加教学任务"""
     form = AssignmentForm()
     
-    # 动态加载选择项
-    courses = Course.query.order_by(Course.course_name).all()
-    teachers = Teacher.query.order_by(Teacher.name).all()
-    
-    form.course_id.choices = [('', '请选择课程')] + [(c.course_id, f"{c.course_id} - {c.course_name}") for c in courses]
-    form.teacher_id.choices = [('', '请选择教师')] + [(t.teacher_id, f"{t.teacher_id} - {t.name}") for t in teachers]
+    # 只渲染已选项，其余选项由前端输入联想查询
+    form.course_id.choices = typeahead.choices('course', form.course_id.data, '请选择课程')
+    form.teacher_id.choices = typeahead.choices('teacher', form.teacher_id.data, '请选择教师')
     
     if form.validate_on_submit():
+        if not typeahead.exists('course', form.course_id.data) or not typeahead.exists('teacher', form.teacher_id.data):
+            flash('所选课程或教师不存在', 'danger')
+            return render_template('admin/assignment_form.html', form=form, title='添加教学任务')
+        
         # 检查是否已存在相同的教学任务
         existing = Assignment.query.filter_by(
             course_id=form.course_id.data,
@@ -612,30 +610,14 @@ def delete_assignment(assignment_id):
 @bp.route('/users')
 def users():
     """用户管理"""
-    # 获取筛选参数
-    role_filter = request.args.get('role', '')
-    search_query = request.args.get('search', '')
-    
-    # 构建查询
-    query = User.query
-    
-    if role_filter:
-        query = query.filter_by(role=role_filter)
-    
-    if search_query:
-        query = query.filter(
-            db.or_(
-                User.username.ilike(f'%{search_query}%'),
-                User.email.ilike(f'%{search_query}%')
-            )
-        )
-    
-    users = query.order_by(User.created_at.desc()).all()
+    query = User.query.options(joinedload(User.teacher_profile), joinedload(User.student_profile))
+    page, active = paginate_list('users', query, USER_KEYS, USER_FILTERS)
     
     return render_template('admin/users.html', 
-                          users=users,
-                          role_filter=role_filter,
-                          search_query=search_query)
+                          users=page.items,
+                          page=page,
+                          role_filter=active.get('role', ''),
+                          search_query=active.get('search', ''))
 
 @bp.route('/users/<int:user_id>/reset_password', methods=['GET', 'POST'])
 def reset_user_password(user_id):
@@ -699,38 +681,66 @@ def delete_user(user_id):
 # ==================== 数据统计 ====================
 @bp.route('/statistics')
 def statistics():
-    """数据统计"""
-    # 系部学生统计
-    dept_stats = db.session.query(
-        Department.dept_name,
-        db.func.count(Student.student_id).label('student_count')
-    ).join(Student, Department.dept_id == Student.dept_id, isouter=True)\
-     .group_by(Department.dept_id, Department.dept_name).all()
-    
-    # 课程选课统计
-    course_stats = db.session.query(
-        Course.course_name,
-        db.func.count(Selection.selection_id).label('selection_count')
-    ).join(Assignment, Course.course_id == Assignment.course_id, isouter=True)\
-     .join(Selection, Assignment.assignment_id == Selection.assignment_id, isouter=True)\
-     .group_by(Course.course_id, Course.course_name).all()
-    
+    """数据统计（读取预聚合表，见 app.rollup）"""
+    from app import rollup
+    course_stats, term_stats = rollup.course_stats()
     return render_template('admin/statistics.html', 
-                          dept_stats=dept_stats, 
-                          course_stats=course_stats)
+                          stats=counters.get(),
+                          dept_stats=rollup.department_stats(), 
+                          course_stats=course_stats,
+                          term_stats=term_stats)
 
 # ==================== API接口 ====================
 @bp.route('/api/students/count')
 def api_students_count():
     """学生数量API"""
-    count = Student.query.count()
-    return jsonify({'count': count})
+    return jsonify({'count': counters.count('students')})
 
 @bp.route('/api/teachers/count')
 def api_teachers_count():
     """教师数量API"""
-    count = Teacher.query.count()
-    return jsonify({'count': count})
+    return jsonify({'count': counters.count('teachers')})
+
+@bp.route('/api/analytics/departments/<dept_id>')
+def api_department_analytics(dept_id):
+    """系部成绩分布API，默认当前学期"""
+    from app.analytics import analytics
+    Department.query.get_or_404(dept_id)
+    academic_year = request.args.get('academic_year', current_app.config['CURRENT_ACADEMIC_YEAR'])
+    semester = request.args.get('semester', current_app.config['CURRENT_SEMESTER'])
+    return jsonify(analytics.department(dept_id, academic_year, semester))
+
+@bp.route('/api/analytics/courses/<course_id>')
+def api_course_analytics(course_id):
+    """课程（全部教学班）成绩分布API，默认当前学期"""
+    from app.analytics import analytics
+    Course.query.get_or_404(course_id)
+    academic_year = request.args.get('academic_year', current_app.config['CURRENT_ACADEMIC_YEAR'])
+    semester = request.args.get('semester', current_app.config['CURRENT_SEMESTER'])
+    return jsonify(analytics.course(course_id, academic_year, semester))
+
+@bp.route('/api/search/<entity>')
+def api_search(entity):
+    """按相关度排序的搜索API：student / teacher / course / user"""
+    if entity not in search.ENTITIES:
+        return jsonify({'error': '不支持的搜索类型'}), 404
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify(search.search(entity, request.args.get('q', ''), limit=limit))
+
+@bp.route('/api/typeahead/<entity>')
+def api_typeahead(entity):
+    """输入联想API：teacher / course / student / department，按编号或名称前缀匹配"""
+    from app.typeahead import ENTITIES
+    if entity not in ENTITIES:
+        return jsonify({'error': '不支持的类型'}), 404
+    limit = min(request.args.get('limit', 20, type=int), 50)
+    return jsonify(typeahead.lookup(entity, request.args.get('q', ''), limit=limit))
+
+@bp.route('/api/admission')
+def api_admission():
+    """并发准入指标API"""
+    from app.admission import admission
+    return jsonify(admission.snapshot())
 
 @bp.route('/api/departments/<dept_id>/teachers')
 def api_department_teachers(dept_id):
@@ -755,19 +765,85 @@ def update_settings():
 # ==================== 数据备份 ====================
 @bp.route('/backup')
 def backup():
-    """数据备份"""
-    # 这里可以添加数据备份逻辑
-    flash('数据备份功能开发中', 'info')
-    return redirect(url_for('admin.dashboard'))
+    """数据备份：备份列表"""
+    from app.backup import list_backups
+    return render_template('admin/backup.html', backups=list_backups())
+
+@bp.route('/backup/create', methods=['POST'])
+def create_backup():
+    """做一次全量或增量备份"""
+    from app.backup import create
+    incremental = request.form.get('kind') == 'incremental'
+    try:
+        manifest = create(incremental=incremental)
+        rows = sum(table['rows'] for table in manifest['tables'].values())
+        flash(f"备份 {manifest['name']} 已完成，共 {rows} 行", 'success')
+    except Exception as e:
+        flash(f'备份失败: {str(e)}', 'danger')
+    return redirect(url_for('admin.backup'))
 
-@bp.route('/import')
+@bp.route('/import', methods=['GET', 'POST'])
 def data_import():
-    """数据导入"""
-    flash('数据导入功能开发中', 'info')
-    return redirect(url_for('admin.dashboard'))
+    """数据导入：批量导入学生名单"""
+    from app import intake
+    if request.method == 'GET':
+        return render_template('admin/data_import.html')
+
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('请选择要导入的学生名单', 'warning')
+        return redirect(url_for('admin.data_import'))
+
+    skip_invalid = bool(request.form.get('skip_invalid'))
+    try:
+        # 请求内不启动散列进程池，新账号共用一个默认口令散列；大名单用 manage.py import-students
+        result = intake.import_students(upload.stream, upload.filename, skip_invalid=skip_invalid, workers=None)
+        if result['errors'] and not skip_invalid:
+            db.session.rollback()
+            flash(f"名单有 {len(result['errors'])} 行错误，未导入任何学生", 'danger')
+        else:
+            db.session.commit()
+            message = f"导入完成：共 {result['rows']} 行，导入 {result['imported']} 名学生"
+            if result['errors']:
+                message += f"，跳过 {len(result['errors'])} 行错误"
+            flash(message + f'。初始账号为学号，密码：{intake.DEFAULT_PASSWORD}', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'导入失败: {str(e)}', 'danger')
+        return redirect(url_for('admin.data_import'))
+
+    return render_template('admin/data_import.html', result=result)
+
+@bp.route('/import/template')
+def data_import_template():
+    """下载学生名单导入模板（CSV）"""
+    from app import intake
+    return Response(intake.template(), mimetype='text/csv', headers={
+        'Content-Disposition': 'attachment; filename=students_template.csv'
+    })
 
 @bp.route('/export')
 def data_export():
-    """数据导出"""
-    flash('数据导出功能开发中', 'info')
-    return redirect(url_for('admin.dashboard'))
\ No newline at end of file
+    """数据导出：不带 dataset 参数时显示导出页，否则以流式响应下载"""
+    from app import export
+    dataset = request.args.get('dataset')
+    if not dataset:
+        departments = Department.query.order_by(Department.dept_id).all()
+        academic_years = [row[0] for row in db.session.query(Assignment.academic_year).distinct()
+                                                       .order_by(Assignment.academic_year.desc())]
+        return render_template('admin/data_export.html',
+                               datasets=export.DATASETS,
+                               filter_labels=export.FILTER_LABELS,
+                               departments=departments,
+                               academic_years=academic_years)
+
+    fmt = request.args.get('format', 'csv')
+    if dataset not in export.DATASETS or fmt not in export.FORMATS:
+        flash('不支持的导出类型或格式', 'danger')
+        return redirect(url_for('admin.data_export'))
+
+    generate, mimetype = export.FORMATS[fmt]
+    return Response(stream_with_context(generate(dataset, request.args)), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={export.filename(dataset, fmt)}',
+        'X-Accel-Buffering': 'no',
+    })
\ No newline at end of file
@@ -1,9 +1,18 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+import hashlib
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app, Response
 from flask_login import login_required, current_user
 from datetime import datetime
-from app import db
-from app.models import Student, Course, Assignment, Selection, Department
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, contains_eager
+from app import db, summary, transcript, ranking
+from app.models import Student, Course, Assignment, Selection, Department, Waitlist, Notification, Preference
 from app.forms import CourseSelectionForm
+from app.enrollment import reserve_seat, release_seat, is_full, checkout, promote_waitlist, waitlist_position
+from app.rush import gateway
+from app.schedule import load_masks, has_conflict, iter_slots, EMPTY
+from app.catalog import catalog
+from app.seatfeed import broadcaster, event_stream
+from app.idempotency import idempotent
 
 bp = Blueprint('student', __name__, url_prefix='/student')
 
@@ -24,20 +33,16 @@ def dashboard():
         return redirect(url_for('auth.logout'))
     
     # 获取学生的选课记录
-    selections = Selection.query.filter_by(student_id=student.student_id).all()
+    selections = Selection.query.filter_by(student_id=student.student_id)\
+                               .options(joinedload(Selection.assignment).joinedload(Assignment.course)).all()
     
     # 统计信息
-    stats = {
-        'total_courses': len(selections),
-        'completed_courses': len([s for s in selections if s.total_grade is not None]),
-        'total_credits': sum(s.assignment.course.credits or 0 for s in selections if s.total_grade and s.total_grade >= 60),
-        'gpa': calculate_gpa(selections)
-    }
+    stats = summary.get(student.student_id)
     
     # 获取当前学期的课程
     current_assignments = Assignment.query.filter(
-        Assignment.academic_year == '2023-2024',
-        Assignment.semester == '1'
+        Assignment.academic_year == current_app.config['CURRENT_ACADEMIC_YEAR'],
+        Assignment.semester == current_app.config['CURRENT_SEMESTER']
     ).all()
     
     return render_template('student/dashboard.html', 
@@ -46,36 +51,6 @@ def dashboard():
                           selections=selections,
                           current_assignments=current_assignments)
 
-def calculate_gpa(selections):
-    """计算GPA"""
-    graded_courses = [s for s in selections if s.total_grade is not None]
-    if not graded_courses:
-        return 0.0
-    
-    total_points = 0
-    total_credits = 0
-    
-    for selection in graded_courses:
-        credits = selection.assignment.course.credits or 0
-        grade = selection.total_grade
-        
-        # 转换为绩点（4.0制）
-        if grade >= 90:
-            points = 4.0
-        elif grade >= 80:
-            points = 3.0
-        elif grade >= 70:
-            points = 2.0
-        elif grade >= 60:
-            points = 1.0
-        else:
-            points = 0.0
-            
-        total_points += points * credits
-        total_credits += credits
-    
-    return round(total_points / total_credits, 2) if total_credits > 0 else 0.0
-
 # ==================== 查询个人信息 ====================
 @bp.route('/profile')
 def profile():
@@ -135,7 +110,7 @@ def select_courses():
             continue
         
         # 检查课程是否已满
-        if assignment.enrollment_limit and len(assignment.selections) >= assignment.enrollment_limit:
+        if is_full(assignment):
             continue
             
         available_assignments.append(assignment)
@@ -161,15 +136,20 @@ def select_courses():
             flash('您已经选择了该课程', 'warning')
             return redirect(url_for('student.select_courses'))
         
-        # 检查课程是否已满
-        if assignment.enrollment_limit and len(assignment.selections) >= assignment.enrollment_limit:
+        if has_conflict(student.student_id, assignment):
+            flash('与已选课程上课时间冲突', 'danger')
+            return redirect(url_for('student.select_courses'))
+        
+        # 占用名额（原子操作，满员则失败）
+        if not reserve_seat(assignment.assignment_id):
+            db.session.rollback()
             flash('该课程已满员，无法选择', 'danger')
             return redirect(url_for('student.select_courses'))
         
         # 创建选课记录
         selection = Selection(
             student_id=student.student_id,
-            assignment_id=assignment_id,
+            assignment_id=assignment.assignment_id,
             selection_time=datetime.utcnow()
         )
         
@@ -178,6 +158,10 @@ def select_courses():
             db.session.commit()
             flash(f'成功选择课程：{assignment.course.course_name}', 'success')
             return redirect(url_for('student.my_courses'))
+        except IntegrityError:
+            db.session.rollback()
+            flash('您已经选择了该课程', 'warning')
+            return redirect(url_for('student.select_courses'))
         except Exception as e:
             db.session.rollback()
             flash(f'选课失败：{str(e)}', 'danger')
@@ -187,12 +171,16 @@ def select_courses():
                           assignments=available_assignments)
 
 @bp.route('/courses/<int:assignment_id>/select', methods=['POST'])
+@idempotent
 def select_course(assignment_id):
     """快速选课"""
     student = Student.query.filter_by(user_id=current_user.id).first()
     if not student:
         return jsonify({'success': False, 'message': '学生信息不存在'})
     
+    if current_app.config['ENROLLMENT_RUSH_MODE']:
+        return rush_select(student, assignment_id)
+    
     assignment = Assignment.query.get(assignment_id)
     if not assignment:
         return jsonify({'success': False, 'message': '课程不存在'})
@@ -206,9 +194,17 @@ def select_course(assignment_id):
     if existing_selection:
         return jsonify({'success': False, 'message': '您已经选择了该课程'})
     
-    # 检查课程是否已满
-    if assignment.enrollment_limit and len(assignment.selections) >= assignment.enrollment_limit:
-        return jsonify({'success': False, 'message': '该课程已满员'})
+    if has_conflict(student.student_id, assignment):
+        return jsonify({'success': False, 'message': '与已选课程上课时间冲突'})
+    
+    # 占用名额（原子操作，满员则失败）
+    if not reserve_seat(assignment_id):
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': '该课程已满员，可加入候补队列',
+            'waitlist_url': url_for('student.join_waitlist', assignment_id=assignment_id)
+        })
     
     # 创建选课记录
     selection = Selection(
@@ -225,11 +221,84 @@ def select_course(assignment_id):
             'message': f'成功选择：{assignment.course.course_name}',
             'course_name': assignment.course.course_name
         })
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': '您已经选择了该课程'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'选课失败：{str(e)}'})
 
+def rush_select(student, assignment_id):
+    """抢课模式：排队等待批量分配"""
+    # 排队期间不占用数据库连接
+    db.session.remove()
+    
+    ticket = gateway.submit(student.student_id, assignment_id)
+    if ticket is None:
+        return jsonify({'success': False, 'message': '选课人数过多，请稍后再试'}), 503
+    
+    timeout = request.args.get('wait', current_app.config['RUSH_WAIT_TIMEOUT'], type=float)
+    timeout = max(0.0, min(timeout, current_app.config['RUSH_WAIT_TIMEOUT']))
+    if ticket.wait(timeout):
+        return jsonify(ticket.to_dict())
+    
+    data = ticket.to_dict()
+    data['success'] = False
+    data['poll_url'] = url_for('student.rush_ticket', ticket_id=ticket.ticket_id)
+    return jsonify(data), 202
+
+@bp.route('/courses/tickets/<ticket_id>')
+def rush_ticket(ticket_id):
+    """查询抢课凭证状态"""
+    ticket = gateway.get(ticket_id)
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    
+    if not ticket or not student or ticket.student_id != student.student_id:
+        return jsonify({'success': False, 'message': '凭证不存在或已过期'}), 404
+    
+    if ticket.status == 'pending':
+        return jsonify(ticket.to_dict()), 202
+    return jsonify(ticket.to_dict())
+
+@bp.route('/api/cart/checkout', methods=['POST'])
+@idempotent
+def cart_checkout():
+    """购物车批量选课"""
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    if not student:
+        return jsonify({'success': False, 'message': '学生信息不存在'})
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        assignment_ids = [int(i) for i in data.get('assignment_ids', [])]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': '课程参数错误'}), 400
+    
+    if not assignment_ids:
+        return jsonify({'success': False, 'message': '请选择课程'}), 400
+    if len(assignment_ids) > current_app.config['CART_MAX_COURSES']:
+        return jsonify({'success': False, 'message': f"一次最多选择 {current_app.config['CART_MAX_COURSES']} 门课程"}), 400
+    
+    results = checkout(student.student_id, assignment_ids)
+    
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': '选课记录已变化，请刷新后重试'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'选课失败：{str(e)}'})
+    
+    succeeded = sum(1 for r in results if r['success'])
+    return jsonify({
+        'success': succeeded > 0,
+        'message': f'成功选择 {succeeded} 门课程，失败 {len(results) - succeeded} 门',
+        'results': results
+    })
+
 @bp.route('/courses/<int:selection_id>/drop', methods=['POST'])
+@idempotent
 def drop_course(selection_id):
     """退选课程"""
     selection = Selection.query.get_or_404(selection_id)
@@ -243,13 +312,171 @@ def drop_course(selection_id):
         return jsonify({'success': False, 'message': '该课程已录入成绩，无法退选'})
     
     try:
+        release_seat(selection.assignment_id)
         db.session.delete(selection)
+        # 同一事务内递补候补队首
+        promote_waitlist(selection.assignment_id)
         db.session.commit()
         return jsonify({'success': True, 'message': '退选成功'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': f'退选失败：{str(e)}'})
 
+# ==================== 候补队列 ====================
+@bp.route('/courses/<int:assignment_id>/waitlist', methods=['POST'])
+def join_waitlist(assignment_id):
+    """加入候补队列"""
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    if not student:
+        return jsonify({'success': False, 'message': '学生信息不存在'})
+    
+    assignment = Assignment.query.get(assignment_id)
+    if not assignment:
+        return jsonify({'success': False, 'message': '课程不存在'})
+    
+    if Selection.query.filter_by(student_id=student.student_id, assignment_id=assignment_id).first():
+        return jsonify({'success': False, 'message': '您已经选择了该课程'})
+    
+    if not is_full(assignment):
+        return jsonify({'success': False, 'message': '该课程尚有余量，请直接选课'})
+    
+    entry = Waitlist.query.filter_by(student_id=student.student_id, assignment_id=assignment_id).first()
+    if not entry:
+        entry = Waitlist(student_id=student.student_id, assignment_id=assignment_id)
+        try:
+            db.session.add(entry)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            entry = Waitlist.query.filter_by(student_id=student.student_id, assignment_id=assignment_id).first()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': f'加入候补失败：{str(e)}'})
+    
+    position = waitlist_position(entry)
+    return jsonify({
+        'success': True,
+        'message': f'已加入候补队列，当前第 {position} 位',
+        'waitlist_id': entry.waitlist_id,
+        'position': position
+    })
+
+@bp.route('/waitlist/<int:waitlist_id>/cancel', methods=['POST'])
+def cancel_waitlist(waitlist_id):
+    """退出候补队列"""
+    entry = Waitlist.query.get_or_404(waitlist_id)
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    
+    if not student or entry.student_id != student.student_id:
+        return jsonify({'success': False, 'message': '无权操作'})
+    
+    try:
+        db.session.delete(entry)
+        db.session.commit()
+        return jsonify({'success': True, 'message': '已退出候补队列'})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'操作失败：{str(e)}'})
+
+@bp.route('/api/waitlist')
+def api_waitlist():
+    """我的候补API"""
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    if not student:
+        return jsonify([])
+    
+    entries = Waitlist.query.filter_by(student_id=student.student_id)\
+                            .order_by(Waitlist.created_at).all()
+    return jsonify([{
+        'waitlist_id': entry.waitlist_id,
+        'assignment_id': entry.assignment_id,
+        'course_name': entry.assignment.course.course_name,
+        'position': waitlist_position(entry),
+        'created_at': entry.created_at.isoformat() if entry.created_at else None
+    } for entry in entries])
+
+@bp.route('/api/notifications')
+def api_notifications():
+    """我的通知API"""
+    notifications = Notification.query.filter_by(user_id=current_user.id)\
+                                      .order_by(Notification.notification_id.desc())\
+                                      .limit(50).all()
+    return jsonify([{
+        'notification_id': n.notification_id,
+        'message': n.message,
+        'is_read': n.is_read,
+        'created_at': n.created_at.isoformat() if n.created_at else None
+    } for n in notifications])
+
+@bp.route('/api/notifications/read', methods=['POST'])
+def read_notifications():
+    """将通知标记为已读"""
+    Notification.query.filter_by(user_id=current_user.id, is_read=False)\
+                      .update({'is_read': True}, synchronize_session=False)
+    db.session.commit()
+    return jsonify({'success': True})
+
+# ==================== 选课志愿 ====================
+@bp.route('/api/preferences', methods=['GET', 'POST'])
+def api_preferences():
+    """选课志愿API：GET 查询，POST 按排序提交（覆盖所涉学期的原有志愿）"""
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    if not student:
+        return jsonify({'success': False, 'message': '学生信息不存在'})
+    
+    if request.method == 'POST':
+        if not current_app.config['PREFERENCE_WINDOW_OPEN']:
+            return jsonify({'success': False, 'message': '当前不在志愿填报时间'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        try:
+            assignment_ids = list(dict.fromkeys(int(i) for i in data.get('assignment_ids', [])))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': '课程参数错误'}), 400
+        
+        if not assignment_ids:
+            return jsonify({'success': False, 'message': '请选择课程'}), 400
+        if len(assignment_ids) > current_app.config['PREFERENCE_MAX']:
+            return jsonify({'success': False, 'message': f"最多填报 {current_app.config['PREFERENCE_MAX']} 个志愿"}), 400
+        
+        terms = db.session.query(Assignment.assignment_id, Assignment.academic_year, Assignment.semester)\
+                          .filter(Assignment.assignment_id.in_(assignment_ids)).all()
+        missing = set(assignment_ids) - {t.assignment_id for t in terms}
+        if missing:
+            return jsonify({'success': False, 'message': f'课程不存在：{sorted(missing)}'}), 400
+        
+        try:
+            for academic_year, semester in {(t.academic_year, t.semester) for t in terms}:
+                term_ids = db.session.query(Assignment.assignment_id).filter_by(
+                    academic_year=academic_year, semester=semester)
+                Preference.query.filter(Preference.student_id == student.student_id,
+                                        Preference.assignment_id.in_(term_ids))\
+                                .delete(synchronize_session=False)
+            db.session.add_all([
+                Preference(student_id=student.student_id, assignment_id=assignment_id, rank=rank)
+                for rank, assignment_id in enumerate(assignment_ids, start=1)
+            ])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': f'提交失败：{str(e)}'})
+        
+        return jsonify({'success': True, 'message': f'已提交 {len(assignment_ids)} 个志愿'})
+    
+    preferences = db.session.query(Preference.assignment_id, Preference.rank,
+                                   Course.course_name, Assignment.academic_year, Assignment.semester)\
+                            .join(Assignment, Preference.assignment_id == Assignment.assignment_id)\
+                            .join(Course, Assignment.course_id == Course.course_id)\
+                            .filter(Preference.student_id == student.student_id)\
+                            .order_by(Assignment.academic_year, Assignment.semester, Preference.rank).all()
+    return jsonify([{
+        'assignment_id': p.assignment_id,
+        'rank': p.rank,
+        'course_name': p.course_name,
+        'academic_year': p.academic_year,
+        'semester': p.semester
+    } for p in preferences])
+
 # ==================== 我的课程 ====================
 @bp.route('/my_courses')
 def my_courses():
@@ -279,25 +506,20 @@ def grades():
     # 修复排序错误
     selections = Selection.query.filter_by(student_id=student.student_id)\
                                .join(Assignment)\
+                               .options(contains_eager(Selection.assignment).joinedload(Assignment.course))\
                                .order_by(
                                    Assignment.academic_year.desc(),
                                    Assignment.semester.desc()
                                ).all()
     
-    # 计算统计信息
-    graded_selections = [s for s in selections if s.total_grade is not None]
-    stats = {
-        'total_courses': len(selections),
-        'graded_courses': len(graded_selections),
-        'passed_courses': len([s for s in graded_selections if s.total_grade >= 60]),
-        'total_credits': sum(s.assignment.course.credits or 0 for s in graded_selections if s.total_grade >= 60),
-        'gpa': calculate_gpa(selections)
-    }
+    # 统计信息
+    stats = summary.get(student.student_id)
     
     return render_template('student/grades.html', 
                           student=student, 
                           selections=selections,
-                          stats=stats)
+                          stats=stats,
+                          term_stats=summary.terms(student.student_id))
 
 # ==================== 成绩详情 ====================
 @bp.route('/grades/<int:selection_id>')
@@ -322,58 +544,106 @@ def api_my_grades():
     if not student:
         return jsonify([])
     
-    selections = Selection.query.filter_by(student_id=student.student_id).all()
-    result = []
+    return jsonify(transcript.transcript(student.student_id))
+
+@bp.route('/api/ranking')
+def api_ranking():
+    """本人在同系部同年级中的 GPA 排名API"""
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    if not student:
+        return jsonify({'error': '学生信息不存在'}), 404
     
-    for selection in selections:
-        if selection.total_grade is not None:
-            result.append({
-                'course_name': selection.assignment.course.course_name,
-                'academic_year': selection.assignment.academic_year,
-                'semester': selection.assignment.semester,
-                'usual_grade': selection.usual_grade,
-                'final_grade': selection.final_grade,
-                'total_grade': selection.total_grade,
-                'credits': selection.assignment.course.credits or 0
-            })
+    cohort_rank = ranking.get(student)
+    if cohort_rank is None:
+        return jsonify({'ranked': False, 'message': '暂无成绩，未参与排名'})
+    cohort_rank['ranked'] = True
+    return jsonify(cohort_rank)
+
+@bp.route('/api/timetable')
+def api_timetable():
+    """课表API（含时间冲突标记）"""
+    student = Student.query.filter_by(user_id=current_user.id).first()
+    if not student:
+        return jsonify([])
+    
+    query = db.session.query(Selection.assignment_id, Assignment.academic_year, Assignment.semester,
+                             Assignment.class_time, Assignment.location, Course.course_name)\
+                      .join(Assignment, Selection.assignment_id == Assignment.assignment_id)\
+                      .join(Course, Assignment.course_id == Course.course_id)\
+                      .filter(Selection.student_id == student.student_id)
+    academic_year = request.args.get('academic_year')
+    semester = request.args.get('semester')
+    if academic_year:
+        query = query.filter(Assignment.academic_year == academic_year)
+    if semester:
+        query = query.filter(Assignment.semester == semester)
+    rows = query.all()
+    
+    masks = load_masks([row.assignment_id for row in rows])
+    result = []
+    for row in rows:
+        mask = masks.get(row.assignment_id, EMPTY)
+        conflicts = [
+            other.assignment_id for other in rows
+            if other.assignment_id != row.assignment_id
+            and (other.academic_year, other.semester) == (row.academic_year, row.semester)
+            and mask.conflicts(masks.get(other.assignment_id, EMPTY))
+        ]
+        result.append({
+            'assignment_id': row.assignment_id,
+            'course_name': row.course_name,
+            'academic_year': row.academic_year,
+            'semester': row.semester,
+            'class_time': row.class_time,
+            'location': row.location,
+            'slots': [{'weekday': weekday + 1, 'periods': periods, 'weeks': weeks}
+                      for weekday, periods, weeks in iter_slots(mask)],
+            'conflicts': conflicts
+        })
     
     return jsonify(result)
 
 @bp.route('/api/available_courses')
 def api_available_courses():
-    """可选课程API"""
+    """可选课程API（默认当前学期，支持 ETag 条件请求）"""
     student = Student.query.filter_by(user_id=current_user.id).first()
     if not student:
         return jsonify([])
     
-    # 获取学生已选的课程ID
-    selected_assignments = Selection.query.filter_by(student_id=student.student_id).all()
-    selected_ids = [s.assignment_id for s in selected_assignments]
+    academic_year = request.args.get('academic_year', current_app.config['CURRENT_ACADEMIC_YEAR'])
+    semester = request.args.get('semester', current_app.config['CURRENT_SEMESTER'])
+    digest, rows = catalog.get(academic_year, semester)
     
-    # 获取所有课程
-    all_assignments = Assignment.query.all()
-    
-    result = []
-    for assignment in all_assignments:
-        # 排除已选课程
-        if assignment.assignment_id in selected_ids:
-            continue
-            
-        # 检查是否已满
-        is_full = assignment.enrollment_limit and len(assignment.selections) >= assignment.enrollment_limit
-        
-        result.append({
-            'assignment_id': assignment.assignment_id,
-            'course_name': assignment.course.course_name,
-            'teacher_name': assignment.teacher.name,
-            'academic_year': assignment.academic_year,
-            'semester': assignment.semester,
-            'class_time': assignment.class_time,
-            'location': assignment.location,
-            'current_enrollment': len(assignment.selections),
-            'enrollment_limit': assignment.enrollment_limit,
-            'is_full': is_full,
-            'credits': assignment.course.credits or 0
-        })
+    # 获取学生已选的课程ID
+    selected_ids = {row.assignment_id for row in db.session.query(Selection.assignment_id)
+                                                          .filter_by(student_id=student.student_id)}
+    
+    etag = hashlib.sha1(f"{digest}:{','.join(map(str, sorted(selected_ids)))}".encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    response = jsonify([row for row in rows if row['assignment_id'] not in selected_ids])
+    response.set_etag(etag)
+    return response
+
+@bp.route('/api/seats/stream')
+def seat_stream():
+    """选课人数实时推送（SSE）"""
+    subscriber = broadcaster.subscribe()
+    if subscriber is None:
+        return jsonify({'success': False, 'message': '连接数过多，请稍后再试'}), 503, {'Retry-After': '10'}
+    
+    # 长连接期间不占用数据库连接
+    db.session.remove()
+    keepalive = current_app.config['SEAT_STREAM_KEEPALIVE']
+    
+    def generate():
+        try:
+            yield from event_stream(subscriber, keepalive)
+        finally:
+            broadcaster.unsubscribe(subscriber)
     
-    return jsonify(result)
\ No newline at end of file
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
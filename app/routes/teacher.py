@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app, Response
 from flask_login import login_required, current_user
 from datetime import datetime
-from app import db
+from app import db, gradebook
 from app.models import Teacher, Assignment, Selection, Student, Course, User
 from app.forms import GradeForm
+from app.idempotency import idempotent
+from app.signals import track
+from app.analytics import analytics
 
 bp = Blueprint('teacher', __name__, url_prefix='/teacher')
 
@@ -82,7 +85,11 @@ def course_detail(assignment_id):
     
     return render_template('teacher/course_detail.html', 
                           assignment=assignment, 
-                          selections=selections)
+                          selections=selections,
+                          grade_stats=analytics.assignment(assignment_id),
+                          course_stats=analytics.course(assignment.course_id, 
+                                                        assignment.academic_year, 
+                                                        assignment.semester))
 
 # ==================== 录入/修改所授课程成绩 ====================
 @bp.route('/grades')
@@ -100,6 +107,7 @@ def grades():
     return render_template('teacher/grades.html', teacher=teacher, assignments=assignments)
 
 @bp.route('/grades/<int:assignment_id>', methods=['GET', 'POST'])
+@idempotent
 def grade_management(assignment_id):
     """成绩录入/修改"""
     assignment = Assignment.query.get_or_404(assignment_id)
@@ -116,21 +124,17 @@ def grade_management(assignment_id):
     
     if request.method == 'POST':
         try:
-            for selection in selections:
-                usual_key = f'usual_grade_{selection.selection_id}'
-                final_key = f'final_grade_{selection.selection_id}'
-                
-                if usual_key in request.form and request.form[usual_key]:
-                    selection.usual_grade = float(request.form[usual_key])
-                
-                if final_key in request.form and request.form[final_key]:
-                    selection.final_grade = float(request.form[final_key])
-                
-                selection.grade_time = datetime.utcnow()
-            
-            db.session.commit()
-            flash('成绩保存成功', 'success')
-            return redirect(url_for('teacher.grade_management', assignment_id=assignment_id))
+            # 只写入有变化的行
+            result = gradebook.import_grades(assignment_id, gradebook.form_sheet(selections, request.form))
+            if result['errors']:
+                db.session.rollback()
+                for error in result['errors'][:5]:
+                    flash(f"{error['student_id']}：{error['message']}", 'danger')
+                flash(f"共 {len(result['errors'])} 处错误，成绩未保存", 'danger')
+            else:
+                db.session.commit()
+                flash(f"成绩保存成功，更新 {result['updated']} 人" if result['updated'] else '成绩无变化', 'success')
+                return redirect(url_for('teacher.grade_management', assignment_id=assignment_id))
             
         except Exception as e:
             db.session.rollback()
@@ -140,6 +144,57 @@ def grade_management(assignment_id):
                           assignment=assignment, 
                           selections=selections)
 
+@bp.route('/grades/<int:assignment_id>/import', methods=['POST'])
+def import_grades(assignment_id):
+    """从 Excel/CSV 成绩表批量导入成绩"""
+    assignment = Assignment.query.get_or_404(assignment_id)
+    
+    if assignment.teacher.user_id != current_user.id:
+        flash('您没有权限管理此课程成绩', 'danger')
+        return redirect(url_for('teacher.grades'))
+    
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('请选择要导入的成绩表', 'warning')
+        return redirect(url_for('teacher.grade_management', assignment_id=assignment_id))
+    
+    try:
+        sheet = gradebook.read_sheet(upload.stream, upload.filename, current_app.config['GRADE_IMPORT_MAX_ROWS'])
+        result = gradebook.import_grades(assignment_id, sheet)
+        if not result['errors']:
+            db.session.commit()
+            flash(f"导入完成：共 {result['rows']} 行，更新 {result['updated']} 人，"
+                  f"{result['unchanged']} 人无变化", 'success')
+            return redirect(url_for('teacher.grade_management', assignment_id=assignment_id))
+        db.session.rollback()
+        flash(f"成绩表有 {len(result['errors'])} 处错误，未导入任何成绩", 'danger')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'导入失败: {str(e)}', 'danger')
+        return redirect(url_for('teacher.grade_management', assignment_id=assignment_id))
+    
+    selections = Selection.query.filter_by(assignment_id=assignment_id)\
+                               .join(Student, Selection.student_id == Student.student_id)\
+                               .order_by(Student.name).all()
+    return render_template('teacher/grade_management.html', 
+                          assignment=assignment, 
+                          selections=selections,
+                          import_errors=result['errors'])
+
+@bp.route('/grades/<int:assignment_id>/import/template')
+def grade_import_template(assignment_id):
+    """下载成绩导入模板（CSV）"""
+    assignment = Assignment.query.get_or_404(assignment_id)
+    
+    if assignment.teacher.user_id != current_user.id:
+        flash('您没有权限管理此课程成绩', 'danger')
+        return redirect(url_for('teacher.grades'))
+    
+    data = gradebook.roster_template(assignment_id).to_csv(index=False).encode('utf-8-sig')
+    return Response(data, mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename=grades_{assignment_id}.csv'
+    })
+
 @bp.route('/grades/<int:selection_id>/edit', methods=['GET', 'POST'])
 def edit_grade(selection_id):
     """单个学生成绩编辑"""
@@ -156,6 +211,8 @@ def edit_grade(selection_id):
     if form.validate_on_submit():
         form.populate_obj(selection)
         selection.grade_time = datetime.utcnow()
+        selection.grade_version = (selection.grade_version or 0) + 1
+        track('grades', [assignment.assignment_id])
         
         try:
             db.session.commit()
@@ -264,11 +321,55 @@ def api_course_grades(assignment_id):
     
     for selection in selections:
         result.append({
+            'selection_id': selection.selection_id,
             'student_id': selection.student_id,
             'student_name': selection.student.name,
             'usual_grade': selection.usual_grade,
             'final_grade': selection.final_grade,
-            'total_grade': selection.total_grade
+            'total_grade': selection.total_grade,
+            'version': selection.grade_version
         })
     
-    return jsonify(result)
\ No newline at end of file
+    return jsonify(result)
+
+@bp.route('/api/course/<int:assignment_id>/analytics')
+def api_course_analytics(assignment_id):
+    """课程成绩分布API：本教学班及同课程同学期全部教学班"""
+    assignment = Assignment.query.get_or_404(assignment_id)
+    
+    if assignment.teacher.user_id != current_user.id:
+        return jsonify({'error': '无权限'}), 403
+    
+    return jsonify({
+        'assignment': analytics.assignment(assignment_id),
+        'course': analytics.course(assignment.course_id, assignment.academic_year, assignment.semester)
+    })
+
+@bp.route('/api/course/<int:assignment_id>/grades', methods=['PATCH'])
+def api_patch_grades(assignment_id):
+    """成绩增量保存API
+
+    请求体 {"changes": [{"selection_id", "version", "usual_grade"?, "final_grade"?}]}，
+    版本不一致的行不保存，在 conflicts 中返回其当前值。
+    """
+    assignment = Assignment.query.get_or_404(assignment_id)
+    
+    if assignment.teacher.user_id != current_user.id:
+        return jsonify({'error': '无权限'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    changes = data.get('changes')
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'error': '请求格式错误，需要 changes 列表'}), 400
+    if len(changes) > current_app.config['GRADE_IMPORT_MAX_ROWS']:
+        return jsonify({'error': '单次提交的成绩过多'}), 400
+    
+    try:
+        result = gradebook.apply_delta(assignment_id, changes)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'保存失败: {str(e)}'}), 500
+    
+    status = 409 if result['conflicts'] and not result['updated'] else 200
+    return jsonify(result), status
\ No newline at end of file
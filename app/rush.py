@@ -0,0 +1,229 @@
+"""选课高峰期"抢课模式"
+
+开启 ENROLLMENT_RUSH_MODE 后，选课请求不再各自开事务提交，而是进入进程内队列，
+由单独的写线程按 assignment_id 分批，每批在一个事务内完成名额分配与批量插入。
+请求处理函数拿到一张"选课凭证"（ticket），可在限定时间内等待结果，或稍后轮询。
+"""
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy import insert, update, func
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Assignment, Selection
+from app.schedule import load_masks, student_masks, EMPTY
+from app.signals import track
+from app.summary import add_courses
+from app.counters import adjust
+from app.rollup import add_selections
+
+# 批量插入遇到唯一约束冲突时最多尝试的次数
+ALLOCATE_ATTEMPTS = 3
+FAILURE_MESSAGE = '选课失败，请稍后重试'
+
+
+class RushTicket:
+    """选课凭证"""
+
+    def __init__(self, student_id, assignment_id):
+        self.ticket_id = uuid.uuid4().hex
+        self.student_id = student_id
+        self.assignment_id = assignment_id
+        self.status = 'pending'
+        self.message = '排队中'
+        self.course_name = None
+        self.created_at = time.monotonic()
+        self.resolved_at = None
+        self._done = threading.Event()
+
+    def resolve(self, success, message, course_name=None):
+        self.status = 'success' if success else 'failed'
+        self.message = message
+        self.course_name = course_name
+        self.resolved_at = time.monotonic()
+        self._done.set()
+
+    def wait(self, timeout):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        data = {
+            'ticket': self.ticket_id,
+            'assignment_id': self.assignment_id,
+            'status': self.status,
+            'message': self.message,
+        }
+        if self.status != 'pending':
+            data['success'] = self.status == 'success'
+        if self.course_name:
+            data['course_name'] = self.course_name
+        return data
+
+
+class RushGateway:
+    """进程内选课请求队列 + 批量写线程"""
+
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._tickets = {}
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def init_app(self, app):
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config['RUSH_QUEUE_SIZE'])
+
+    def submit(self, student_id, assignment_id):
+        """提交选课请求，队列已满时返回 None"""
+        ticket = RushTicket(student_id, assignment_id)
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(ticket)
+        except queue.Full:
+            return None
+        with self._lock:
+            self._tickets[ticket.ticket_id] = ticket
+        return ticket
+
+    def get(self, ticket_id):
+        with self._lock:
+            return self._tickets.get(ticket_id)
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name='rush-writer', daemon=True)
+                self._writer.start()
+
+    # ==================== 写线程 ====================
+    def _run(self):
+        batch_size = self.app.config['RUSH_BATCH_SIZE']
+        batch_window = self.app.config['RUSH_BATCH_WINDOW']
+
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + batch_window
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            groups = {}
+            for ticket in batch:
+                groups.setdefault(ticket.assignment_id, []).append(ticket)
+
+            with self.app.app_context():
+                for assignment_id, tickets in groups.items():
+                    self._allocate(assignment_id, tickets)
+                db.session.remove()
+
+            self._prune()
+
+    def _allocate(self, assignment_id, tickets):
+        """为同一教学任务的一批请求分配名额
+
+        其他进程（或普通模式的请求）可能同时为同一学生插入了选课记录，批量插入因唯一约束失败时
+        回滚并重新检查已选情况后再分配一次，冲突的学生在重试中按"已选"拒绝，不影响同批其他学生。
+        """
+        for attempt in range(ALLOCATE_ATTEMPTS):
+            try:
+                outcome = self._try_allocate(assignment_id, tickets)
+                break
+            except IntegrityError:
+                db.session.rollback()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('抢课批次写入失败（教学任务 %s）', assignment_id)
+                outcome = None
+                break
+        else:
+            self.app.logger.error('抢课批次多次遇到选课记录冲突（教学任务 %s）', assignment_id)
+            outcome = None
+
+        if outcome is None:
+            for ticket in tickets:
+                ticket.resolve(False, FAILURE_MESSAGE)
+            return
+        course_name, accepted, rejected = outcome
+        for ticket in accepted:
+            ticket.resolve(True, f'成功选择：{course_name}', course_name)
+        for ticket, message in rejected:
+            ticket.resolve(False, message)
+
+    def _try_allocate(self, assignment_id, tickets):
+        """在一个事务内分配名额并写入，返回 (课程名, 录取的凭证, [(凭证, 原因)])"""
+        assignment = Assignment.query.filter_by(assignment_id=assignment_id)\
+                                     .with_for_update().first()
+        if not assignment:
+            db.session.rollback()
+            return None, [], [(ticket, '课程不存在') for ticket in tickets]
+
+        course_name = assignment.course.course_name
+        student_ids = {t.student_id for t in tickets}
+        selected = {
+            row.student_id for row in db.session.query(Selection.student_id).filter(
+                Selection.assignment_id == assignment_id,
+                Selection.student_id.in_(student_ids)
+            )
+        }
+
+        mask = load_masks([assignment_id]).get(assignment_id, EMPTY)
+        taken = student_masks(student_ids, assignment.academic_year, assignment.semester) if mask else {}
+
+        if assignment.enrollment_limit:
+            seats = max(assignment.enrollment_limit - (assignment.current_enrollment or 0), 0)
+        else:
+            seats = len(tickets)
+
+        accepted, rejected = [], []
+        for ticket in tickets:
+            if ticket.student_id in selected:
+                rejected.append((ticket, '您已经选择了该课程'))
+            elif mask.conflicts(taken.get(ticket.student_id, EMPTY)):
+                rejected.append((ticket, '与已选课程上课时间冲突'))
+            elif len(accepted) >= seats:
+                rejected.append((ticket, '该课程已满员'))
+            else:
+                accepted.append(ticket)
+                selected.add(ticket.student_id)
+
+        if accepted:
+            now = datetime.utcnow()
+            db.session.execute(insert(Selection), [
+                {'student_id': t.student_id, 'assignment_id': assignment_id, 'selection_time': now}
+                for t in accepted
+            ])
+            db.session.execute(
+                update(Assignment)
+                .where(Assignment.assignment_id == assignment_id)
+                .values(current_enrollment=func.coalesce(Assignment.current_enrollment, 0) + len(accepted))
+                .execution_options(synchronize_session=False)
+            )
+            track('seats', [assignment_id])
+            add_courses({(t.student_id, assignment_id): 1 for t in accepted})
+            adjust('selections', len(accepted))
+            add_selections({assignment_id: len(accepted)})
+        db.session.commit()
+        return course_name, accepted, rejected
+
+    def _prune(self):
+        """清理过期凭证"""
+        ttl = self.app.config['RUSH_TICKET_TTL']
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, t in self._tickets.items()
+                       if t.resolved_at is not None and now - t.resolved_at > ttl]
+            for key in expired:
+                del self._tickets[key]
+
+
+gateway = RushGateway()
@@ -0,0 +1,201 @@
+"""上课时间解析与冲突检测
+
+Assignment.class_time 为自由文本，例如 "周一 1-2节 1-16周，周三 3-4节 单周"。
+解析后每个时间段表示为 (星期, 节次位图, 周次位图)，保存在 assignment_slot 表中，
+冲突检测只需对位图做按位与。
+"""
+import re
+from sqlalchemy import event, delete, insert
+from app import db
+from app.models import Assignment, AssignmentSlot, Selection
+
+PERIODS_PER_DAY = 16
+MAX_WEEKS = 30
+ALL_WEEKS = (1 << MAX_WEEKS) - 1
+
+WEEKDAY_NAMES = {'一': 0, '二': 1, '三': 2, '四': 3, '五': 4, '六': 5, '日': 6, '天': 6}
+
+_WEEKDAY_RE = re.compile(r'(?:周|星期|礼拜)([一二三四五六日天])')
+_PERIOD_RE = re.compile(r'第?(\d{1,2})(?:\s*[-~～至到]\s*(\d{1,2}))?\s*节')
+_WEEK_RE = re.compile(r'第?(\d{1,2})(?:\s*[-~～至到]\s*(\d{1,2}))?\s*周')
+_ODD_RE = re.compile(r'单周?|\(单\)|（单）')
+_EVEN_RE = re.compile(r'双周?|\(双\)|（双）')
+
+
+def _range_mask(start, end, limit=PERIODS_PER_DAY):
+    """第 start 至 end 项（从 1 开始）对应的位图"""
+    start, end = int(start), int(end or start)
+    if start > end:
+        start, end = end, start
+    mask = 0
+    for i in range(max(start, 1), min(end, limit) + 1):
+        mask |= 1 << (i - 1)
+    return mask
+
+
+def _parse_weeks(text):
+    """解析周次，未注明时返回 None"""
+    mask = 0
+    for m in _WEEK_RE.finditer(text):
+        mask |= _range_mask(m.group(1), m.group(2), limit=MAX_WEEKS)
+    if _ODD_RE.search(text):
+        mask = (mask or ALL_WEEKS) & int('01' * (MAX_WEEKS // 2), 2)
+    elif _EVEN_RE.search(text):
+        mask = (mask or ALL_WEEKS) & int('10' * (MAX_WEEKS // 2), 2)
+    return mask or None
+
+
+def parse_class_time(text):
+    """解析上课时间，返回 [(weekday, period_mask, week_mask), ...]，无法解析时返回空列表"""
+    if not text:
+        return []
+
+    matches = list(_WEEKDAY_RE.finditer(text))
+    if not matches:
+        return []
+
+    # 第一个星期之前出现的周次作为默认周次，如 "1-16周 周一1-2节 周三3-4节"
+    default_weeks = _parse_weeks(text[:matches[0].start()]) or ALL_WEEKS
+
+    slots = []
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        segment = text[m.end():end]
+        period_mask = 0
+        for pm in _PERIOD_RE.finditer(segment):
+            period_mask |= _range_mask(pm.group(1), pm.group(2))
+        if not period_mask:
+            continue
+        # 去掉节次后再解析周次，"1-2节 1-16周" 与 "1-16周 1-2节" 均可
+        week_text = _PERIOD_RE.sub('', segment)
+        slots.append((WEEKDAY_NAMES[m.group(1)], period_mask, _parse_weeks(week_text) or default_weeks))
+    return slots
+
+
+class ScheduleMask:
+    """一组上课时间段的位图表示
+
+    节次位图按星期平移后合并为一个整数：bit = weekday * PERIODS_PER_DAY + (节次 - 1)。
+    union 为所有时间段的合并位图，用于快速排除不冲突的情况。
+    """
+    __slots__ = ('segments', 'union')
+
+    def __init__(self, segments=()):
+        self.segments = tuple(segments)
+        union = 0
+        for slot_bits, _ in self.segments:
+            union |= slot_bits
+        self.union = union
+
+    @classmethod
+    def from_slots(cls, slots):
+        return cls((period_mask << (weekday * PERIODS_PER_DAY), week_mask)
+                   for weekday, period_mask, week_mask in slots)
+
+    def __or__(self, other):
+        return ScheduleMask(self.segments + other.segments)
+
+    def __bool__(self):
+        return bool(self.union)
+
+    def conflicts(self, other):
+        if not self.union & other.union:
+            return False
+        for slot_bits, weeks in self.segments:
+            for other_bits, other_weeks in other.segments:
+                if slot_bits & other_bits and weeks & other_weeks:
+                    return True
+        return False
+
+
+EMPTY = ScheduleMask()
+
+
+def iter_slots(mask):
+    """将 ScheduleMask 还原为 (weekday, [节次...], [周次...]) 便于展示"""
+    day_mask = (1 << PERIODS_PER_DAY) - 1
+    for slot_bits, weeks in mask.segments:
+        for weekday in range(7):
+            periods = (slot_bits >> (weekday * PERIODS_PER_DAY)) & day_mask
+            if periods:
+                yield (weekday,
+                       [i + 1 for i in range(PERIODS_PER_DAY) if periods >> i & 1],
+                       [i + 1 for i in range(MAX_WEEKS) if weeks >> i & 1])
+
+
+# ==================== 时间段索引 ====================
+def _slot_rows(assignment_id, class_time):
+    return [
+        {'assignment_id': assignment_id, 'weekday': weekday,
+         'period_mask': period_mask, 'week_mask': week_mask}
+        for weekday, period_mask, week_mask in parse_class_time(class_time)
+    ]
+
+
+def _reindex(connection, assignment_id, class_time):
+    connection.execute(delete(AssignmentSlot.__table__)
+                       .where(AssignmentSlot.assignment_id == assignment_id))
+    rows = _slot_rows(assignment_id, class_time)
+    if rows:
+        connection.execute(insert(AssignmentSlot.__table__), rows)
+
+
+@event.listens_for(Assignment, 'after_insert')
+def _index_new_assignment(mapper, connection, target):
+    _reindex(connection, target.assignment_id, target.class_time)
+
+
+@event.listens_for(Assignment, 'after_update')
+def _index_changed_assignment(mapper, connection, target):
+    if db.inspect(target).attrs.class_time.history.has_changes():
+        _reindex(connection, target.assignment_id, target.class_time)
+
+
+def rebuild_slot_index():
+    """根据 class_time 重建全部时间段索引，返回写入的时间段数"""
+    db.session.execute(delete(AssignmentSlot.__table__))
+    rows = []
+    for assignment_id, class_time in db.session.query(Assignment.assignment_id, Assignment.class_time):
+        rows.extend(_slot_rows(assignment_id, class_time))
+    if rows:
+        db.session.execute(insert(AssignmentSlot.__table__), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def _build_masks(rows, key):
+    slots = {}
+    for row in rows:
+        slots.setdefault(getattr(row, key), []).append((row.weekday, row.period_mask, row.week_mask))
+    return {k: ScheduleMask.from_slots(v) for k, v in slots.items()}
+
+
+def load_masks(assignment_ids):
+    """批量读取教学任务的时间位图，返回 {assignment_id: ScheduleMask}"""
+    if not assignment_ids:
+        return {}
+    rows = db.session.query(AssignmentSlot).filter(AssignmentSlot.assignment_id.in_(assignment_ids)).all()
+    return _build_masks(rows, 'assignment_id')
+
+
+def student_masks(student_ids, academic_year, semester):
+    """批量读取学生在指定学期已选课程的合并时间位图，返回 {student_id: ScheduleMask}"""
+    if not student_ids:
+        return {}
+    rows = db.session.query(
+        Selection.student_id, AssignmentSlot.weekday, AssignmentSlot.period_mask, AssignmentSlot.week_mask
+    ).join(AssignmentSlot, AssignmentSlot.assignment_id == Selection.assignment_id)\
+     .join(Assignment, Assignment.assignment_id == Selection.assignment_id)\
+     .filter(Selection.student_id.in_(student_ids),
+             Assignment.academic_year == academic_year,
+             Assignment.semester == semester).all()
+    return _build_masks(rows, 'student_id')
+
+
+def has_conflict(student_id, assignment):
+    """检查学生已选课程与该教学任务是否时间冲突"""
+    mask = load_masks([assignment.assignment_id]).get(assignment.assignment_id)
+    if not mask:
+        return False
+    taken = student_masks([student_id], assignment.academic_year, assignment.semester)
+    return mask.conflicts(taken.get(student_id, EMPTY))
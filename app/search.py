@@ -0,0 +1,259 @@
+"""学生、教师、课程、用户的搜索索引
+
+ilike('%q%') 无法使用索引，数据量大时每次搜索都是全表扫描。这里把被搜索的字段切分为词元
+写入 search_token 表（entity, token, entity_id），按词元走索引查找：
+
+- 前缀词元 "^" + 前 n 个字符（n ≤ PREFIX_MAX）
+- 单字与二元词元：每个字符，以及相邻两个字符（末尾补 "$"），如 "张伟" -> "张"、"伟"、"张伟"、"伟$"
+
+查询 q（已规范化）时取 q 的各个二元组（单个字符时取该字符）的倒排求交集作为候选，
+再取出候选的字段值逐个核对是否包含 q，因此结果与 ilike 一致，词元只负责缩小范围。
+倒排超过 CANDIDATE_LIMIT 说明查询区分度太低（如学号中常见的数字二元组、单字姓氏），
+此时：
+
+- 列表筛选：q 只有一两个字符时，其单字或二元词元的倒排恰好就是命中的记录，由数据库按该倒排的
+  子查询筛选；更长的 q 改按前缀词元 "^q" 查找，只返回以 q 开头的记录，前缀倒排不超过
+  CANDIDATE_LIMIT 时取回主键核对，否则同样以子查询筛选；
+- search() 取前缀倒排的前 CANDIDATE_LIMIT 条核对打分（前缀命中总排在仅包含的命中之前）。
+
+只有连前缀也没有命中时才退回 ilike 扫描。
+
+索引随 ORM 写入由 mapper 事件同步；绕过 ORM 的批量写入需调用 reindex()。
+"""
+import unicodedata
+from sqlalchemy import event, delete, insert, select, cast, func, or_
+from app import db
+from app.models import Student, Teacher, Course, User, SearchToken
+
+PREFIX_MAX = 12
+CANDIDATE_LIMIT = 2000
+CHUNK_SIZE = 2000
+
+# 实体 -> (模型, 主键, 被搜索的字段)，字段按排序时的优先级排列
+ENTITIES = {
+    'student': (Student, Student.student_id, (Student.student_id, Student.name)),
+    'teacher': (Teacher, Teacher.teacher_id, (Teacher.teacher_id, Teacher.name, Teacher.title)),
+    'course': (Course, Course.course_id, (Course.course_id, Course.course_name)),
+    'user': (User, User.id, (User.username, User.email)),
+}
+
+
+def normalize(text):
+    """全角转半角、转小写"""
+    return unicodedata.normalize('NFKC', str(text)).strip().lower() if text is not None else ''
+
+
+def tokens(values):
+    result = set()
+    for value in values:
+        text = normalize(value)
+        if not text:
+            continue
+        result.update('^' + text[:n] for n in range(1, min(len(text), PREFIX_MAX) + 1))
+        result.update(text)
+        padded = text + '$'
+        result.update(padded[i:i + 2] for i in range(len(text)))
+    return result
+
+
+def _token_rows(entity, entity_id, values):
+    return [{'entity': entity, 'token': token, 'entity_id': str(entity_id)} for token in tokens(values)]
+
+
+# ==================== 索引维护 ====================
+def reindex(entity, rows, connection=None):
+    """重写一批记录的词元，rows 为 [(主键, 各字段值...)]（在当前事务内，不提交）"""
+    connection = connection if connection is not None else db.session
+    table = SearchToken.__table__
+    for i in range(0, len(rows), CHUNK_SIZE):
+        chunk = rows[i:i + CHUNK_SIZE]
+        connection.execute(delete(table).where(table.c.entity == entity)
+                                        .where(table.c.entity_id.in_([str(row[0]) for row in chunk])))
+        token_rows = [token for row in chunk for token in _token_rows(entity, row[0], row[1:])]
+        if token_rows:
+            connection.execute(insert(table), token_rows)
+
+
+def _values(target, fields):
+    return tuple(getattr(target, field.key) for field in fields)
+
+
+def _listen(entity, model, key, fields):
+    table = SearchToken.__table__
+
+    @event.listens_for(model, 'after_insert')
+    def _index_new(mapper, connection, target):
+        reindex(entity, [(getattr(target, key.key),) + _values(target, fields)], connection)
+
+    @event.listens_for(model, 'after_update')
+    def _index_changed(mapper, connection, target):
+        state = db.inspect(target)
+        if not any(state.attrs[field.key].history.has_changes() for field in (key,) + fields):
+            return
+        # 主键被修改时删除旧主键的词元
+        old_keys = [str(value) for value in state.attrs[key.key].history.deleted if value is not None]
+        if old_keys:
+            connection.execute(delete(table).where(table.c.entity == entity)
+                                            .where(table.c.entity_id.in_(old_keys)))
+        reindex(entity, [(getattr(target, key.key),) + _values(target, fields)], connection)
+
+    @event.listens_for(model, 'after_delete')
+    def _unindex(mapper, connection, target):
+        connection.execute(delete(table).where(table.c.entity == entity)
+                                        .where(table.c.entity_id == str(getattr(target, key.key))))
+
+
+for _entity, (_model, _key, _fields) in ENTITIES.items():
+    _listen(_entity, _model, _key, _fields)
+
+
+def rebuild():
+    """重建全部搜索索引，返回写入的词元数"""
+    table = SearchToken.__table__
+    db.session.execute(delete(table))
+    count = 0
+    for entity, (model, key, fields) in ENTITIES.items():
+        rows = []
+        for row in db.session.query(key, *fields).order_by(key).yield_per(CHUNK_SIZE):
+            rows.extend(_token_rows(entity, row[0], row[1:]))
+            if len(rows) >= CHUNK_SIZE * 10:
+                db.session.execute(insert(table), rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            db.session.execute(insert(table), rows)
+            count += len(rows)
+    db.session.commit()
+    return count
+
+
+# ==================== 查询 ====================
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _posting_query(entity, token):
+    return select(SearchToken.entity_id).where(SearchToken.entity == entity, SearchToken.token == token)\
+        .order_by(SearchToken.entity_id).limit(CANDIDATE_LIMIT + 1)
+
+
+def _posting_size(entity, token):
+    """token 的倒排条数（最多数到 CANDIDATE_LIMIT + 1），只扫描索引、不取回主键"""
+    return db.session.scalar(select(func.count()).select_from(_posting_query(entity, token).subquery()))
+
+
+def _posting(entity, token, truncate=False):
+    """token 的倒排，超过 CANDIDATE_LIMIT 条时返回 None（truncate 为 True 时返回前 CANDIDATE_LIMIT 条）"""
+    ids = db.session.scalars(_posting_query(entity, token)).all()
+    if len(ids) > CANDIDATE_LIMIT:
+        if not truncate:
+            return None
+        ids = ids[:CANDIDATE_LIMIT]
+    return set(ids)
+
+
+def _prefix_token(q):
+    return '^' + q[:PREFIX_MAX]
+
+
+def _token_subquery(entity, token):
+    """token 倒排中的记录主键（子查询，由数据库按词元索引筛选）"""
+    key = ENTITIES[entity][1]
+    return select(cast(SearchToken.entity_id, key.type))\
+        .where(SearchToken.entity == entity, SearchToken.token == token)
+
+
+def _candidates(entity, q):
+    """可能包含 q 的记录主键；查询区分度太低时返回 None"""
+    grams = {q} if len(q) == 1 else {q[i:i + 2] for i in range(len(q) - 1)}
+    # 先数各倒排的条数，只取回不超过上限的倒排，从最短的开始求交集
+    sizes = sorted((size, gram) for gram in grams
+                   for size in [_posting_size(entity, gram)] if size <= CANDIDATE_LIMIT)
+    candidates = None
+    for _, gram in sizes:
+        ids = _posting(entity, gram)
+        candidates = ids if candidates is None else candidates & ids
+        if not candidates:
+            break
+    return candidates
+
+
+def _score(q, values):
+    """命中程度：字段完全相同 > 前缀 > 包含，排在前面的字段优先；不包含 q 时返回 None"""
+    best = None
+    for i, value in enumerate(values):
+        text = normalize(value)
+        if q not in text:
+            continue
+        score = (300 if text == q else 200 if text.startswith(q) else 100) - i * 10
+        best = score if best is None else max(best, score)
+    return best
+
+
+def _contains(fields, q):
+    return or_(*[field.ilike(f'%{_escape_like(q)}%', escape='\\') for field in fields])
+
+
+def _scan(entity, q, limit=None):
+    """按 ilike 扫描，返回 [(主键, 各字段值...)]"""
+    model, key, fields = ENTITIES[entity]
+    query = db.session.query(key, *fields).filter(_contains(fields, q))
+    return query.limit(limit).all() if limit else query.all()
+
+
+def _verify(entity, q, ids):
+    """取出候选的字段值并核对，返回包含 q 的记录 [(主键, 各字段值...)]"""
+    model, key, fields = ENTITIES[entity]
+    python_type = key.type.python_type
+    ids = [python_type(i) for i in ids]
+    rows = []
+    for i in range(0, len(ids), CHUNK_SIZE):
+        rows.extend(db.session.query(key, *fields).filter(key.in_(ids[i:i + CHUNK_SIZE])))
+    return [row for row in rows if _score(q, row[1:]) is not None]
+
+
+def _matches(entity, q):
+    """包含 q 的全部记录；区分度太低时返回 None"""
+    ids = _candidates(entity, q)
+    return None if ids is None else _verify(entity, q, ids)
+
+
+def search(entity, q, limit=20):
+    """按相关度排序的搜索结果 [{'id', 'values', 'score'}]"""
+    q = normalize(q)
+    if not q:
+        return []
+    rows = _matches(entity, q)
+    if rows is None:
+        rows = _verify(entity, q, _posting(entity, _prefix_token(q), truncate=True)) or None
+    if rows is None:
+        rows = _scan(entity, q, limit=CANDIDATE_LIMIT)
+    scored = [(_score(q, row[1:]), row) for row in rows]
+    scored = [(score, row) for score, row in scored if score is not None]
+    scored.sort(key=lambda item: (-item[0], str(item[1][0])))
+    return [{'id': row[0], 'values': list(row[1:]), 'score': score} for score, row in scored[:limit]]
+
+
+def matching(entity):
+    """列表筛选器：限定为搜索命中的记录，可与其他筛选器组合"""
+    model, key, fields = ENTITIES[entity]
+
+    def builder(query, value):
+        q = normalize(value)
+        if not q:
+            return query
+        rows = _matches(entity, q)
+        if rows is None and len(q) <= 2:
+            # 单字、二元词元的倒排恰好是包含 q 的全部记录
+            return query.filter(key.in_(_token_subquery(entity, q)))
+        if rows is None:
+            prefixed = _posting(entity, _prefix_token(q))
+            if prefixed is None:
+                query = query.filter(key.in_(_token_subquery(entity, _prefix_token(q))))
+                # 前缀词元只保存前 PREFIX_MAX 个字符，更长的查询仍需核对全文
+                return query.filter(_contains(fields, value)) if len(q) > PREFIX_MAX else query
+            rows = _verify(entity, q, prefixed) or None
+        if rows is None:
+            return query.filter(_contains(fields, value))
+        return query.filter(key.in_([row[0] for row in rows]))
+    return builder
@@ -0,0 +1,161 @@
+"""选课人数实时推送（Server-Sent Events）
+
+每个进程一个广播线程：本进程的选课变更通过 seats_changed 信号即时唤醒它，
+其他进程的变更通过按 updated_at 增量查询发现。每次只查询一次数据库，
+再把人数变化分发给所有订阅者，数据库读取量与客户端数量无关。
+
+每个订阅者的缓冲按 assignment_id 合并，只保留最新人数；缓冲超过上限时清空并
+通知客户端重新拉取目录（resync）。
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app import db
+from app.models import Assignment
+from app.signals import seats_changed
+
+
+class Subscriber:
+    """单个客户端的有界缓冲"""
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.overflow = False
+        self._cond = threading.Condition()
+
+    def push(self, updates):
+        with self._cond:
+            for item in updates:
+                self.pending.pop(item['assignment_id'], None)
+                self.pending[item['assignment_id']] = item
+            if len(self.pending) > self.max_pending:
+                self.pending.clear()
+                self.overflow = True
+            self._cond.notify()
+
+    def pop(self, timeout):
+        """等待并取出缓冲，返回 (updates, overflow)；超时返回 ([], False)"""
+        with self._cond:
+            if not self.pending and not self.overflow:
+                self._cond.wait(timeout)
+            updates = list(self.pending.values())
+            overflow = self.overflow
+            self.pending.clear()
+            self.overflow = False
+            return updates, overflow
+
+
+class SeatBroadcaster:
+    """进程内选课人数广播"""
+
+    def __init__(self):
+        self.app = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._hints = set()
+        self._counts = {}
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        seats_changed.connect(self._on_seats_changed, weak=False)
+
+    def subscribe(self):
+        """新增订阅者，超过上限时返回 None"""
+        with self._lock:
+            if len(self._subscribers) >= self.app.config['SEAT_STREAM_MAX_CLIENTS']:
+                return None
+            subscriber = Subscriber(self.app.config['SEAT_STREAM_BUFFER'])
+            self._subscribers.add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='seat-broadcaster', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _on_seats_changed(self, sender, assignment_ids=(), **kwargs):
+        # 提交回调中不能再查询数据库，只记录并唤醒广播线程
+        if not self._subscribers:
+            return
+        with self._lock:
+            self._hints.update(assignment_ids)
+        self._wake.set()
+
+    # ==================== 广播线程 ====================
+    def _run(self):
+        interval = self.app.config['SEAT_STREAM_POLL_INTERVAL']
+        since = datetime.utcnow() - timedelta(seconds=interval)
+
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._subscribers:
+                    # 无订阅者时退出，下次订阅再启动
+                    self._thread = None
+                    self._counts.clear()
+                    return
+                hints, self._hints = self._hints, set()
+
+            polled_at = datetime.utcnow()
+            try:
+                with self.app.app_context():
+                    updates = self._collect(hints, since)
+                    db.session.remove()
+            except Exception:
+                self.app.logger.exception('选课人数推送查询失败')
+                time.sleep(interval)
+                continue
+            # 秒级精度的 DATETIME 也不会漏掉同一秒内的更新，重复的由人数比较过滤
+            since = polled_at - timedelta(seconds=1)
+
+            if updates:
+                with self._lock:
+                    subscribers = list(self._subscribers)
+                for subscriber in subscribers:
+                    subscriber.push(updates)
+
+    def _collect(self, hints, since):
+        condition = Assignment.updated_at >= since
+        if hints:
+            condition = db.or_(condition, Assignment.assignment_id.in_(hints))
+        rows = db.session.query(
+            Assignment.assignment_id, Assignment.current_enrollment, Assignment.enrollment_limit
+        ).filter(condition).all()
+
+        updates = []
+        for assignment_id, current, limit in rows:
+            current = current or 0
+            if self._counts.get(assignment_id) == (current, limit):
+                continue
+            self._counts[assignment_id] = (current, limit)
+            updates.append({
+                'assignment_id': assignment_id,
+                'current_enrollment': current,
+                'enrollment_limit': limit,
+                'is_full': bool(limit) and current >= limit
+            })
+        return updates
+
+
+def event_stream(subscriber, keepalive):
+    """SSE 事件生成器"""
+    yield 'retry: 3000\n\n'
+    while True:
+        updates, overflow = subscriber.pop(keepalive)
+        if overflow:
+            yield 'event: resync\ndata: {}\n\n'
+        elif updates:
+            yield f"event: seats\ndata: {json.dumps(updates)}\n\n"
+        else:
+            yield ': keepalive\n\n'
+
+
+broadcaster = SeatBroadcaster()
@@ -0,0 +1,48 @@
+"""数据变更信号
+
+写操作在事务内用 track() 登记变更，事务提交后统一发送对应信号，回滚则丢弃，
+订阅方（缓存失效、推送等）因此只会看到已提交的数据。
+"""
+from flask import current_app, has_app_context
+from flask.signals import Namespace
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+
+_signals = Namespace()
+
+# 选课人数变化，参数 assignment_ids
+seats_changed = _signals.signal('seats-changed')
+# 成绩变化，参数 assignment_ids
+grades_changed = _signals.signal('grades-changed')
+# 教师、课程、学生、系部的增删改，参数 entities（见 app.typeahead）
+directory_changed = _signals.signal('directory-changed')
+
+_KINDS = {
+    'seats': (seats_changed, 'assignment_ids'),
+    'grades': (grades_changed, 'assignment_ids'),
+    'directory': (directory_changed, 'entities'),
+}
+
+
+def track(kind, ids, session=None):
+    """登记本事务内的变更"""
+    session = session if session is not None else db.session()
+    pending = session.info.setdefault('pending_changes', {})
+    pending.setdefault(kind, set()).update(ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch(session):
+    pending = session.info.pop('pending_changes', None)
+    if not pending:
+        return
+    sender = current_app._get_current_object() if has_app_context() else None
+    for kind, ids in pending.items():
+        signal, arg = _KINDS[kind]
+        signal.send(sender, **{arg: ids})
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('pending_changes', None)
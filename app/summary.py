@@ -0,0 +1,237 @@
+"""学生学业概况读模型
+
+student_summary / student_term_summary 保存每名学生（及每个学期）的选课门数、已获学分、GPA 等，
+仪表盘、成绩页按主键读取，不再逐条汇总选课记录。
+
+维护方式分两种，都在提交前、与选课或成绩写入同一事务内完成：
+
+- 选课、退选：未录成绩的选课记录只影响选课门数，以 total_courses = total_courses ± n 写入
+  总体与所在学期的概况行（按主键排序后 UPSERT），不重算成绩；
+- 成绩变化（以及有成绩的选课记录被删除）：用 app.transcript 只重算这些学生并覆盖其概况行，
+  GPA 有变化的学生所在的排名分组标记为待重算（见 app.ranking）。
+
+ORM 写入由 flush 事件自动登记。绕过 ORM 的批量写入需自行登记：批量选课（抢课模式、志愿抽签）
+调用 add_courses()，批量改成绩调用 mark_dirty()。
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, insert, delete, select, tuple_
+from sqlalchemy.orm import Session
+from app import db, transcript, ranking
+from app.models import Student, Selection, Assignment, StudentSummary, StudentTermSummary
+from app.upsert import upsert
+
+CHUNK_SIZE = 2000
+INT_FIELDS = ('total_courses', 'graded_courses', 'passed_courses')
+FIELDS = INT_FIELDS + ('total_credits', 'graded_credits', 'grade_points', 'gpa')
+# 这些属性变化时成绩统计随之变化，需要重算
+GRADE_ATTRIBUTES = ('usual_grade', 'final_grade', 'assignment_id', 'student_id')
+
+
+def mark_dirty(student_ids, session=None):
+    """登记本事务内成绩有变化、需要重算概况的学生"""
+    session = session if session is not None else db.session()
+    session.info.setdefault('dirty_students', set()).update(student_ids)
+
+
+def add_courses(changes, session=None):
+    """登记本事务内新增或删除的未录成绩的选课记录，changes 为 {(student_id, assignment_id): 增减门数}"""
+    session = session if session is not None else db.session()
+    session.info.setdefault('course_changes', Counter()).update(changes)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+    dirty, changes = set(), Counter()
+    for objects, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            if not isinstance(obj, Selection):
+                continue
+            # 已删除的行不能再加载过期属性，只读取对象上已有的值；成绩未加载时按有成绩处理
+            values = db.inspect(obj).dict
+            if values.get('usual_grade') is None and values.get('final_grade') is None \
+                    and ('usual_grade' in values or sign > 0):
+                changes[(values.get('student_id'), values.get('assignment_id'))] += sign
+            else:
+                dirty.add(values.get('student_id'))
+    for obj in session.dirty:
+        if isinstance(obj, Selection):
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in GRADE_ATTRIBUTES):
+                dirty.add(obj.student_id)
+
+    dirty.discard(None)
+    if dirty:
+        mark_dirty(dirty, session)
+    if changes:
+        add_courses(changes, session)
+
+
+@event.listens_for(Session, 'before_commit')
+def _refresh_dirty(session):
+    # before_commit 时尚未 flush，先 flush 以收集本事务的全部变更
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+    ids = session.info.pop('dirty_students', None) or set()
+    changes = session.info.pop('course_changes', None)
+    if changes:
+        # 要重算的学生已包含本事务的选课变化
+        _count_courses({key: n for key, n in changes.items() if n and key[0] not in ids}, session)
+    if ids:
+        refresh(ids, session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop('dirty_students', None)
+    session.info.pop('course_changes', None)
+
+
+def _count_courses(changes, session):
+    """按选课门数的增减更新总体与学期概况行；行按主键排序写入，并发事务以相同顺序加锁"""
+    if not changes:
+        return
+    assignment_ids = {assignment_id for _, assignment_id in changes}
+    terms = {row[0]: (row[1], row[2]) for row in session.execute(
+        select(Assignment.assignment_id, Assignment.academic_year, Assignment.semester)
+        .where(Assignment.assignment_id.in_(assignment_ids)))}
+    overall, by_term = Counter(), Counter()
+    for (student_id, assignment_id), n in changes.items():
+        if assignment_id in terms:
+            overall[student_id] += n
+            by_term[(student_id, *terms[assignment_id])] += n
+
+    now = datetime.utcnow()
+    upsert(session, StudentSummary.__table__,
+           [{'student_id': student_id, 'total_courses': n, 'updated_at': now}
+            for student_id, n in sorted(overall.items()) if n],
+           increment=('total_courses',), assign=('updated_at',))
+    upsert(session, StudentTermSummary.__table__,
+           [{'student_id': student_id, 'academic_year': year, 'semester': semester, 'total_courses': n,
+             'updated_at': now} for (student_id, year, semester), n in sorted(by_term.items()) if n],
+           increment=('total_courses',), assign=('updated_at',))
+
+    # 退选后没有课程的学期不再显示
+    emptied = [key for key, n in by_term.items() if n < 0]
+    if emptied:
+        table = StudentTermSummary.__table__
+        key_columns = tuple_(table.c.student_id, table.c.academic_year, table.c.semester)
+        for i in range(0, len(emptied), CHUNK_SIZE):
+            session.execute(delete(table).where(key_columns.in_(emptied[i:i + CHUNK_SIZE]))
+                                         .where(table.c.total_courses <= 0))
+
+
+def _rows(student_ids):
+    """重算一批学生，返回 (总体概况行, 分学期概况行)"""
+    df = transcript.compute(transcript.load(student_ids))
+    overall = transcript.summarize(df)
+    terms = transcript.summarize(df, by=('student_id', 'academic_year', 'semester'))
+    now = datetime.utcnow()
+
+    overall = overall.reindex(student_ids, fill_value=0)
+    overall.index.name = 'student_id'
+    return _records(overall, now), _records(terms, now)
+
+
+def _records(frame, now):
+    frame = frame.reset_index()
+    frame = frame.astype({field: int for field in INT_FIELDS})
+    frame = frame.astype({field: float for field in FIELDS if field not in INT_FIELDS})
+    frame['updated_at'] = now
+    columns = [name for name in frame.columns if name not in ('completed_courses',)]
+    return frame[columns].to_dict('records')
+
+
+def _write(student_ids, session, replace=True):
+    """重算并写入一批学生的概况，返回写入的总体概况行"""
+    existing = [row[0] for row in session.query(Student.student_id)
+                                         .filter(Student.student_id.in_(student_ids))]
+    if replace:
+        for model in (StudentTermSummary, StudentSummary):
+            session.execute(delete(model.__table__).where(model.__table__.c.student_id.in_(student_ids)))
+    if not existing:
+        return []
+    summary_rows, term_rows = _rows(existing)
+    session.execute(insert(StudentSummary.__table__), summary_rows)
+    if term_rows:
+        session.execute(insert(StudentTermSummary.__table__), term_rows)
+    return summary_rows
+
+
+def refresh(student_ids, session=None):
+    """重算指定学生的概况，GPA 有变化的学生所在排名分组标记为待重算（在当前事务内，不提交）"""
+    session = session if session is not None else db.session()
+    ids = sorted(student_ids)
+    changed = []
+    for i in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[i:i + CHUNK_SIZE]
+        before = {row[0]: (row[1], row[2]) for row in session.execute(
+            select(StudentSummary.student_id, StudentSummary.graded_courses, StudentSummary.gpa)
+            .where(StudentSummary.student_id.in_(chunk)))}
+        changed += [row['student_id'] for row in _write(chunk, session)
+                    if before.get(row['student_id'], (0, 0.0)) != (row['graded_courses'], row['gpa'])]
+    ranking.mark_dirty(changed, session)
+
+
+def get(student_id):
+    """读取学生概况，返回与模板 stats 对应的 dict；尚未建立概况时现场计算"""
+    summary = db.session.get(StudentSummary, student_id)
+    if summary is None:
+        return transcript.student_stats(student_id)
+    return {
+        'total_courses': summary.total_courses,
+        'graded_courses': summary.graded_courses,
+        'completed_courses': summary.graded_courses,
+        'passed_courses': summary.passed_courses,
+        'total_credits': summary.total_credits,
+        'gpa': summary.gpa
+    }
+
+
+def terms(student_id):
+    """学生分学期概况，按学年、学期倒序"""
+    return StudentTermSummary.query.filter_by(student_id=student_id)\
+                                   .order_by(StudentTermSummary.academic_year.desc(),
+                                             StudentTermSummary.semester.desc()).all()
+
+
+# ==================== 全量重建 ====================
+_worker_app = None
+
+
+def _rebuild_chunk(student_ids):
+    with _worker_app.app_context():
+        try:
+            count = len(_write(student_ids, db.session, replace=False))
+            db.session.commit()
+            return count
+        finally:
+            db.session.remove()
+
+
+def rebuild(workers=1, chunk_size=CHUNK_SIZE):
+    """清空并重建全部学生概况，workers > 1 时分块并行计算写入，返回学生数"""
+    global _worker_app
+    ids = [row[0] for row in db.session.query(Student.student_id).order_by(Student.student_id)]
+    db.session.execute(delete(StudentTermSummary.__table__))
+    db.session.execute(delete(StudentSummary.__table__))
+    ranking.mark_all_dirty()
+    db.session.commit()
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            _write(chunk, db.session, replace=False)
+            db.session.commit()
+        return len(ids)
+
+    # 子进程由 fork 继承应用对象；先释放连接池，避免父子进程共用数据库连接
+    _worker_app = current_app._get_current_object()
+    db.session.remove()
+    db.engine.dispose()
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        return sum(pool.map(_rebuild_chunk, chunks))
@@ -0,0 +1,163 @@
+"""成绩单与 GPA 计算
+
+一次联表查询取出选课记录的平时成绩、期末成绩与课程学分，转换为列式数据后用
+pandas/NumPy 向量化计算总评、绩点、获得学分与 GPA。单个学生与整个系部共用同一套计算，
+结果与 Selection.total_grade 的逐行计算一致。
+"""
+import numpy as np
+import pandas as pd
+from app import db
+from app.models import Selection, Assignment, Course, Student
+
+USUAL_WEIGHT = 0.3
+FINAL_WEIGHT = 0.7
+PASS_GRADE = 60
+# (总评下限, 绩点)，4.0 制
+GRADE_POINTS = ((90, 4.0), (80, 3.0), (70, 2.0), (60, 1.0))
+
+SUMMARY_FIELDS = ('total_courses', 'graded_courses', 'completed_courses', 'passed_courses',
+                  'total_credits', 'graded_credits', 'grade_points', 'gpa')
+COUNT_FIELDS = ('total_courses', 'graded_courses', 'completed_courses', 'passed_courses')
+
+
+def load(student_ids=None, dept_id=None, academic_year=None, semester=None, detail=False):
+    """读取选课记录为 DataFrame，一行对应一条选课
+
+    detail 为 True 时附带课程编号与名称，用于输出成绩单明细。
+    """
+    columns = [Selection.selection_id, Selection.student_id, Selection.assignment_id,
+               Assignment.academic_year, Assignment.semester,
+               Selection.usual_grade, Selection.final_grade, Course.credits]
+    if detail:
+        columns += [Course.course_id, Course.course_name]
+
+    query = db.session.query(*columns)\
+                      .join(Assignment, Selection.assignment_id == Assignment.assignment_id)\
+                      .join(Course, Assignment.course_id == Course.course_id)
+    if student_ids is not None:
+        query = query.filter(Selection.student_id.in_(list(student_ids)))
+    if dept_id:
+        query = query.join(Student, Selection.student_id == Student.student_id)\
+                     .filter(Student.dept_id == dept_id)
+    if academic_year:
+        query = query.filter(Assignment.academic_year == academic_year)
+    if semester:
+        query = query.filter(Assignment.semester == semester)
+
+    names = [c.key for c in columns]
+    return pd.DataFrame.from_records(query.all(), columns=names)
+
+
+def compute(df):
+    """在 DataFrame 上补充 total_grade、graded、passed、grade_point、earned_credits 列"""
+    usual = np.asarray(df['usual_grade'], dtype=float)
+    final = np.asarray(df['final_grade'], dtype=float)
+    credits = np.nan_to_num(np.asarray(df['credits'], dtype=float))
+
+    usual_missing, final_missing = np.isnan(usual), np.isnan(final)
+    weighted = np.round(usual * USUAL_WEIGHT + final * FINAL_WEIGHT, 2)
+    total = np.where(usual_missing, final, np.where(final_missing, usual, weighted))
+
+    graded = ~np.isnan(total)
+    with np.errstate(invalid='ignore'):
+        passed = graded & (total >= PASS_GRADE)
+        grade_point = np.select([total >= low for low, _ in GRADE_POINTS],
+                                [point for _, point in GRADE_POINTS], 0.0)
+
+    df['credits'] = credits
+    df['total_grade'] = total
+    df['graded'] = graded
+    df['passed'] = passed
+    df['grade_point'] = np.where(graded, grade_point, np.nan)
+    df['earned_credits'] = np.where(passed, credits, 0.0)
+    return df
+
+
+def summarize(df, by=('student_id',)):
+    """按 by 列分组汇总（默认按学生），返回以分组键为索引的 DataFrame（列见 SUMMARY_FIELDS）
+
+    graded_credits 为有成绩课程的学分合计，grade_points 为绩点×学分合计，gpa = grade_points / graded_credits。
+    """
+    by = list(by)
+    if df.empty:
+        index = pd.MultiIndex.from_arrays([[]] * len(by), names=by) if len(by) > 1 \
+            else pd.Index([], name=by[0])
+        return pd.DataFrame(columns=SUMMARY_FIELDS, index=index)
+
+    if len(by) == 1:
+        codes, keys = pd.factorize(df[by[0]])
+        index = pd.Index(keys, name=by[0])
+    else:
+        codes, index = pd.MultiIndex.from_frame(df[by]).factorize()
+        index.names = by
+    n = len(index)
+    graded = df['graded'].to_numpy()
+    credits = df['credits'].to_numpy()
+    graded_credits = np.where(graded, credits, 0.0)
+    points = np.where(graded, df['grade_point'].to_numpy() * credits, 0.0)
+
+    credit_sum = np.bincount(codes, weights=graded_credits, minlength=n)
+    point_sum = np.bincount(codes, weights=points, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gpa = np.where(credit_sum > 0, np.round(point_sum / credit_sum, 2), 0.0)
+
+    graded_courses = np.bincount(codes, weights=graded, minlength=n).astype(int)
+    return pd.DataFrame({
+        'total_courses': np.bincount(codes, minlength=n),
+        'graded_courses': graded_courses,
+        'completed_courses': graded_courses,
+        'passed_courses': np.bincount(codes, weights=df['passed'].to_numpy(), minlength=n).astype(int),
+        'total_credits': np.bincount(codes, weights=df['earned_credits'].to_numpy(), minlength=n),
+        'graded_credits': credit_sum,
+        'grade_points': point_sum,
+        'gpa': gpa,
+    }, index=index)
+
+
+def student_stats(student_id, **filters):
+    """单个学生的成绩统计，返回与模板 stats 对应的 dict"""
+    summary = summarize(compute(load([student_id], **filters)))
+    if student_id not in summary.index:
+        return {'total_courses': 0, 'graded_courses': 0, 'completed_courses': 0,
+                'passed_courses': 0, 'total_credits': 0, 'gpa': 0.0}
+    row = summary.loc[student_id]
+    stats = {field: int(row[field]) for field in COUNT_FIELDS}
+    stats['total_credits'] = float(row['total_credits'])
+    stats['gpa'] = float(row['gpa'])
+    return stats
+
+
+def transcript(student_id, graded_only=True):
+    """单个学生的成绩单明细，按选课顺序排列"""
+    df = compute(load([student_id], detail=True))
+    if graded_only:
+        df = df[df['graded']]
+    df = df.sort_values('selection_id')
+    return [{
+        'course_name': row.course_name,
+        'academic_year': row.academic_year,
+        'semester': row.semester,
+        'usual_grade': _optional(row.usual_grade),
+        'final_grade': _optional(row.final_grade),
+        'total_grade': _optional(row.total_grade),
+        'credits': float(row.credits)
+    } for row in df.itertuples(index=False)]
+
+
+def _optional(value):
+    return None if pd.isna(value) else float(value)
+
+
+def department_gpa(academic_year=None, semester=None):
+    """各系部学生平均 GPA（只统计有成绩的学生），返回 {dept_id: (平均GPA, 人数)}"""
+    summary = summarize(compute(load(academic_year=academic_year, semester=semester)))
+    summary = summary[summary['graded_courses'] > 0]
+    if summary.empty:
+        return {}
+    depts = pd.DataFrame.from_records(
+        db.session.query(Student.student_id, Student.dept_id).all(),
+        columns=['student_id', 'dept_id']
+    ).set_index('student_id')
+    grouped = summary[['gpa']].join(depts, how='inner').groupby('dept_id')['gpa']
+    means, sizes = grouped.mean(), grouped.size()
+    return {dept: (round(float(means[dept]), 2), int(sizes[dept])) for dept in means.index}
@@ -0,0 +1,120 @@
+"""输入联想（教师、课程、学生、系部）
+
+每个进程为每类对象在内存中保存一份前缀索引：编号、名称规范化后作为键排序存放，
+前缀查找用二分定位到第一个键后顺序读取，相当于一棵压平的前缀树，比逐字符的字典树
+省内存得多。索引在首次查询时建立；对象增删改提交后（directory_changed 信号）标记为过期，
+下一次查询时重建。其他进程的写入由 TYPEAHEAD_TTL 兜底。
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Teacher, Course, Student, Department
+from app.search import normalize
+from app.signals import directory_changed, track
+
+# 对象类型 -> (模型, 编号, 名称)，编号和名称都作为前缀键
+ENTITIES = {
+    'teacher': (Teacher, Teacher.teacher_id, Teacher.name),
+    'course': (Course, Course.course_id, Course.course_name),
+    'student': (Student, Student.student_id, Student.name),
+    'department': (Department, Department.dept_id, Department.dept_name),
+}
+_BY_MODEL = {model: entity for entity, (model, _, _) in ENTITIES.items()}
+
+
+def _label(key, name):
+    return f'{key} - {name}'
+
+
+class PrefixIndex:
+    """一类对象的前缀索引"""
+
+    def __init__(self, rows):
+        # rows 为 [(编号, 名称)]
+        self._ids = [row[0] for row in rows]
+        self._names = [row[1] for row in rows]
+        pairs = sorted((normalize(key), i) for i, row in enumerate(rows) for key in row if key)
+        self._keys = [key for key, _ in pairs]
+        self._refs = array('l', (i for _, i in pairs))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _option(self, i):
+        return {'id': self._ids[i], 'label': _label(self._ids[i], self._names[i])}
+
+    def lookup(self, prefix, limit):
+        """以 prefix 开头的对象，按键排序，完全匹配的键排在最前"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        result, seen = [], set()
+        for pos in range(bisect_left(self._keys, prefix), len(self._keys)):
+            if not self._keys[pos].startswith(prefix) or len(result) >= limit:
+                break
+            i = self._refs[pos]
+            if i not in seen:
+                seen.add(i)
+                result.append(self._option(i))
+        return result
+
+
+class Typeahead:
+    """按对象类型缓存的前缀索引"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def index(self, entity):
+        ttl = current_app.config['TYPEAHEAD_TTL']
+        entry = self._entries.get(entity)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+
+        model, key, name = ENTITIES[entity]
+        rows = db.session.execute(select(key, name)).all()
+        index = PrefixIndex(rows)
+        with self._lock:
+            self._entries[entity] = (time.monotonic(), index)
+        return index
+
+    def lookup(self, entity, prefix, limit=20):
+        return self.index(entity).lookup(prefix, limit)
+
+    def choices(self, entity, value, placeholder):
+        """表单下拉框的选项：只包含占位项和当前值（按主键读取），其余由前端按输入查询"""
+        model, key, name = ENTITIES[entity]
+        row = db.session.execute(select(key, name).where(key == value)).first() if value else None
+        return [('', placeholder)] + ([(row[0], _label(*row))] if row else [])
+
+    def exists(self, entity, value):
+        model = ENTITIES[entity][0]
+        return db.session.get(model, value) is not None
+
+    def invalidate(self, sender=None, entities=None, **kwargs):
+        with self._lock:
+            if entities is None:
+                self._entries.clear()
+                return
+            for entity in entities:
+                self._entries.pop(entity, None)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect(session, flush_context):
+    entities = {_BY_MODEL[type(obj)] for obj in chain(session.new, session.deleted) if type(obj) in _BY_MODEL}
+    entities.update(_BY_MODEL[type(obj)] for obj in session.dirty
+                    if type(obj) in _BY_MODEL and session.is_modified(obj, include_collections=False))
+    if entities:
+        track('directory', entities, session)
+
+
+typeahead = Typeahead()
+directory_changed.connect(typeahead.invalidate, weak=False)
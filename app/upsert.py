@@ -0,0 +1,31 @@
+"""按主键插入或更新（UPSERT）
+
+MySQL 用 INSERT ... ON DUPLICATE KEY UPDATE，SQLite / PostgreSQL 用 INSERT ... ON CONFLICT DO UPDATE。
+单条语句完成"不存在则插入、存在则更新"，并发事务首次写入同一主键时不会因唯一约束失败。
+"""
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from sqlalchemy.engine import Connection
+
+_INSERTS = {'mysql': mysql.insert, 'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def upsert(session, table, rows, increment=(), assign=()):
+    """以 executemany 写入 rows；主键已存在时 increment 中的列加上本行的值，assign 中的列改为本行的值
+
+    session 也可以是 Connection。
+    """
+    if not rows:
+        return
+    bind = session if isinstance(session, Connection) else session.get_bind()
+    dialect = bind.dialect.name
+    if dialect not in _INSERTS:
+        raise NotImplementedError(f'不支持的数据库: {dialect}')
+    statement = _INSERTS[dialect](table)
+    new = statement.inserted if dialect == 'mysql' else statement.excluded
+    values = {name: table.c[name] + new[name] for name in increment}
+    values.update({name: new[name] for name in assign})
+    if dialect == 'mysql':
+        statement = statement.on_duplicate_key_update(values)
+    else:
+        statement = statement.on_conflict_do_update(index_elements=list(table.primary_key.columns), set_=values)
+    session.execute(statement, rows)
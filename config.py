@@ -23,6 +23,74 @@ class Config:
     SQLALCHEMY_ECHO = True
 
     ITEMS_PER_PAGE = 20
+
+    # 每个进程的 WSGI 工作线程数，应与 gunicorn --threads 等部署参数一致
+    WSGI_THREADS = int(os.environ.get('WSGI_THREADS', '16'))
+
+    # 并发准入控制：容量取连接池连接数与工作线程数中较小者，教师、管理员各保留固定份额，
+    # 扣除留给登录等未受控请求与后台线程（抢课写线程、人数推送）的余量后其余归学生端；
+    # ADMISSION_LIMITS 可按蓝图显式覆盖推出的上限，如 {'student': 8}
+    ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1').lower() in ('1', 'true', 'yes')
+    ADMISSION_RESERVED = {'teacher': 2, 'admin': 2}
+    ADMISSION_HEADROOM = 3
+    ADMISSION_LIMITS = {}
+    ADMISSION_EXEMPT = ('student.seat_stream',)
+    ADMISSION_RETRY_AFTER = 5
+
+    # 当前学年学期
+    CURRENT_ACADEMIC_YEAR = os.environ.get('CURRENT_ACADEMIC_YEAR', '2023-2024')
+    CURRENT_SEMESTER = os.environ.get('CURRENT_SEMESTER', '1')
+    CATALOG_SNAPSHOT_TTL = 2.0
+
+    # 选课人数实时推送
+    SEAT_STREAM_MAX_CLIENTS = 2000
+    SEAT_STREAM_BUFFER = 500
+    SEAT_STREAM_POLL_INTERVAL = 1.0
+    SEAT_STREAM_KEEPALIVE = 15.0
+    CART_MAX_COURSES = 12
+
+    # 写请求幂等键
+    IDEMPOTENCY_TTL = 24 * 3600
+    IDEMPOTENCY_LRU_SIZE = 10000
+
+    # 志愿征集（抽签分配）
+    PREFERENCE_WINDOW_OPEN = os.environ.get('PREFERENCE_WINDOW_OPEN', '').lower() in ('1', 'true', 'yes')
+    PREFERENCE_MAX = 20
+
+    # 抢课模式：选课请求排队后由写线程批量提交
+    ENROLLMENT_RUSH_MODE = os.environ.get('ENROLLMENT_RUSH_MODE', '').lower() in ('1', 'true', 'yes')
+    RUSH_QUEUE_SIZE = 10000
+    RUSH_BATCH_SIZE = 200
+    RUSH_BATCH_WINDOW = 0.02
+    RUSH_WAIT_TIMEOUT = 3.0
+    RUSH_TICKET_TTL = 300
+
+    # 成绩批量导入
+    GRADE_IMPORT_MAX_ROWS = 5000
+
+    # 成绩分布统计缓存（本进程内成绩变化时立即失效）
+    ANALYTICS_CACHE_TTL = 300
+
+    # GPA 排名由后台线程按此间隔（秒）重算有成绩变化的分组
+    RANKING_REFRESH_INTERVAL = 60
+
+    # 统计页选课人次的缓冲写入间隔（秒）
+    ROLLUP_FLUSH_INTERVAL = 5
+
+    # 管理端列表：是否显示总数，总数按筛选条件缓存的秒数
+    ADMIN_LIST_COUNTS = True
+    ADMIN_COUNT_CACHE_TTL = 60
+
+    # 仪表盘总数缓存；表很大时可改用表统计信息估算（仅 MySQL）
+    COUNTERS_CACHE_TTL = 300
+    DASHBOARD_APPROXIMATE_COUNTS = False
+
+    # 输入联想索引（本进程内数据变化时立即失效）
+    TYPEAHEAD_TTL = 600
+
+    # 数据备份目录
+    BACKUP_FOLDER = os.environ.get('BACKUP_FOLDER', os.path.join(basedir, 'backups'))
+
     UPLOAD_FOLDER = os.path.join(basedir, 'app/static/uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
 
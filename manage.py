@@ -156,5 +156,169 @@ def sample_data():
             db.session.rollback()
             click.echo(f"❌ 错误: {e}")
 
+@cli.command(name='sync-enrollment')
+def sync_enrollment():
+    """按选课记录校准教学任务的已选人数"""
+    from app.enrollment import sync_enrollment_counts
+    with app.app_context():
+        fixed = sync_enrollment_counts()
+        click.echo(f"已校准 {fixed} 个教学任务的选课人数")
+
+@cli.command(name='rebuild-slots')
+def rebuild_slots():
+    """根据上课时间重建时间段索引"""
+    from app.schedule import rebuild_slot_index
+    with app.app_context():
+        count = rebuild_slot_index()
+        click.echo(f"已写入 {count} 个上课时间段")
+
+@cli.command(name='allocate-lottery')
+@click.option('--academic-year', required=True, help='学年，如 2023-2024')
+@click.option('--semester', required=True, help='学期')
+@click.option('--seed', type=int, required=True, help='随机种子（公开以便复核）')
+@click.option('--max-courses', type=int, default=None, help='每名学生最多分得的课程数')
+@click.option('--dry-run', is_flag=True, help='只计算不写入')
+def allocate_lottery(academic_year, semester, seed, max_courses, dry_run):
+    """按志愿抽签分配选课名额"""
+    from app.lottery import allocate
+    with app.app_context():
+        stats = allocate(academic_year, semester, seed, max_courses=max_courses, dry_run=dry_run)
+        click.echo(f"志愿数: {stats['preferences']}  学生数: {stats['students']}  轮数: {stats['rounds']}")
+        click.echo(f"分配成功: {stats['allocated']}  未分得课程的学生: {stats['unallocated_students']}")
+        click.echo(f"耗时: {stats['elapsed']:.2f}s" + ("（试运行，未写入）" if dry_run else ""))
+
+@cli.command(name='purge-idempotency')
+def purge_idempotency():
+    """清理过期的幂等键记录"""
+    from app.idempotency import purge_expired
+    with app.app_context():
+        click.echo(f"已删除 {purge_expired()} 条过期记录")
+
+@cli.command(name='rebuild-summaries')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, help='并行进程数')
+@click.option('--chunk-size', type=int, default=2000, help='每个进程每次处理的学生数')
+def rebuild_summaries(workers, chunk_size):
+    """重建学生学业概况（总体及分学期）"""
+    from app.summary import rebuild
+    with app.app_context():
+        count = rebuild(workers=workers, chunk_size=chunk_size)
+        click.echo(f"已重建 {count} 名学生的学业概况")
+
+@cli.command(name='rebuild-rankings')
+def rebuild_rankings():
+    """重新计算全部系部、年级的 GPA 排名"""
+    from app.ranking import rebuild
+    with app.app_context():
+        click.echo(f"已为 {rebuild()} 名学生计算排名")
+
+@cli.command(name='refresh-rankings')
+def refresh_rankings():
+    """重算有成绩变化的系部、年级的 GPA 排名（可由定时任务执行）"""
+    from app.ranking import refresh_dirty
+    with app.app_context():
+        click.echo(f"已重算 {refresh_dirty()} 个分组的排名")
+
+@cli.command(name='rebuild-search-index')
+def rebuild_search_index():
+    """重建学生、教师、课程、用户的搜索索引"""
+    from app.search import rebuild
+    with app.app_context():
+        click.echo(f"已写入 {rebuild()} 个搜索词元")
+
+@cli.command(name='rebuild-rollups')
+def rebuild_rollups():
+    """重算数据统计页的预聚合表（系部人数、课程学期选课人次）"""
+    from app.rollup import rebuild
+    with app.app_context():
+        click.echo(f"已写入 {rebuild()} 行统计数据")
+
+@cli.command(name='import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--skip-invalid', is_flag=True, help='跳过有错误的行，导入其余学生')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, help='为各账号口令散列的进程数')
+def import_students(path, skip_invalid, workers):
+    """从 .xlsx/.csv 名单批量导入学生（并创建用户账号）"""
+    from app.intake import import_students
+    with app.app_context(), open(path, 'rb') as stream:
+        result = import_students(stream, os.path.basename(path), skip_invalid=skip_invalid, workers=workers,
+                                 progress=lambda rows, imported: click.echo(f"已读取 {rows} 行，导入 {imported} 名"))
+        for error in result['errors']:
+            click.echo(f"第 {error['row']} 行（{error['student_id'] or '-'}）：{error['message']}", err=True)
+        if result['errors'] and not skip_invalid:
+            db.session.rollback()
+            raise click.ClickException(f"名单有 {len(result['errors'])} 行错误，未导入任何学生")
+        db.session.commit()
+        click.echo(f"已导入 {result['imported']} 名学生，跳过 {len(result['errors'])} 行")
+
+@cli.command(name='reset-passwords')
+@click.option('--role', type=click.Choice(['student', 'teacher']), help='只重置该角色的账号')
+@click.option('--username', multiple=True, help='只重置指定用户名的账号（可重复）')
+@click.option('--password', help='统一设置的新口令；不指定时为每个账号生成随机口令')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), help='随机口令写入的 CSV 文件')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, help='计算口令散列的进程数')
+def reset_passwords(role, username, password, output, workers):
+    """批量重置账号口令（不含管理员）"""
+    import csv
+    from app.passwords import reset_passwords, generate_password
+    if not (role or username):
+        raise click.UsageError('请指定 --role 或 --username')
+    if not password and not output:
+        raise click.UsageError('生成随机口令时须用 --output 指定保存口令的文件')
+    with app.app_context():
+        query = db.session.query(User.id, User.username).filter(User.role != 'admin')
+        if role:
+            query = query.filter(User.role == role)
+        if username:
+            query = query.filter(User.username.in_(username))
+        users = query.order_by(User.id).all()
+        passwords = [password or generate_password() for _ in users]
+        count = reset_passwords([user.id for user in users], passwords, workers=workers)
+        # 先把新口令写入文件并落盘再提交：文件写入失败时回滚，不会留下无人知道口令的账号
+        if output:
+            try:
+                with open(output, 'w', newline='', encoding='utf-8-sig') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['用户名', '新口令'])
+                    writer.writerows((user.username, new) for user, new in zip(users, passwords))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                db.session.rollback()
+                raise click.ClickException(f"写入 {output} 失败，口令未修改：{e}")
+        db.session.commit()
+        click.echo(f"已重置 {count} 个账号的口令" + (f"，新口令已写入 {output}" if output else ''))
+
+@cli.command(name='backup')
+@click.option('--incremental', is_flag=True, help='只备份上一次备份之后变化的行')
+def backup(incremental):
+    """备份业务数据（全量或增量）"""
+    from app.backup import create
+    with app.app_context():
+        manifest = create(incremental=incremental)
+        for table, info in manifest['tables'].items():
+            click.echo(f"{table}: {info['rows']} 行")
+        click.echo(f"备份 {manifest['name']} 已完成")
+
+@cli.command(name='list-backups')
+def list_backups():
+    """列出已完成的备份"""
+    from app.backup import list_backups
+    with app.app_context():
+        for manifest in list_backups():
+            rows = sum(table['rows'] for table in manifest['tables'].values())
+            base = f"，基准 {manifest['base']}" if manifest['base'] else ''
+            click.echo(f"{manifest['name']}  {rows} 行  {manifest['size'] // 1024} KB{base}")
+
+@cli.command(name='restore')
+@click.argument('name')
+@click.option('--workers', type=int, default=4, help='并行写入的连接数')
+@click.confirmation_option(prompt='恢复会清空现有数据，请确认 Web 服务已停止，确定继续吗？')
+def restore(name, workers):
+    """恢复到指定备份（增量备份会连同其基准备份一起套用；须先停止 Web 服务）"""
+    from app.backup import restore
+    with app.app_context():
+        counts = restore(name, workers=workers, progress=lambda table: click.echo(f"已恢复 {table}"))
+        click.echo(f"已恢复到备份 {name}，共 {sum(counts.values())} 行")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file